@@ -33,18 +33,46 @@ import numpy as np
 import math
 import smoothing
 from Pipeutils import Pipeutils
+from ReferenceAccumulator import ReferenceAccumulator
 
 
 class Calibration(object):
 
-    def __init__(self, smoothing_window_size=0):
+    def __init__(self, smoothing_window_size=0, smoothing_kernel='boxcar', nan_native=False,
+                 precision='float64'):
 
         # set calibration constants
         self.BB = .0132  # Ruze equation parameter
         self.UNDER_2GHZ_TAU_0 = 0.008
         self.SMOOTHING_WINDOW = smoothing_window_size
+        self.SMOOTHING_KERNEL = smoothing_kernel
         self.pu = Pipeutils()
 
+        # when True, blanked channels are nans in plain arrays rather than
+        #   masked values in numpy masked arrays
+        self.NAN_NATIVE = nan_native
+
+        # floating point type of the calibrated spectra in the block methods.
+        #   With float32, sums and weights are still computed in float64; the
+        #   spectra differ from a float64 calibration by at most about 1e-6
+        #   of the peak value of each spectrum.
+        self.PRECISION = np.dtype(precision)
+
+        # fractional channel shift interpolation kernels, see shift_spectra()
+        self._shift_kernels = {}
+
+    def blank_spectra(self, array):
+        """Blank the nans in spectra: masked array, or plain array when NAN_NATIVE"""
+        if self.NAN_NATIVE:
+            return self.pu.nan_array(array)
+        return self.pu.masked_array(array)
+
+    def to_precision(self, array):
+        """Convert spectra (plain or masked) to the calibration PRECISION"""
+        if array.dtype == self.PRECISION:
+            return array
+        return array.astype(self.PRECISION)
+
     # ------------- Unit methods: do not depend on any other pipeline methods
 
     def total_power(self, cal_on, cal_off, t_on, t_off):
@@ -64,6 +92,9 @@ class Calibration(object):
             The exposure time is the sum of the input exposure times.
 
         """
+        if self.NAN_NATIVE:
+            return (self.pu.nanmean((self.pu.nan_array(cal_on), self.pu.nan_array(cal_off)), axis=0),
+                    t_on + t_off)
         return np.ma.mean((cal_on, cal_off), axis=0), t_on + t_off
 
     def tsky_correction(self, tsky_sig, tsky_ref, spillover):
@@ -151,11 +182,11 @@ class Calibration(object):
            A = -0.023437  + \frac{1.0140}{\sin( \frac{pi}{180} * (elev + \frac{5.1774}{elev + 3.3543} )}
 
         Args:
-            zenith_opacity(float): Opacity at zenith based only on time.
-            elev(float): Elevation angle of integration or scan.
+            zenith_opacity(float or 1d array): Opacity at zenith based only on time.
+            elev(float or 1d array): Elevation angle of integration or scan.
 
         Returns:
-            float:
+            float or 1d array:
             Elevation-adjusted opacity
 
         .. testsetup::
@@ -170,7 +201,7 @@ class Calibration(object):
 
         """
         deg2rad = (math.pi/180)  # factor to convert degrees to radians
-        num_atmospheres = -0.023437 + 1.0140 / math.sin(deg2rad * (elev + 5.1774 / (elev + 3.3543)))
+        num_atmospheres = -0.023437 + 1.0140 / np.sin(deg2rad * (elev + 5.1774 / (elev + 3.3543)))
         corrected_opacity = zenith_opacity * num_atmospheres
 
         return corrected_opacity
@@ -180,7 +211,7 @@ class Calibration(object):
 
         Keyword arguments:
         freq_hz -- input frequency in Hz
-        where: tmp_c -- input ground temperature in Celsius
+        where: tmp_c -- input ground temperature(s) in Celsius
 
         Returns:
         air_temp_k -- output Air Temperature in Kelvin
@@ -240,7 +271,7 @@ class Calibration(object):
                 air_temp_k_A = term[0]
                 air_temp_k_B = term[1]
 
-        air_temp_k = air_temp_k_A + (air_temp_k_B * float(tmp_c))
+        air_temp_k = air_temp_k_A + (air_temp_k_B * np.asarray(tmp_c, dtype=float))
         return air_temp_k
 
     def zenith_opacity(self, coeffs, freq_ghz):
@@ -291,11 +322,15 @@ class Calibration(object):
         nchan = len(cal_off)
         low = int(.1 * nchan)
         high = int(.9 * nchan)
-        cal_off = (cal_off[low:high]).mean()
-        cal_on = (cal_on[low:high]).mean()
+        if self.NAN_NATIVE:
+            cal_off = self.pu.nanmean(self.pu.nan_array(cal_off)[low:high])
+            cal_on = self.pu.nanmean(self.pu.nan_array(cal_on)[low:high])
+        else:
+            cal_off = (cal_off[low:high]).mean()
+            cal_on = (cal_on[low:high]).mean()
         return np.float(tcal * (cal_off / (cal_on - cal_off)) + tcal / 2)
 
-    def antenna_temp(self, tsys, sig, ref, t_sig, t_ref):
+    def antenna_temp(self, tsys, sig, ref, t_sig, t_ref, ref_smoothed=False):
         r"""Calibrate a spectrum to units of antenna temperature.
 
         Args:
@@ -304,6 +339,8 @@ class Calibration(object):
             ref(1d array): Reference ("off") spectrum.
             t_sig(float): Exposure time of the signal spectrum.
             t_ref(float): Exposure time of the reference spectrum.
+            ref_smoothed(bool): True if *ref* has already been through \
+                *smooth_reference*, so it is not smoothed again.
 
         Returns:
             1d array or float:
@@ -321,108 +358,341 @@ class Calibration(object):
             reference spectrum.
 
         """
-        if self.SMOOTHING_WINDOW > 1:
-            ref = smoothing.boxcar(ref, self.SMOOTHING_WINDOW)
-            window_size = self.SMOOTHING_WINDOW
+        if ref_smoothed:
+            window_size = max(self.SMOOTHING_WINDOW, 1)
         else:
-            window_size = 1
-
-        ref = self.pu.masked_array(ref)
+            ref, window_size = self.smooth_reference(ref)
 
         spectrum = tsys * ((sig-ref)/ref)
         exposure_time = (t_sig * t_ref * window_size / (t_sig + t_ref*window_size))
         return spectrum, exposure_time
 
-    def _ta_fs_one_state(self, sigref_state, sigid, refid, scale):
+    def smooth_reference(self, ref):
+        r"""Smooth a reference spectrum with the reference smoothing kernel.
 
-        sig = sigref_state[sigid]['TP']
+        All the rows of a block are smoothed together, along the channel axis.
 
-        ref = sigref_state[refid]['TP']
-        ref_cal_on = sigref_state[refid]['cal_on']
-        ref_cal_off = sigref_state[refid]['cal_off']
+        Args:
+            ref(1d or 2d array): Reference ("off") spectrum, or a block of \
+                reference spectra with one spectrum per row.
 
-        tcal = ref_cal_off['TCAL'] * scale
+        Returns:
+            masked array, int:
+            The smoothed reference with NaNs masked (a plain array with NaNs \
+            when NAN_NATIVE), and the smoothing window \
+            size used to weight the exposure time (1 when not smoothing).
 
-        tsys = self.tsys(tcal,  ref_cal_on['DATA'],  ref_cal_off['DATA'])
+        """
+        if self.SMOOTHING_WINDOW > 1:
+            # smoothing sums are in float64
+            ref = self.to_precision(smoothing.smooth(ref, self.SMOOTHING_WINDOW, self.SMOOTHING_KERNEL))
+            window_size = self.SMOOTHING_WINDOW
+        else:
+            window_size = 1
 
-        a_temp_params = {'tsys': tsys, 'sig': sig, 'ref': ref,
-                         't_sig': sigref_state[sigid]['EXPOSURE'],
-                         't_ref': sigref_state[refid]['EXPOSURE']}
-        antenna_temp, exposure = self.antenna_temp(**a_temp_params)
+        return self.blank_spectra(ref), window_size
 
-        return antenna_temp, tsys, exposure
+    def prepare_references(self, references):
+        r"""Smooth and mask the averaged reference spectra once, for reuse.
 
-    def ta_fs(self, sigref_state, scale):
-        r"""Calibrate a frequency-switched integration to units of antenna temperature.
+        The references are the same for every integration calibrated
+        against them, and interpolating between two smoothed references
+        is the same as smoothing the interpolated reference, so each
+        reference only needs to be smoothed once.
 
         Args:
-            sigref_state(struct): A structure holding the noise diode off and on \
-                integrations (which are full rows from the FITS table, including the DATA column), \
-                a total power integration, FITS table row number and \
-                exposure time.
-            scale(float): A relative beam scaling factor.  Default is 1, or no scaling.
+            references(list): One or two (spectrum, tsys, timestamp, exposure) \
+                tuples for the averaged reference scans.
 
         Returns:
-            1d array, float, float:
-            An averaged spectrum calibrated to units of antenna temperature, \
-            a system temperature and a total exposure time for the spectrum.
+            list:
+            The same tuples, with each spectrum smoothed and masked.  Pass \
+            these to *calibrate_ps_block* with *smoothed=True*.
 
         """
+        prepared = []
+        for spectrum, tsys, timestamp, exposure in references:
+            spectrum = self.to_precision(spectrum)
+            spectrum, _ = self.smooth_reference(spectrum)
+            prepared.append((spectrum, tsys, timestamp, exposure))
 
-        ta0, tsys0, exposure0 = self._ta_fs_one_state(sigref_state, 0, 1, scale)
-        ta1, tsys1, exposure1 = self._ta_fs_one_state(sigref_state, 1, 0, scale)
+        return prepared
 
-        # shift in frequency
-        sig_centerfreq = sigref_state[0]['cal_off']['OBSFREQ']
-        ref_centerfreq = sigref_state[1]['cal_off']['OBSFREQ']
+    def tsys_block(self, tcal, cal_on, cal_off):
+        r"""Calculate the system temperature for each integration in a block.
+
+        Args:
+            tcal(1d array): Lab-measured receiver calibration temperature of each row.
+            cal_on(2d array): Spectra *with* noise diode applied, one per row.
+            cal_off(2d array): Spectra *without* noise diode applied, one per row.
 
-        sig_delta = sigref_state[0]['cal_off']['CDELT1']
-        channel_shift = -((sig_centerfreq-ref_centerfreq)/sig_delta)
+        Returns:
+            1d array:
+            The same values as calling *tsys* on each row.
 
-        # do integer channel shift to second spectrum
-        ta1_ishifted = np.roll(ta1, int(channel_shift))
+        """
+        nchan = cal_off.shape[-1]
+        low = int(.1 * nchan)
+        high = int(.9 * nchan)
+        if self.NAN_NATIVE:
+            cal_off = self.pu.nanmean(self.pu.nan_array(cal_off)[:, low:high], axis=1)
+            cal_on = self.pu.nanmean(self.pu.nan_array(cal_on)[:, low:high], axis=1)
+        else:
+            cal_off = self.pu.masked_array(cal_off)[:, low:high].mean(axis=1)
+            cal_on = self.pu.masked_array(cal_on)[:, low:high].mean(axis=1)
+        return np.array(tcal * (cal_off / (cal_on - cal_off)) + tcal / 2, dtype=float)
+
+    def _shift_kernel(self, nchan, fractional_shift):
+        """Return (cached) indices and offsets to reproduce np.interp for a fractional shift."""
+
+        key = (nchan, fractional_shift)
+        if key not in self._shift_kernels:
+            xxp = np.arange(nchan, dtype=float)
+            xxx = xxp - fractional_shift
+            left = np.searchsorted(xxp, xxx, side='right') - 1
+            # outside of the band np.interp takes the end channel values
+            interior = (left >= 0) & (left < nchan - 1)
+            left = left.clip(0, nchan - 1)
+            offset = xxx[interior] - xxp[left[interior]]
+            self._shift_kernels[key] = (left, interior, offset)
+
+        return self._shift_kernels[key]
+
+    def shift_spectra(self, spectra, channel_shift):
+        r"""Shift a block of spectra by a (possibly fractional) number of channels.
+
+        The same shift is applied to every row of the block.  The integer part is a roll with the channels that
+        wrap around blanked, the fractional part is a linear interpolation
+        that uses a kernel computed once for each shift.
+
+        Args:
+            spectra(2d array): Spectra to shift, one per row.
+            channel_shift(float): Number of channels to shift.
+
+        Returns:
+            2d masked array:
+            The shifted spectra, with NaNs masked (a plain array when NAN_NATIVE).
+
+        """
+        ishifted = np.roll(spectra, int(channel_shift), axis=1)
         if channel_shift > 0:
-            ta1_ishifted[:channel_shift] = float('nan')
+            ishifted[:, :int(channel_shift)] = float('nan')
         elif channel_shift < 0:
-            ta1_ishifted[channel_shift:] = float('nan')
+            ishifted[:, int(channel_shift):] = float('nan')
+
+        yyp = np.array(ishifted, dtype=self.PRECISION)
+        nchan = yyp.shape[1]
+        if nchan < 2:
+            return self.blank_spectra(yyp)
+
+        left, interior, offset = self._shift_kernel(nchan, channel_shift - int(channel_shift))
+
+        slopes = yyp[:, 1:] - yyp[:, :-1]
+        shifted = yyp[:, left]
+        # where a channel falls exactly on an input channel, take it as it
+        #  is, like np.interp, so a NaN slope to the next channel (NaN * 0)
+        #  does not blank it
+        shifted[:, interior] = np.where(offset == 0, shifted[:, interior],
+                                        slopes[:, left[interior]] * offset.astype(self.PRECISION) +
+                                        shifted[:, interior])
 
-        # do fractional channel shift
-        fractional_shift = channel_shift - int(channel_shift)
-        # doMessage(logger, msg.DBG, 'Fractional channel shift is',
-        #          fractional_shift)
-        xxp = range(len(ta1_ishifted))
-        yyp = ta1_ishifted
-        xxx = xxp-fractional_shift
+        return self.blank_spectra(shifted)
 
-        yyy = np.interp(xxx, xxp, yyp)
-        ta1_shifted = self.pu.masked_array(yyy)
+    def ta_fs_block(self, sigref_state, scale):
+        r"""Calibrate a block of frequency-switched integrations to units of antenna temperature.
 
-        exposures = np.array([exposure0, exposure1])
-        tsyss = np.array([tsys0, tsys1])
-        tas = [ta0, ta1_shifted]
+        The frequency throw is normally the same for every integration in a
+        scan, so the channel shift is computed once for each distinct
+        throw in the block and applied to all the rows that share it.
 
-        # average shifted spectra
-        ta = self.average_spectra(tas, tsyss, exposures)
+        Args:
+            sigref_state(list): Two dicts, for the signal and reference states, \
+                holding blocks of the noise diode on and off spectra ('cal_on', \
+                'cal_off') and 1d arrays of their exposure times ('t_on', 't_off') \
+                and of the 'TCAL', 'OBSFREQ' and 'CDELT1' values of the noise diode \
+                off rows.
+            scale(float): A relative beam scaling factor.  Default is 1, or no scaling.
+
+        Returns:
+            2d array, 1d array, 1d array:
+            The calibrated spectra, one per row, with the system temperature \
+            and exposure time of each row.
+
+        """
+        tps = []
+        exposures = []
+        for state in sigref_state:
+            tp, exposure = self.total_power(self.blank_spectra(state['cal_on']),
+                                            self.blank_spectra(state['cal_off']),
+                                            state['t_on'], state['t_off'])
+            tps.append(tp.astype(self.PRECISION))
+            exposures.append(exposure)
+
+        column = (len(exposures[0]), 1)
+
+        tas = []
+        tsyss = []
+        ta_exposures = []
+        for sigid, refid in ((0, 1), (1, 0)):
+            ref_state = sigref_state[refid]
+            tcal = np.asarray(ref_state['TCAL'], dtype=float) * scale
+            tsys = self.tsys_block(tcal, ref_state['cal_on'], ref_state['cal_off'])
+            ta, exposure = self.antenna_temp(tsys.reshape(column).astype(self.PRECISION), tps[sigid], tps[refid],
+                                             exposures[sigid], exposures[refid])
+            tas.append(ta)
+            tsyss.append(tsys)
+            ta_exposures.append(exposure)
+
+        # shift in frequency
+        channel_shifts = -((sigref_state[0]['OBSFREQ'] - sigref_state[1]['OBSFREQ']) / sigref_state[0]['CDELT1'])
+
+        nchan = tas[1].shape[1]
+        ta1_shifted = np.empty(tas[1].shape, dtype=self.PRECISION)
+        if not self.NAN_NATIVE:
+            ta1_shifted = np.ma.masked_array(ta1_shifted, mask=False)
+        for channel_shift in np.unique(channel_shifts):
+            rows = channel_shifts == channel_shift
+            ta1_shifted[rows] = self.shift_spectra(tas[1][rows], channel_shift)
+
+        # average shifted spectra, weighting as average_spectra() does
+        tsyss = np.array(tsyss)
+        ta_exposures = np.array(ta_exposures)
+        weights = self.make_weights(tsyss, ta_exposures)
+
+        if self.NAN_NATIVE:
+            ta = self.pu.nan_average([tas[0], ta1_shifted], weights[:, :, np.newaxis])
+        else:
+            specs = np.ma.masked_array(np.array([tas[0], ta1_shifted], dtype=float),
+                                       mask=[np.ma.getmaskarray(tas[0]), np.ma.getmaskarray(ta1_shifted)])
+            ww = weights[:, :, np.newaxis] * np.ma.masked_array(np.ones(specs.shape), specs.mask)
+            ta = np.ma.add.reduce(specs * ww, 0, dtype=float) / np.ma.add.reduce(ww, 0, dtype=float)
+        ta = self.to_precision(ta)
 
         # average tsys
-        tsys = self.average_tsys(tsyss, exposures)
+        tsys = self.average_tsys(tsyss, ta_exposures)
 
         # only sum the exposure if frequency switch is "in band" (i.e.
         # overlapping channels); otherwise use the exposure from the
         # first state only
-        if abs(channel_shift) < len(ta1):
-            exposure_sum = exposure0 + exposure1
-        else:
-            exposure_sum = exposure0
+        exposure_sum = np.where(np.abs(channel_shifts) < nchan,
+                                ta_exposures[0] + ta_exposures[1], ta_exposures[0])
 
         return ta, tsys, exposure_sum
 
+    def calibrate_ps_block(self, cal_on, cal_off, t_on, t_off, timestamps, references,
+                           units='ta', obsfreq=None, zenith_opacities=None,
+                           elevations=None, tambients=None, tsky_refs=None,
+                           spillover=.99, reference_eta_b=None, reference_eta_a=None,
+                           smoothed=False):
+        r"""Calibrate a block of position-switched integrations at once.
+
+        This applies the same steps as the per-integration methods
+        (*total_power*, *interpolate_by_time*, *antenna_temp*,
+        *tsky_correction*, *ta_star*, ...) to every row of a block, using
+        array operations over the whole block instead of a Python loop.
+
+        Args:
+            cal_on(2d array): Spectra *with* noise diode applied, one per row. \
+                None if the noise diode is not firing.
+            cal_off(2d array): Spectra *without* noise diode applied, one per row.
+            t_on(1d array): Exposure times of the *cal_on* spectra (None with *cal_on*).
+            t_off(1d array): Exposure times of the *cal_off* spectra.
+            timestamps(1d array): MJD timestamp of each row.
+            references(list): One or two (spectrum, tsys, timestamp, exposure) \
+                tuples for the averaged reference scans.  With two references, \
+                the reference spectrum and tsys are interpolated in time.
+            units(str): Calibration units: 'ta', 'tsrc', 'ta*', 'tmb' or 'jy'.
+            obsfreq(float): Observed frequency in Hz.  Needed for units other than 'ta'.
+            zenith_opacities(1d array): Zenith opacity for each row.  Needed for \
+                units other than 'ta'.
+            elevations(1d array): Elevation in degrees of each row.
+            tambients(1d array): Ambient temperature in Kelvin of each row.
+            tsky_refs(tuple): Sky brightness (tsky1, tsky2) of the references, \
+                or None to skip the sky brightness correction.
+            spillover(float): Spillover factor.
+            reference_eta_b(float): Reference main beam efficiency, for 'tmb'.
+            reference_eta_a(float): Reference aperture efficiency, for 'jy'.
+            smoothed(bool): True if the reference spectra come from \
+                *prepare_references* and are already smoothed.
+
+        Returns:
+            2d array, 1d array, 1d array:
+            The calibrated spectra, one per row, with the system temperature \
+            and exposure time of each row.
+
+        """
+        timestamps = np.asarray(timestamps, dtype=float)
+        nrows = len(timestamps)
+        column = (nrows, 1)  # shape to broadcast one value per row across channels
+
+        if cal_on is not None:
+            csig, sig_exposure = self.total_power(self.blank_spectra(cal_on),
+                                                  self.blank_spectra(cal_off),
+                                                  np.asarray(t_on), np.asarray(t_off))
+        else:
+            csig, sig_exposure = self.blank_spectra(cal_off), np.asarray(t_off)
+        csig = self.to_precision(csig)
+
+        ref_spectrum1, ref_tsys1, ref_timestamp1, ref_exposure1 = references[0]
+        if len(references) > 1:
+            ref_spectrum2, ref_tsys2, ref_timestamp2, ref_exposure2 = references[1]
+            # interpolation weights are computed in float64
+            aa1, aa2 = self.interpolation_weights(ref_timestamp1, ref_timestamp2,
+                                                  timestamps.reshape(column))
+            ref = (aa1.astype(self.PRECISION) * ref_spectrum1 +
+                   aa2.astype(self.PRECISION) * ref_spectrum2)
+            tsys = self.interpolate_by_time(ref_tsys1, ref_tsys2,
+                                            ref_timestamp1, ref_timestamp2,
+                                            timestamps)
+        else:
+            ref_exposure2 = None
+            ref = ref_spectrum1
+            tsys = np.ones(nrows) * ref_tsys1
+
+        if ref_exposure2:
+            ref_exposure = (ref_exposure1+ref_exposure2)/2.
+        else:
+            ref_exposure = ref_exposure1
+
+        spectra, exposure = self.antenna_temp(tsys.reshape(column).astype(self.PRECISION), csig, ref,
+                                              sig_exposure, ref_exposure, smoothed)
+
+        if units == 'ta':
+            return spectra, tsys, exposure
+
+        opacity_el = self.elevation_adjusted_opacity(np.asarray(zenith_opacities),
+                                                     np.asarray(elevations))
+
+        if tsky_refs is not None:
+            tsky1, tsky2 = tsky_refs
+            if tsky1 and tsky2:
+                tsky_ref = self.interpolate_by_time(tsky1, tsky2,
+                                                    references[0][2], references[1][2],
+                                                    timestamps)
+            else:
+                tsky_ref = tsky1
+
+            tsky_current = self.tsky(np.asarray(tambients), obsfreq, opacity_el)
+            tsky_correction = self.tsky_correction(tsky_current, tsky_ref, spillover)
+            spectra -= np.reshape(tsky_correction, column).astype(self.PRECISION)
+
+        if units in ('ta*', 'tmb', 'jy'):
+            spectra = self.ta_star(spectra, opacity=opacity_el.reshape(column).astype(self.PRECISION),
+                                   spillover=spillover)
+
+        if units == 'tmb':
+            spectra = spectra / self.main_beam_efficiency(reference_eta_b, obsfreq)
+        elif units == 'jy':
+            spectra = spectra / (2.85 * self.aperture_efficiency(reference_eta_a, obsfreq))
+
+        return spectra, tsys, exposure
+
     def ta_star(self, antenna_temp, opacity, spillover):
         r"""Calibrate a spectrum to units of **ta***.
 
         Args:
             antenna_temp(1d array): Spectrum calibrated to units of antenna temperature.
-            opacity(float): Elevation-adjusted atmospheric opacity.
+            opacity(float or column of floats): Elevation-adjusted atmospheric opacity.
             spillover(float): Correction factor for rear-spillover,	ohmic loss and blockage	efficiency.
 
         Returns:
@@ -486,10 +756,28 @@ class Calibration(object):
 
         """
 
+        aa1, aa2 = self.interpolation_weights(first_ref_timestamp, second_ref_timestamp,
+                                              integration_timestamp)
+        return aa1 * reference1 + aa2 * reference2
+
+    def interpolation_weights(self, first_ref_timestamp, second_ref_timestamp,
+                              integration_timestamp):
+        r"""Weights of the first and second values for *interpolate_by_time*.
+
+        Args:
+            first_ref_timestamp(float): First time.
+            second_ref_timestamp(float): Second time.
+            integration_timestamp(float or array): The time(s) for which we want a value.
+
+        Returns:
+            float or array, float or array:
+            The weights of the first and second values.
+
+        """
         time_btwn_ref_scans = float(second_ref_timestamp) - float(first_ref_timestamp)
         aa1 = (second_ref_timestamp - integration_timestamp) / time_btwn_ref_scans
         aa2 = (integration_timestamp - first_ref_timestamp) / time_btwn_ref_scans
-        return aa1 * reference1 + aa2 * reference2
+        return aa1, aa2
 
     def make_weights(self, tsyss, exposures):
         r"""Create weights for integration averaging.
@@ -542,6 +830,10 @@ class Calibration(object):
         """
         weights = self.make_weights(tsyss, exposures)
 
+        if self.NAN_NATIVE:
+            weights = np.reshape(weights, (len(specs),) + (1,) * (np.ndim(specs[0])))
+            return self.pu.nan_average([self.pu.nan_array(spec) for spec in specs], weights)
+
         if float('nan') in specs[0] or float('nan') in specs[1]:
 
             weight0 = np.ma.array([weights[0]] * len(specs[0]), mask=specs[0].mask)
@@ -569,36 +861,23 @@ class Calibration(object):
 
         """
 
-        # convert to numpy arrays
-        crefs = np.array(crefs)
-        tsyss = np.array(tsyss)
-        exposures = np.array(exposures)
-        timestamps = np.array(timestamps)
-        tambients = np.array(tambients)
-        elevations = np.array(elevations)
-
-        avg_tsys = self.average_tsys(tsyss, exposures)
-
-        avg_tsys80 = avg_tsys.mean(0)  # single value for mid 80% of band
-        avg_cref = self.average_spectra(crefs, tsyss, exposures)
-        exposure = np.sum(exposures)
+        # the weighted averages are the same as average_tsys() and
+        #   average_spectra() of the whole stack of integrations
+        accumulator = ReferenceAccumulator(self.NAN_NATIVE)
+        accumulator.add(np.array(crefs), tsyss, exposures, timestamps, tambients, elevations)
 
-        avg_timestamp = timestamps.mean()
-        avg_tambient = tambients.mean()
-        avg_elevation = elevations.mean()
-
-        return avg_cref, avg_tsys80, avg_timestamp, avg_tambient, avg_elevation, exposure
+        return accumulator.average()
 
     def tsky(self, ambient_temp_k, freq_hz, tau):
         r"""Determine the sky brightness temperature at a frequency.
 
         Args:
-            ambient_temp_k(float): Mean ambient temperature in Kelvin.
+            ambient_temp_k(float or 1d array): Mean ambient temperature in Kelvin.
             freq_hz(float): Frequency in Hz.
-            tau(float): Atmospheric opacity value.
+            tau(float or 1d array): Atmospheric opacity value.
 
         Returns:
-            float:
+            float or 1d array:
             The sky model temperature contribution at frequency channel.
 
         """
@@ -0,0 +1,125 @@
+# Copyright (C) 2007 Associated Universities, Inc. Washington DC, USA.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+# Correspondence concerning GBT software should be addressed as follows:
+#       GBT Operations
+#       National Radio Astronomy Observatory
+#       P. O. Box 2
+#       Green Bank, WV 24944-0002 USA
+
+# $Id$
+
+import json
+import os
+import socket
+import time
+
+
+class CalibrationManifest:
+    """A record of the calibrated output files written by pipeline runs.
+
+       Each calibrated output file gets a record, written when the file
+       is closed, with the file name, its feed, window and polarization,
+       the map scans, the number of channels and rows, and the source
+       name and rest frequency.  Imaging is planned from the records,
+       without looking for files or reading them.
+
+       The manifest is a text file with one JSON record per line.
+       Records are appended with a single write, so the calibration
+       processes of a run can all add to the same manifest.  Every
+       record has the id of the run that wrote it, and records() only
+       returns those of this run, so files left from earlier runs are
+       never picked up.  A run empties the manifest with start(), so it
+       does not grow with the records of every run before.
+
+    """
+
+    # manifest file name, in the directory of the calibrated files
+    FILENAME = 'calibrated.manifest'
+
+    def __init__(self, filename=FILENAME, run=None):
+        """
+        Args:
+            filename: (str) manifest file name
+            run: (str) id of this run.  Default is made from the host
+                name, process id and time.
+
+        """
+        self.filename = filename
+        if run is None:
+            run = '{host}:{pid}:{time:.6f}'.format(host=socket.gethostname(),
+                                                  pid=os.getpid(), time=time.time())
+        self.run = run
+
+    def start(self):
+        """Empty the manifest, at the start of a run"""
+        fd = os.open(self.filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0644)
+        os.close(fd)
+
+    def add(self, outfilename, **fields):
+        """Add the record of a calibrated file.
+
+        Args:
+            outfilename: (str) calibrated file name
+            fields: the rest of the record, e.g. feed, window, pol,
+                start, end, nchans, nrows, object, restfreq
+
+        """
+        record = dict(fields)
+        record['file'] = outfilename
+        record['run'] = self.run
+        line = json.dumps(record, sort_keys=True) + '\n'
+
+        fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def records(self, outfilenames=None):
+        """Records of the files calibrated in this run.
+
+        Args:
+            outfilenames: (list) only return the records of these files.
+                Default is all files.
+
+        Returns:
+        a (list) of record dictionaries, sorted by file name.  If a file
+        was recorded more than once, the last record is returned.
+
+        """
+        if not os.path.exists(self.filename):
+            return []
+
+        wanted = None
+        if outfilenames is not None:
+            wanted = set(outfilenames)
+
+        latest = {}
+        with open(self.filename) as manifest:
+            for line in manifest:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # e.g. a partly written line from a run that was killed
+                    continue
+                if record.get('run') != self.run:
+                    continue
+                if wanted is not None and record['file'] not in wanted:
+                    continue
+                latest[record['file']] = record
+
+        return [latest[name] for name in sorted(latest)]
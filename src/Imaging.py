@@ -22,11 +22,8 @@
 
 # $Id$
 
-import fitsio
-
 import sys
 import os
-import glob
 import subprocess
 from collections import namedtuple
 import socket
@@ -37,91 +34,102 @@ class Imaging:
     def __init__(self,):
         pass
 
-    def run(self, log, terminal, cl_params, mapping_pipelines):
+    def run(self, log, terminal, cl_params, records):
 
         log.doMessage('INFO', '\n{t.underline}Start imaging.{t.normal}'.format(t=terminal))
 
+        maps = self.plan(log, records)
+
+        for thismap in sorted(maps):
+            self.image_map(log, cl_params, thismap, maps[thismap])
+
+    def plan(self, log, records):
+        """Group calibrated files into the maps to image.
+
+        Keyword arguments:
+        records -- CalibrationManifest records of the calibrated files
+
+        Returns a dictionary of (nchans, window, start, end) map
+        descriptions to the list of records of the map's files.
+
+        """
+
         # ------------------------------------------------- identify imaging scripts
 
         MapStruct = namedtuple("MapStruct", "nchans, window, start, end")
 
         maps = {}
-        for mp in mapping_pipelines:
-            nchans = int(mp.mp_object.row_list.get(mp.start, mp.feed, mp.window, mp.pol)['NCHANS'])
-            maps[MapStruct(nchans, mp.window, mp.start, mp.end)] = set()
-
-        for mp in mapping_pipelines:
-            nchans = int(mp.mp_object.row_list.get(mp.start, mp.feed, mp.window, mp.pol)['NCHANS'])
-            maps[MapStruct(nchans, mp.window, mp.start, mp.end)].add(mp.feed)
+        for record in records:
+            thismap = MapStruct(record['nchans'], record['window'], record['start'], record['end'])
+            maps.setdefault(thismap, []).append(record)
 
         log.doMessage('DBG', 'maps', maps)
 
-        for thismap in maps:
-
-            log.doMessage('INFO', 'Imaging window {win} '
-                          'for map scans {start}-{stop}'.format(win=thismap.window,
-                                                                start=thismap.start,
-                                                                stop=thismap.end))
-
-            scanrange = str(thismap.start) + '_' + str(thismap.end)
-
-            imfiles = glob.glob('*' + scanrange + '*window' +
-                                str(thismap.window) + '_feed*_pol*' + '.fits')
-
-            if not imfiles:
-                # no files found
-                log.doMessage('ERR', 'No calibrated files found.')
-                continue
-
-            # filter file list to only include those with a feed calibrated for use in this map
-            feeds = map(str, sorted(maps[thismap]))
-
-            ff = fitsio.FITS(imfiles[0])
-            nchans = int([xxx['tdim'] for xxx
-                          in ff[1].get_info()['colinfo']
-                          if xxx['name'] == 'DATA'][0][0])
-            ff.close()
-            if cl_params.channels:
-                channels = str(cl_params.channels)
-            elif nchans:
-                chan_min = int(nchans*.02)  # start at 2% of nchan
-                chan_max = int(nchans*.98)  # end at 98% of nchans
-                channels = str(chan_min) + ':' + str(chan_max)
-
-            infiles = ' '.join(imfiles)
-
-            if cl_params.keeptempfiles:
-                keeptempfiles = '1'
-            else:
-                keeptempfiles = '0'
-
-            # get the source name and restfrequency from an input file
-            tabledata = fitsio.read(imfiles[0])
-            source = tabledata['OBJECT'][0].strip()
-            restfreq = tabledata['RESTFREQ'][0]
-            del tabledata
-
-            freq = "_%.0f_MHz" % (restfreq * 1e-6)
-            output_basename = source + '_' + scanrange + freq
-
-            if cl_params.average <= 1:
-                average = 1
-            else:
-                average = cl_params.average
-
-            if cl_params.clobber:
-                clobber = ' --clobber'
-            else:
-                clobber = ''
-
-            self.grid(log,
-                      channels,
-                      str(average),
-                      output_basename,
-                      str(cl_params.verbose),
-                      clobber,
-                      infiles)
-
+        return maps
+
+    def image_map(self, log, cl_params, thismap, records):
+        """Grid the calibrated files of one map window with gbtgridder.
+
+        Keyword arguments:
+        thismap -- map description, from plan()
+        records -- records of the map's calibrated files, from plan()
+
+        """
+        log.doMessage('INFO', 'Imaging window {win} '
+                      'for map scans {start}-{stop}'.format(win=thismap.window,
+                                                            start=thismap.start,
+                                                            stop=thismap.end))
+
+        scanrange = str(thismap.start) + '_' + str(thismap.end)
+
+        # files with no calibrated rows can not be gridded
+        records = [record for record in records if record['nrows']]
+        imfiles = [str(record['file']) for record in records]
+
+        if not imfiles:
+            # no files found
+            log.doMessage('ERR', 'No calibrated files found.')
+            return
+
+        nchans = thismap.nchans
+        if cl_params.channels:
+            channels = str(cl_params.channels)
+        elif nchans:
+            chan_min = int(nchans*.02)  # start at 2% of nchan
+            chan_max = int(nchans*.98)  # end at 98% of nchans
+            channels = str(chan_min) + ':' + str(chan_max)
+
+        infiles = ' '.join(imfiles)
+
+        if cl_params.keeptempfiles:
+            keeptempfiles = '1'
+        else:
+            keeptempfiles = '0'
+
+        # get the source name and restfrequency from the first file
+        source = str(records[0]['object'])
+        restfreq = records[0]['restfreq']
+
+        freq = "_%.0f_MHz" % (restfreq * 1e-6)
+        output_basename = source + '_' + scanrange + freq
+
+        if cl_params.average <= 1:
+            average = 1
+        else:
+            average = cl_params.average
+
+        if cl_params.clobber:
+            clobber = ' --clobber'
+        else:
+            clobber = ''
+
+        self.grid(log,
+                  channels,
+                  str(average),
+                  output_basename,
+                  str(cl_params.verbose),
+                  clobber,
+                  infiles)
 
     def grid(self, log, channels, average, output, verbose, clobber, infiles):
         cmd = ' '.join(('gbtgridder',
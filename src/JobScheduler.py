@@ -0,0 +1,192 @@
+# Copyright (C) 2007 Associated Universities, Inc. Washington DC, USA.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+# Correspondence concerning GBT software should be addressed as follows:
+#       GBT Operations
+#       National Radio Astronomy Observatory
+#       P. O. Box 2
+#       Green Bank, WV 24944-0002 USA
+
+# $Id$
+
+import multiprocessing
+import sys
+import time
+import traceback
+from collections import namedtuple
+from Queue import Empty
+
+
+class JobScheduler:
+    """Run jobs in a fixed number of processes, largest first.
+
+       Jobs are added with an estimated cost, then run() calls each job's
+       function in its own forked process, with at most njobs processes
+       running at once.  A new job starts as soon as any job finishes, so
+       there is no waiting for a whole group of jobs (e.g. a window) to
+       finish before the next group starts.  Starting with the most
+       costly jobs keeps the longest ones from being left until last.
+
+       The jobs' functions and arguments are not pickled: the processes
+       are forked, so they see the jobs as they were when run() was
+       called.
+
+       A job can be made to wait for other jobs, e.g. imaging a map
+       after its calibration; it starts once they have all ended,
+       whether they finished or failed.
+
+       Each job reports back whether it finished or failed.  A job fails
+       if its function raises an exception or calls sys.exit(), or if its
+       process dies.
+
+    """
+
+    FINISHED = 'finished'
+    FAILED = 'failed'
+
+    def __init__(self, njobs):
+        """
+        Args:
+            njobs: (int) number of jobs to run at once
+
+        """
+        self.njobs = max(1, njobs)
+        self.Job = namedtuple('job', 'name, cost, function, args, after')
+        self.Result = namedtuple('result', 'name, status, message, elapsed')
+        self.jobs = []
+        self.results = None
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, name, cost, function, args=(), after=()):
+        """Add a job.
+
+        Args:
+            name: (str) name of the job, for messages
+            cost: (number) estimated cost, used only to order the jobs
+            function: function to call in the job's process
+            args: (tuple) arguments of the function
+            after: (list) job numbers of jobs that must end before this
+                job starts
+
+        Returns:
+        the job number
+
+        """
+        self.jobs.append(self.Job(name, cost, function, tuple(args), tuple(after)))
+        return len(self.jobs) - 1
+
+    def order(self):
+        """Job numbers in the order they are started, most costly first.
+
+        A job waiting for other jobs is started after them instead.
+
+        """
+        # sorted() is stable, so jobs of the same cost start in the order added
+        return sorted(range(len(self.jobs)), key=lambda idx: -self.jobs[idx].cost)
+
+    def run(self, log=None):
+        """Run all the jobs, and wait for them to finish.
+
+        Args:
+            log: Logging object for a message as each job starts,
+                finishes or fails.  Default is no messages.
+
+        Returns:
+        a list with a result for each job, in the order the jobs were
+        added.  Each result has the job name, status (FINISHED or FAILED),
+        a message saying why a job failed and the elapsed time in seconds.
+
+        """
+        self.results = multiprocessing.Queue()
+        pending = self.order()
+        running = {}   # job number -> process
+        results = {}   # job number -> Result
+
+        while pending or running:
+            while len(running) < self.njobs:
+                # the most costly job that is not waiting for others
+                ready = [idx for idx in pending
+                         if all(other in results for other in self.jobs[idx].after)]
+                if not ready:
+                    break
+                idx = ready[0]
+                pending.remove(idx)
+                process = multiprocessing.Process(target=self._run_job, args=(idx,))
+                process.start()
+                running[idx] = process
+                self._message(log, 'DBG', '{0} started.'.format(self.jobs[idx].name))
+
+            try:
+                idx, status, message, elapsed = self.results.get(timeout=1)
+                self._finish(log, results, idx, status, message, elapsed)
+                running.pop(idx).join()
+            except Empty:
+                pass
+
+            # a process that died before reporting back
+            for idx, process in running.items():
+                if not process.is_alive():
+                    self._collect(log, results)
+                    if idx not in results:
+                        self._finish(log, results, idx, self.FAILED,
+                                     'process exited with code {0}'.format(process.exitcode), 0.)
+                    process.join()
+                    del running[idx]
+
+        self.results = None
+        return [results[idx] for idx in range(len(self.jobs))]
+
+    def _collect(self, log, results):
+        """Take every result waiting in the queue"""
+        while True:
+            try:
+                idx, status, message, elapsed = self.results.get_nowait()
+            except Empty:
+                return
+            self._finish(log, results, idx, status, message, elapsed)
+
+    def _finish(self, log, results, idx, status, message, elapsed):
+        name = self.jobs[idx].name
+        results[idx] = self.Result(name, status, message, elapsed)
+        if status == self.FINISHED:
+            self._message(log, 'DBG', '{0} finished in {1:.1f} s.'.format(name, elapsed))
+        else:
+            self._message(log, 'ERR', '{0} failed: {1}'.format(name, message))
+
+    @staticmethod
+    def _message(log, level, message):
+        if log is not None:
+            log.doMessage(level, message)
+
+    def _run_job(self, idx):
+        """Call a job's function and report back (in the job's process)"""
+        job = self.jobs[idx]
+        start = time.time()
+        status, message = self.FAILED, ''
+        try:
+            job.function(*job.args)
+            status = self.FINISHED
+        except SystemExit as err:
+            message = 'exited'
+            if err.code is not None:
+                message += ' with code {0}'.format(err.code)
+        except Exception as err:
+            traceback.print_exc()
+            message = '{0}: {1}'.format(type(err).__name__, err)
+        sys.stdout.flush()
+        self.results.put((idx, status, message, time.time() - start))
@@ -26,14 +26,18 @@ import fitsio
 
 from Integration import Integration
 from Calibration import Calibration
+from ReferenceAccumulator import ReferenceAccumulator
 from SdFitsIO import SdFits
 from Pipeutils import Pipeutils
 from Weather import Weather
 from PipeLogging import Logging
+from OrderedPool import OrderedPool
+from ScanCheckpoint import ScanCheckpoint
 from settings import *
 
 import numpy as np
 
+import hashlib
 import os
 import sys
 
@@ -43,13 +47,30 @@ if CREATE_PLOTS:
 
 class MappingPipeline:
 
+    # scalar metadata of each input extension, read once and shared by the
+    #   pipelines for every feed/window/polarization: (filename, ext) -> table
+    METADATA = {}
+
+    # CalibrationManifest the calibrated files are recorded in, if any
+    MANIFEST = None
+
+    # ReferenceCache of averaged reference scans shared by the maps, if any
+    REFERENCES = None
+
+    # command line options that change the calibrated data, for build_key
+    CALIBRATION_OPTIONS = ('units', 'tsky', 'spillover', 'aperture_eff', 'mainbeam_eff',
+                           'beamscaling', 'zenithtau', 'smoothing_kernel',
+                           'smoothing_kernel_type', 'nan_native', 'precision',
+                           'refscans', 'mapscans')
+
     def __init__(self, cl_params, row_list, feed, window, pol, term):
 
         self.term = term
         self.log = None
 
         self.pu = Pipeutils()
-        self.cal = Calibration(cl_params.smoothing_kernel)
+        self.cal = Calibration(cl_params.smoothing_kernel, cl_params.smoothing_kernel_type,
+                               cl_params.nan_native, cl_params.precision)
         self.weather = Weather()
         self.sdf = SdFits()
 
@@ -65,10 +86,21 @@ class MappingPipeline:
 
         self.outfile = None
         self.outfilename = None
+        self.nchans = None
+        self.nrows_written = 0
+        self.first_output = None  # first row written, for the manifest
+        self.build_key = None     # hash of the inputs, from make_build_key
+        self.up_to_date = False   # True if the output was kept from a previous run
+        self.checkpoint = None    # ScanCheckpoint of the output
+        self.committed_scans = set()   # map scans already in a resumed output
+        self.resumed_reference = None  # reference key of a resumed output
 
         self.row_list = row_list
         self.CLOBBER = cl_params.clobber
 
+        # optional RowDemultiplexer that reads the scans for many pipelines
+        self.demux = None
+
         try:
             self.create_output_sdfits(feed, window, pol)
         except KeyError:
@@ -124,6 +156,31 @@ class MappingPipeline:
             os.unlink(self.outfilename)
             sys.exit(9)
 
+    def get_metadata(self, ext):
+        """Return the scalar metadata table of an input extension.
+
+        The table is read on first use and indexed by table row number.
+
+        """
+        key = (self.infilename, ext)
+        if key not in MappingPipeline.METADATA:
+            MappingPipeline.METADATA[key] = self.sdf.read_metadata(self.infile[ext])
+        return MappingPipeline.METADATA[key]
+
+    def read_scan_rows(self, scan, feed, window, pol, ext, rows, start, stop, columns=None):
+        """Read rows[start:stop] of a scan for this feed/window/polarization.
+
+        The rows come from the demultiplexer, if there is one, and
+        otherwise are read from the input file.
+
+        Returns:
+        a structured array of the rows and a 2-D view of its DATA column
+
+        """
+        if self.demux is not None:
+            return self.demux.read(scan, feed, window, pol, start, stop)
+        return self.sdf.read_scan_block(self.infile[ext], rows[start:stop], columns)
+
     def determineSetup(self, sdfits_row_structure, ext):
 
         # ------------------ look ahead at first few rows to determine setup
@@ -133,10 +190,9 @@ class MappingPipeline:
         lookahead_cal_states = set([])
         lookahead_sig_states = set([])
 
-        # fill the buffers
-        for rowNum in sdfits_row_structure[:4]:
-            columns = ('CAL', 'SIG')
-            row = Integration(self.infile[ext][columns][rowNum])
+        metadata = self.get_metadata(ext)
+        for rownum in sdfits_row_structure[:4]:
+            row = Integration(metadata[rownum:rownum + 1])
 
             lookahead_cal_states.add(row['CAL'])
             lookahead_sig_states.add(row['SIG'])
@@ -162,57 +218,107 @@ class MappingPipeline:
         ext = referenceRows['EXTENSION']
         rows = referenceRows['ROW']
 
-        crefs = []  # each element will be an average of noise diode on & off pairs
-        tsyss = []  # each element corresponds to the combined noise diode on & off, see Calibration().tsys()
-        cal_on = None  # to hold the integration with noise diode ON
-        cal_off = None  # to hold the integration with noise diode OFF
-        exposures = []   # each element is total exposure, used for weighting the average of reference integrations
-        timestamps = []  # each element is an average to use for interpolation bt/wn references
-        tambients = []   # from the cal_off integration, used for tsky computation for ta* and beyond
-        elevations = []  # from the call_off integration, used for tsky computation for ta* and beyond
-
-        columns = tuple(self.infile[ext].get_colnames())
+        # a reference averaged before, e.g. as the trailing reference of
+        #  the previous map, is used again
+        cache_key = None
+        if MappingPipeline.REFERENCES is not None:
+            cache_key = self.reference_cache_key(scan, feed, window, pol, ext, rows, beam_scaling)
+            reference = MappingPipeline.REFERENCES.get(cache_key)
+            if reference is not None:
+                self.log.doMessage('INFO', 'Tsys for scan {scan} feed {feed} '
+                                   'window {window} pol {pol}: '
+                                   '{tsys:.1f} (cached)'.format(scan=scan, feed=feed,
+                                                                window=window, pol=pol,
+                                                                tsys=reference[1]))
+                return reference
+
+        # running weighted sums of the noise diode on & off pairs, with their
+        #   tsys, exposure, timestamp, ambient temperature and elevation
+        accumulator = ReferenceAccumulator(self.cal.NAN_NATIVE)
+
+        cal_on = None  # scan position of the integration with noise diode ON
+        cal_off = None  # scan position of the integration with noise diode OFF
+        carried = {}  # unpaired integrations from the previous block, by scan position
+
+        metadata = self.get_metadata(ext)
+
+        # read the reference scan in blocks rather than one row at a time
+        for chunkstart in range(0, len(rows), self.BUFFER_SIZE):
+
+            chunkrows = rows[chunkstart:chunkstart + self.BUFFER_SIZE]
+            _, data = self.read_scan_rows(scan, feed, window, pol, ext, rows,
+                                          chunkstart, chunkstart + self.BUFFER_SIZE, ('DATA',))
+            block = metadata[chunkrows]
+
+            # look for "bad" spectra: all NaNs or all zeros
+            bad = np.isnan(data).all(axis=1) | (data.ptp(axis=1) == 0)
+
+            # put any integration left unpaired by the previous block in front
+            carried_positions = sorted(carried)
+            if carried:
+                block = np.concatenate([carried[pos][0] for pos in carried_positions] + [block])
+                data = np.concatenate([carried[pos][1] for pos in carried_positions] + [data])
+                bad = np.concatenate([carried[pos][2] for pos in carried_positions] + [bad])
+
+            def blockidx(pos):
+                if pos < chunkstart:
+                    return carried_positions.index(pos)
+                return len(carried_positions) + pos - chunkstart
+
+            pairs_on = []
+            pairs_off = []
+            for idx in range(len(carried_positions), len(block)):
+
+                pos = chunkstart + idx - len(carried_positions)
+
+                if block['CAL'][idx].strip() == 'T':
+                    cal_on = pos
+                else:
+                    cal_off = pos
+
+                if cal_off is not None and cal_on is not None:
+
+                    if bad[blockidx(cal_off)] or bad[blockidx(cal_on)]:
+                        self.log.doMessage('DBG', 'Bad integration. '
+                                           'Skipping row', rows[pos], 'from input data.')
+                        continue
 
-        for rowNum in rows:
+                    pairs_on.append(blockidx(cal_on))
+                    pairs_off.append(blockidx(cal_off))
 
-            row = Integration(self.infile[ext][columns][rowNum])
+                    # used these, so clear for the next iteration
+                    cal_off = None
+                    cal_on = None
 
-            if row['CAL'] == 'T':
-                cal_on = row
-            else:
-                cal_off = row
+            carried = {}
+            for pos in (cal_on, cal_off):
+                if pos is not None:
+                    idx = blockidx(pos)
+                    carried[pos] = (block[idx:idx + 1], data[idx:idx + 1], bad[idx:idx + 1])
 
-            if cal_off and cal_on:
+            if not pairs_off:
+                continue
 
-                # look for "bad" spectra: all NaNs or all zeros
-                if np.all(np.isnan(cal_off.data['DATA'])) or \
-                   np.all(np.isnan(cal_on.data['DATA'])) or \
-                   0 == cal_off.data['DATA'].ptp() or \
-                   0 == cal_on.data['DATA'].ptp():
-                    self.log.doMessage('DBG', 'Bad integration. '
-                                       'Skipping row', rowNum, 'from input data.')
-                    continue
+            on = np.array(pairs_on)
+            off = np.array(pairs_off)
 
-                receiver = cal_off['FRONTEND'].strip()
+            receiver = block['FRONTEND'][off[0]].strip()
+            beam_scale = self.get_beam_scale(receiver, beam_scaling, feed, pol)
 
-                beam_scale = self.get_beam_scale(receiver, beam_scaling, feed, pol)
-                cref, tsys, exposure, timestamp, tambient, elevation = self.sdf.getReferenceIntegration(cal_on, cal_off, beam_scale)
+            # total power, tsys and metadata of each integration in the block
+            crefs, exposures = self.cal.total_power(self.cal.blank_spectra(data[on]),
+                                                    self.cal.blank_spectra(data[off]),
+                                                    block['EXPOSURE'][on], block['EXPOSURE'][off])
+            tcal = np.asarray(block['TCAL'][off], dtype=float) * beam_scale
+            tsyss = self.cal.tsys_block(tcal, data[on], data[off])
+            timestamps = self.pu.dateToMjd_array(block['DATE-OBS'][off])
 
-                # used these, so clear for the next iteration
-                cal_off = None
-                cal_on = None
+            # add the raw spectra and tsys values of the integrations
+            #   to the average used for calibration
+            accumulator.add(crefs, tsyss, exposures, timestamps,
+                            block['TAMBIENT'][off], block['ELEVATIO'][off])
 
-                # collect raw spectra and tsys values for each integration
-                #   these will be averaged to use for calibration
-                crefs.append(cref)
-                tsyss.append(tsys)
-                exposures.append(exposure)
-                timestamps.append(timestamp)
-                tambients.append(tambient)
-                elevations.append(elevation)
-
-        avgCref, avgTsys, avgTimestamp, avgTambient, avgElevation, sumExposure = \
-            self.cal.getReferenceAverage(crefs, tsyss, exposures, timestamps, tambients, elevations)
+        avgCref, avgTsys, avgTimestamp, avgTambient, avgElevation, sumExposure = accumulator.average()
 
         self.log.doMessage('INFO', 'Tsys for scan {scan} feed {feed} '
                            'window {window} pol {pol}: '
@@ -220,7 +326,26 @@ class MappingPipeline:
                                                window=window, pol=pol,
                                                tsys=avgTsys))
 
-        return avgCref, avgTsys, avgTimestamp, avgTambient, avgElevation, sumExposure
+        reference = (avgCref, avgTsys, avgTimestamp, avgTambient, avgElevation, sumExposure)
+        if cache_key is not None:
+            MappingPipeline.REFERENCES.put(cache_key, reference)
+
+        return reference
+
+    def reference_cache_key(self, scan, feed, window, pol, ext, rows, beam_scaling):
+        """Key of an averaged reference scan in the ReferenceCache.
+
+        The average depends on the input file (name, size and
+        modification time), the rows of the scan, the beam scaling and
+        the handling of NaNs.  Smoothing is applied after the average is
+        taken, so the same average serves any smoothing kernel.
+
+        """
+        status = os.stat(self.infilename)
+        return self.REFERENCES.key(os.path.realpath(self.infilename), status.st_size, status.st_mtime,
+                                   PIPELINE_VERSION, scan, feed, window, pol, ext,
+                                   hashlib.sha1(np.asarray(rows, dtype=np.int64).tostring()).hexdigest(),
+                                   beam_scaling, self.cal.NAN_NATIVE)
 
     def get_dtype(self, feed, window, pol):
 
@@ -229,7 +354,7 @@ class MappingPipeline:
             ext = signalRows['EXTENSION']
         except KeyError:
             raise
-        dtype = self.infile[ext][0].dtype
+        dtype = self.infile[ext].get_rec_dtype()[0]
 
         return dtype
 
@@ -239,9 +364,7 @@ class MappingPipeline:
             signalRows = self.row_list.get(self.cl.mapscans[0], feed, window, pol)
             ext = signalRows['EXTENSION']
             rows = signalRows['ROW']
-            columns = tuple(self.infile[ext].get_colnames())
-            firstIntegration = Integration(self.infile[ext][columns][rows[0]])
-            targetname = firstIntegration['OBJECT'].replace(" ", "")
+            targetname = self.get_metadata(ext)['OBJECT'][rows[0]].strip().replace(" ", "")
 
         except KeyError:
             print('WARNING: Can not find data for scan {scan} window {win} feed {feed} polarization {pol}'.format(scan=self.cl.mapscans[0], win=window, feed=feed, pol=pol))
@@ -251,10 +374,28 @@ class MappingPipeline:
 
         self.log = Logging(self.cl, self.outfilename.rstrip('.fits'))
 
-        if self.CLOBBER is False and os.path.exists(self.outfilename):
+        # with --incremental or --resume, keep an output made from the same
+        #  inputs, and with --resume, continue a partial one.  Other outputs
+        #  are overwritten, as with --clobber.
+        self.build_key = self.make_build_key(feed, window, pol)
+        self.checkpoint = ScanCheckpoint(self.outfilename)
+        exists = os.path.exists(self.outfilename)
+        if exists and (self.cl.incremental or self.cl.resume) and self.output_is_current():
+            self.log.doMessage('INFO', self.outfilename, 'is up to date.')
+            self.up_to_date = True
+            self.read_existing_output()
+            return self.infile[ext].get_rec_dtype()[0]
+        elif exists and self.cl.resume:
+            if self.resume_output():
+                return self.infile[ext].get_rec_dtype()[0]
+            self.log.doMessage('WARN', 'Can not resume', self.outfilename, '\nCalibrating it from the start.')
+        elif self.CLOBBER is False and exists and not self.cl.incremental:
             self.log.doMessage('WARN', ' Will not overwrite existing pipeline output.\nConsider using \'--clobber\' option to overwrite.')
             sys.exit()
 
+        # a checkpoint left with an output that is being replaced
+        self.checkpoint.remove()
+
         # create a new table
         old_stdout = sys.stdout
         from cStringIO import StringIO
@@ -263,7 +404,8 @@ class MappingPipeline:
         self.outfile = fitsio.FITS(self.outfilename, 'rw', clobber=True)
         sys.stdout = old_stdout
 
-        dtype = self.infile[ext][0].dtype
+        dtype = self.infile[ext].get_rec_dtype()[0]
+        self.nchans = dtype['DATA'].shape[0]
 
         input_header = fitsio.read_header(self.infilename, ext)
         self.outfile.create_table_hdu(dtype=dtype, extname=input_header['EXTNAME'])
@@ -277,8 +419,163 @@ class MappingPipeline:
 
         self.outfile[0].write_key('PIPE_VER', PIPELINE_VERSION, comment="GBT Pipeline Version")
 
+        # flush the headers, so that if the output is written and closed
+        #  in a child process, this process has no stale header to write
+        #  back over it (e.g. over PIPEHASH) when its copy is closed
+        self.outfile.reopen()
+
         return dtype
 
+    def make_build_key(self, feed, window, pol):
+        """Hash of everything the calibrated output depends on.
+
+        That is the input file (name, size and modification time), the
+        input rows of the reference and map scans, the calibration
+        options and the pipeline version.  An output with the same key
+        would be calibrated the same way again.
+
+        """
+        digest = hashlib.sha1()
+
+        status = os.stat(self.infilename)
+        digest.update(repr((os.path.realpath(self.infilename), status.st_size,
+                            status.st_mtime, PIPELINE_VERSION)))
+        digest.update(repr([(name, getattr(self.cl, name, None))
+                            for name in self.CALIBRATION_OPTIONS]))
+
+        for scan in list(self.cl.refscans or [])[:2] + list(self.cl.mapscans):
+            try:
+                rows = self.row_list.get(scan, feed, window, pol)
+            except KeyError:
+                digest.update(repr((scan, None)))
+                continue
+            digest.update(repr((scan, rows['EXTENSION'])))
+            digest.update(np.asarray(rows['ROW'], dtype=np.int64).tostring())
+
+        return digest.hexdigest()
+
+    def output_is_current(self):
+        """True if the output file was completed from the same inputs (build_key)"""
+        try:
+            header = fitsio.read_header(self.outfilename, 0)
+        except (IOError, ValueError):
+            return False
+        return header.get('PIPEHASH') == self.build_key
+
+    def read_existing_output(self):
+        """Get what the manifest records about an output kept from a previous run"""
+        outfile = fitsio.FITS(self.outfilename)
+        try:
+            self.nchans = outfile[1].get_rec_dtype()[0]['DATA'].shape[0]
+            self.nrows_written = outfile[1].get_nrows()
+            if self.nrows_written:
+                self.first_output = outfile[1].read(columns=['OBJECT', 'RESTFREQ'], rows=[0])
+        finally:
+            outfile.close()
+
+    def resume_output(self):
+        """Reopen a partial output to continue after its last committed scan.
+
+        The last checkpoint record made with the same build key is
+        checked against the output: the rows it records for the scan
+        must be in the file and be from that scan.  Any rows written
+        after it, by a scan that was not completed, are removed.
+
+        Returns:
+        True if the output was reopened, False if it can not be resumed
+
+        """
+        record = self.checkpoint.last(self.build_key)
+        if record is None or record['scan'] not in self.cl.mapscans:
+            return False
+
+        start, end = record['start'], record['end']
+        try:
+            outfile = fitsio.FITS(self.outfilename, 'rw')
+        except (IOError, ValueError):
+            return False
+        # closed until the calibration starts, which may be in another
+        #  process; this one must not hold the output open meanwhile, or
+        #  closing it would write back the table as it is now
+        try:
+            if len(outfile) < 2 or outfile[1].get_nrows() < end:
+                return False
+            if end > start:
+                scans = outfile[1].read(columns=['SCAN'], rows=range(start, end))['SCAN']
+                if (scans != record['scan']).any():
+                    return False
+            outfile[1].resize(end)
+            self.nchans = outfile[1].get_rec_dtype()[0]['DATA'].shape[0]
+            if end:
+                self.first_output = outfile[1].read(columns=['OBJECT', 'RESTFREQ'], rows=[0])
+        except (IOError, ValueError):
+            return False
+        finally:
+            outfile.close()
+
+        self.nrows_written = end
+
+        last = self.cl.mapscans.index(record['scan'])
+        self.committed_scans = set(self.cl.mapscans[:last + 1])
+        self.resumed_reference = record['reference']
+        self.log.doMessage('INFO', 'Resuming', self.outfilename, 'after scan', record['scan'])
+        return True
+
+    def open_output(self):
+        """Reopen a resumed output, to add the rest of its scans"""
+        if self.outfile is None:
+            self.outfile = fitsio.FITS(self.outfilename, 'rw')
+
+    def restart_output(self):
+        """Empty a resumed output, to calibrate all of its scans again"""
+        self.checkpoint.remove()
+        self.outfile[-1].resize(0)
+        self.outfile.reopen()
+        self.nrows_written = 0
+        self.first_output = None
+        self.committed_scans = set()
+        self.resumed_reference = None
+
+    def commit_scan(self, scan, start, reference=None):
+        """Flush the rows of a completed map scan and add its checkpoint record.
+
+        Keyword arguments:
+        scan -- map scan number
+        start -- first output row of the scan
+        reference -- key of the reference state used, if any
+
+        Only with --resume; otherwise the output is written as it was,
+        without a sync per scan.
+
+        """
+        if not self.cl.resume:
+            return
+
+        # closing and reopening the output updates its headers, then the
+        #  data is synced to disk before the scan is recorded as done
+        self.outfile.reopen()
+        fd = os.open(self.outfilename, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self.checkpoint.add(scan, start, self.nrows_written, self.build_key, reference)
+
+    def reference_key(self, references, tsky_refs):
+        """Hash of the reference state a position-switched map is calibrated with
+
+        Keyword arguments:
+        references -- list of (spectrum, tsys, timestamp, exposure) of each reference
+        tsky_refs -- sky temperatures of the references, or None
+
+        """
+        digest = hashlib.sha1()
+        for spectrum, tsys, timestamp, exposure in references:
+            digest.update(np.ascontiguousarray(spectrum).tostring())
+            digest.update(repr([float(np.mean(tsys)), float(timestamp), float(np.sum(exposure))]))
+        digest.update(repr(tsky_refs))
+        return digest.hexdigest()
+
     def multi_tskys(self, crefTime2, refTambient2, refElevation2):
 
         if (crefTime2 is not None) and (refTambient2 is not None) and (refElevation2 is not None):
@@ -286,34 +583,17 @@ class MappingPipeline:
         else:
             return False
 
-    def set_row_chunks(self, rows, WRITESIZE=100):
-
-        nrows = len(rows)
-        rowchunks = []
-        startchunk = 0
-        while nrows > 0:
-            if nrows > WRITESIZE:
-                nrows = nrows - WRITESIZE
-                rowchunks.append(rows[startchunk:startchunk+WRITESIZE])
-                startchunk = startchunk+WRITESIZE
-            else:
-                rowchunks.append(rows[startchunk:])
-                nrows = 0
-        return rowchunks
-
     def getObsFreq(self, feed, window, pol):
 
         # get integration rows of input table
         signalRows = self.row_list.get(self.cl.mapscans[0], feed, window, pol)
         ext = signalRows['EXTENSION']
         rows = signalRows['ROW']
-        columns = tuple(self.infile[ext].get_colnames())
-        firstIntegration = Integration(self.infile[ext][columns][rows[0]])
 
         # integration observed frequency
         # we assume this center of band frequency is the same for all integrations
         #  in both the reference scans and the map scans
-        obsfreqHz = firstIntegration['OBSFREQ']
+        obsfreqHz = self.get_metadata(ext)['OBSFREQ'][rows[0]]
 
         return obsfreqHz
 
@@ -370,199 +650,293 @@ class MappingPipeline:
 
         return rows2write
 
+    def group_fs_states(self, sig_states, cal_states):
+        """Group the signal and noise diode states of a frequency-switched scan
+
+        Follows the same rules as reading the rows one at a time: the most
+        recent row of each of the four signal and noise diode states makes
+        an integration, and the row that completes the set provides the
+        metadata for the calibrated row.
+
+        Keyword arguments:
+        sig_states -- the SIG column value of each row in the scan
+        cal_states -- the CAL column value of each row in the scan
+
+        Returns:
+        a dict of index arrays, into the scan rows, of the 'sig_on', 'sig_off',
+        'ref_on' and 'ref_off' rows and the 'out' row of each integration
+
+        """
+        keys = ('sig_on', 'sig_off', 'ref_on', 'ref_off')
+        groups = dict((key, []) for key in keys + ('out',))
+
+        current = dict.fromkeys(keys)
+        for idx, (sig, cal) in enumerate(zip(sig_states, cal_states)):
+            state = 'sig' if sig.strip() == 'T' else 'ref'
+            state += '_on' if cal.strip() == 'T' else '_off'
+            current[state] = idx
+
+            # we need 4 states to calibrate FS integrations
+            if None not in current.values():
+                for key in keys:
+                    groups[key].append(current[key])
+                groups['out'].append(idx)
+                # used these, so clear for the next integration
+                current = dict.fromkeys(keys)
+
+        return dict((key, np.array(groups[key], dtype=int)) for key in groups)
+
     def calibrate_fs_sdfits_integrations(self, feed, window, pol, beam_scaling):
 
         dtype = self.get_dtype(feed, window, pol)
         if dtype is None:
             return
 
+        if self.cl.units not in ('ta', 'ta*', 'tmb', 'jy'):
+            self.log.doMessage('ERR', 'units not recognized.  Can not write data.')
+            sys.exit(9)
+
+        self.open_output()
+
+        # with --scan-workers, the scans are calibrated in worker processes
+        scan_results = self.fan_out_scans(lambda scan: list(self.calibrate_fs_scan(scan, feed, window, pol,
+                                                                                   beam_scaling)),
+                                          feed, window, pol)
+
         for scan in self.cl.mapscans:
 
+            # let the caller step through the scans, e.g. to calibrate the
+            #  same scan for other feeds/windows/polarizations next
+            yield scan
+
+            # already in a resumed output
+            if scan in self.committed_scans:
+                continue
+
             try:
                 inputRows = self.row_list.get(scan, feed, window, pol)
             except:
-                continue
+                inputRows = None
+
+            if inputRows is not None:
+                cal_switching, sigref = self.determineSetup(inputRows['ROW'], inputRows['EXTENSION'])
+
+                if not cal_switching or not sigref:
+                    self.log.doMessage('ERR', 'Expected frequency-switched scan', scan, 'does not have 2 signal states and 2 noise diode (cal) states')
+                    if scan_results is not None:
+                        scan_results.close()
+                    self.outfile.close()
+                    # if this is the first scan, remove the output file because the table will be empty
+                    if scan == self.cl.mapscans[0]:
+                        os.unlink(self.outfilename)
+                        self.checkpoint.remove()
+                    sys.exit()
+
+            if scan_results is None:
+                outputs = self.calibrate_fs_scan(scan, feed, window, pol, beam_scaling)
+            else:
+                outputs = scan_results.next()
 
-            # get integration rows
-            rows = inputRows['ROW']
-            ext = inputRows['EXTENSION']
+            start = self.nrows_written
+            self.write_outputs(outputs)
+            self.commit_scan(scan, start)
 
-            columns = tuple(self.infile[ext].get_colnames())
+        self.close_output(feed, window, pol)
 
-            cal_switching, sigref = self.determineSetup(rows, ext)
+    def calibrate_fs_scan(self, scan, feed, window, pol, beam_scaling):
+        """Calibrate the integrations of one frequency-switched map scan.
 
-            if not cal_switching or not sigref:
-                self.log.doMessage('ERR', 'Expected frequency-switched scan', scan, 'does not have 2 signal states and 2 noise diode (cal) states')
-                self.outfile.close()
-                # if this is the first scan, remove the output file because the table will be empty
-                if scan == self.cl.mapscans[0]:
-                    os.unlink(self.outfilename)
-                sys.exit()
+        This is a generator of the calibrated output rows, a block at a
+        time, to be written in order.  Nothing is generated if the scan
+        is not found or is not frequency switched.
+
+        Keyword arguments:
+        scan -- map scan number
+        feed, window, pol -- the feed, window and polarization
+        beam_scaling -- beam scaling factors from the command line
+
+        """
+        try:
+            inputRows = self.row_list.get(scan, feed, window, pol)
+        except:
+            return
 
-            # break the input rows into chunks as buffers to write out
-            #   so that we don't write out rows one at a time
-            rowchunks = self.set_row_chunks(rows, self.BUFFER_SIZE)
+        # get integration rows
+        rows = inputRows['ROW']
+        ext = inputRows['EXTENSION']
 
-            for chunk in rowchunks:
+        columns = tuple(self.infile[ext].get_colnames())
 
-                outputidx = 0
+        cal_switching, sigref = self.determineSetup(rows, ext)
 
-                rows2write = self.nOutputRows(chunk, cal_switching, sigref)
+        # not frequency switched; reported by calibrate_fs_sdfits_integrations
+        if not cal_switching or not sigref:
+            return
 
-                output_data = np.zeros(rows2write, dtype=dtype)
+        # group the four states of each integration for the whole scan,
+        #   then calibrate the integrations a block at a time
+        metadata = self.get_metadata(ext)
+        states = metadata[rows]
+        groups = self.group_fs_states(states['SIG'], states['CAL'])
 
-                sigrefState = [{'cal_on': None, 'cal_off': None, 'TP': None, 'rownum': None},
-                               {'cal_on': None, 'cal_off': None, 'TP': None, 'rownum': None}]
+        nintegrations = len(groups['out'])
+        integrations_per_chunk = max(self.BUFFER_SIZE / 4, 1)
 
-                # now start at the beginning and calibrate all the integrations
-                for rowNum in chunk:
+        for startint in range(0, nintegrations, integrations_per_chunk):
 
-                    row = Integration(self.infile[ext][columns][rowNum])
+            stopint = min(startint + integrations_per_chunk, nintegrations)
 
-                    if row['SIG'] == 'T':
-                        if row['CAL'] == 'T':
-                            sigrefState[0]['cal_on'] = row
-                        else:
-                            sigrefState[0]['cal_off'] = row
+            chunk = dict((key, groups[key][startint:stopint]) for key in groups)
+            first = min(chunk[key].min() for key in chunk)
+            last = chunk['out'].max()
 
-                        sigrefState[0]['rownum'] = rowNum
-                        obsfreqHz = row['OBSFREQ']
+            block, data = self.read_scan_rows(scan, feed, window, pol, ext, rows,
+                                              first, last + 1, columns)
+            meta = metadata[rows[first:last + 1]]
 
-                    else:
-                        if row['CAL'] == 'T':
-                            sigrefState[1]['cal_on'] = row
-                        else:
-                            sigrefState[1]['cal_off'] = row
-
-                        sigrefState[1]['rownum'] = rowNum
-
-                    # we need 4 states to calibrate FS integrations
-                    if sigrefState[0]['cal_on'] and sigrefState[0]['cal_off'] and \
-                       sigrefState[1]['cal_on'] and sigrefState[1]['cal_off']:
-
-                        if (np.all(np.isnan(sigrefState[0]['cal_on']['DATA'].data)) or
-                            np.all(np.isnan(sigrefState[0]['cal_off']['DATA'].data)) or
-                            np.all(np.isnan(sigrefState[1]['cal_on']['DATA'].data)) or
-                            np.all(np.isnan(sigrefState[1]['cal_off']['DATA'].data)) or
-                            (0 == sigrefState[0]['cal_off']['DATA'].ptp() and
-                             0 == sigrefState[0]['cal_on']['DATA'].ptp()) or
-                            (0 == sigrefState[1]['cal_off']['DATA'].ptp() and
-                             0 == sigrefState[1]['cal_on']['DATA'].ptp())):
-
-                            self.log.doMessage('DBG', 'Bad integration. '
-                                               'Writing nan values to output.  Input rows',
-                                               sigrefState[0]['rownum'],
-                                               sigrefState[1]['rownum'])
-
-                            # create an output row with 'nan' data and real metadata
-                            output_data[outputidx] = row.data
-
-                            #
-                            # we can probably replace the following line with a more pythonic
-                            #
-                            # for xx in output_data[outputidx]['DATA']:
-                            #     xx = float('nan')
-                            #
-                            for xx in range(len(output_data[outputidx]['DATA'])):
-                                output_data[outputidx]['DATA'][xx] = float('nan')
-
-                            outputidx = outputidx + 1
-
-                            self.show_progress(outputidx, rows2write)
-
-                            # used these, so clear for the next iteration
-                            sigrefState = [{'cal_on': None, 'cal_off': None, 'TP': None, 'rownum': None, 'EXPOSURE': None},
-                                           {'cal_on': None, 'cal_off': None, 'TP': None, 'rownum': None, 'EXPOSURE': None}]
-                            continue
-
-                        # noise diode is being fired during signal integrations
-                        sigrefState[0]['TP'], sigrefState[0]['EXPOSURE'] = self.cal.total_power(sigrefState[0]['cal_on']['DATA'],
-                                                                                                sigrefState[0]['cal_off']['DATA'],
-                                                                                                sigrefState[0]['cal_on']['EXPOSURE'],
-                                                                                                sigrefState[0]['cal_off']['EXPOSURE'])
-                        sigrefState[1]['TP'], sigrefState[1]['EXPOSURE'] = self.cal.total_power(sigrefState[1]['cal_on']['DATA'],
-                                                                                                sigrefState[1]['cal_off']['DATA'],
-                                                                                                sigrefState[1]['cal_on']['EXPOSURE'],
-                                                                                                sigrefState[1]['cal_off']['EXPOSURE'])
+            for key in chunk:
+                chunk[key] = chunk[key] - first
 
-                    else:
-                        continue  # read more rows until we have all 4 states
+            # look for "bad" integrations: all NaNs, or all zeros in both noise diode states
+            bad = np.zeros(stopint - startint, dtype=bool)
+            for state in ('sig', 'ref'):
+                cal_on = data[chunk[state + '_on']]
+                cal_off = data[chunk[state + '_off']]
+                bad |= np.isnan(cal_on).all(axis=1) | np.isnan(cal_off).all(axis=1)
+                bad |= ((self.pu.nanptp(cal_off, axis=1) == 0) &
+                        (self.pu.nanptp(cal_on, axis=1) == 0))
+
+            # the row that completes each integration provides the output metadata
+            output_data = block[chunk['out']]
 
-                    # integration timestamp and elevation
-                    #  should be same for all states
-                    intTime = self.pu.dateToMjd(sigrefState[0]['cal_off']['DATE-OBS'])
-                    elevation = sigrefState[0]['cal_off']['ELEVATIO']
-                    receiver = sigrefState[0]['cal_off']['FRONTEND'].strip()
+            for idx in np.flatnonzero(bad):
+                self.log.doMessage('DBG', 'Bad integration. '
+                                   'Writing nan values to output.  Input rows',
+                                   rows[first + max(chunk['sig_on'][idx], chunk['sig_off'][idx])],
+                                   rows[first + max(chunk['ref_on'][idx], chunk['ref_off'][idx])])
 
-                    beam_scale = self.get_beam_scale(receiver, beam_scaling, feed, pol)
-                    ta, tsys, exposure = self.cal.ta_fs(sigrefState, beam_scale)
+                # create an output row with 'nan' data and real metadata
+                output_data['DATA'][idx] = float('nan')
 
-                    if self.cl.units != 'ta':
+            good = np.flatnonzero(~bad)
 
-                        if not self.OPACITY:
-                            intOpacity = self.weather.retrieve_zenith_opacity(intTime, obsfreqHz, self.log)
+            if len(good):
+
+                sigref_state = []
+                for state in ('sig', 'ref'):
+                    cal_on = chunk[state + '_on'][good]
+                    cal_off = chunk[state + '_off'][good]
+                    sigref_state.append({'cal_on': data[cal_on], 'cal_off': data[cal_off],
+                                         't_on': meta['EXPOSURE'][cal_on],
+                                         't_off': meta['EXPOSURE'][cal_off],
+                                         'TCAL': meta['TCAL'][cal_off],
+                                         'OBSFREQ': meta['OBSFREQ'][cal_off],
+                                         'CDELT1': meta['CDELT1'][cal_off]})
+
+                # the observed frequency is from the latest signal row
+                obsfreqHz = meta['OBSFREQ'][np.maximum(chunk['sig_on'], chunk['sig_off'])[good]]
+
+                # integration timestamp and elevation
+                #  should be same for all states
+                sig_off = chunk['sig_off'][good]
+                intTimes = self.pu.dateToMjd_array(meta['DATE-OBS'][sig_off])
+                elevations = meta['ELEVATIO'][sig_off]
+                receiver = meta['FRONTEND'][sig_off[0]].strip()
+
+                beam_scale = self.get_beam_scale(receiver, beam_scaling, feed, pol)
+                calibrated, tsys, exposure = self.cal.ta_fs_block(sigref_state, beam_scale)
+
+                if self.cl.units != 'ta':
+
+                    if not self.OPACITY:
+                        intOpacities = []
+                        for intTime, freq in zip(intTimes, obsfreqHz):
+                            intOpacity = self.weather.retrieve_zenith_opacity(intTime, freq, self.log)
                             if not intOpacity:
                                 self.log.doMessage('ERR', 'Not able to retrieve integration '
                                                    'zenith opacity for calibration to:', self.cl.units,
                                                    '\n  Please supply a zenith opacity or calibrate to Ta.')
                                 sys.exit(9)
-                        else:
-                            intOpacity = self.OPACITY
+                            intOpacities.append(intOpacity)
+                    else:
+                        intOpacities = np.ones(len(good)) * self.OPACITY
 
-                        opacity_el = self.cal.elevation_adjusted_opacity(intOpacity, elevation)
+                    opacity_el = self.cal.elevation_adjusted_opacity(np.asarray(intOpacities), elevations)
 
-                    if (self.cl.units == 'ta*') or (self.cl.units == 'tmb') or (self.cl.units == 'jy'):
-                        tastar = self.cal.ta_star(ta, opacity=opacity_el, spillover=self.SPILLOVER)
+                    opacity_el = opacity_el.reshape((len(good), 1)).astype(calibrated.dtype)
+                    calibrated = self.cal.ta_star(calibrated, opacity=opacity_el,
+                                                  spillover=self.SPILLOVER)
 
-                    if self.cl.units == 'tmb':
-                        main_beam_efficiency = self.cal.main_beam_efficiency(self.ETAB_REF, obsfreqHz)
-                        tmb = tastar / main_beam_efficiency
+                if self.cl.units == 'tmb':
+                    efficiencies = dict((freq, self.cal.main_beam_efficiency(self.ETAB_REF, freq))
+                                        for freq in np.unique(obsfreqHz))
+                    calibrated = calibrated / np.array([[efficiencies[freq]] for freq in obsfreqHz],
+                                                       dtype=calibrated.dtype)
 
-                    if self.cl.units == 'jy':
-                        aperture_efficiency = self.cal.aperture_efficiency(self.ETAA_REF, obsfreqHz)
-                        jy = tastar / (2.85 * aperture_efficiency)
+                elif self.cl.units == 'jy':
+                    efficiencies = dict((freq, self.cal.aperture_efficiency(self.ETAA_REF, freq))
+                                        for freq in np.unique(obsfreqHz))
+                    calibrated = calibrated / np.array([[2.85 * efficiencies[freq]] for freq in obsfreqHz],
+                                                       dtype=calibrated.dtype)
 
-                    # used these, so clear for the next iteration
-                    sigrefState = [{'cal_on': None, 'cal_off': None, 'TP': None},
-                                   {'cal_on': None, 'cal_off': None, 'TP': None}]
-
-                    # --------------------------------  write data out to FITS file
-
-                    if 'ta' == self.cl.units:
-                        row['DATA'] = ta
-                    elif 'ta*' == self.cl.units:
-                        row['DATA'] = tastar
-                    elif 'tmb' == self.cl.units:
-                        row['DATA'] = tmb
-                    elif 'jy' == self.cl.units:
-                        row['DATA'] = jy
-                    else:
-                        self.log.doMessage('ERR', 'units not recognized.  Can not write data.')
-                        sys.exit(9)
+                # --------------------------------  write data out to FITS file
 
-                    row['TSYS'] = tsys
-                    row['TUNIT7'] = self.cl.units.title()  # .title() makes first letter upper
-                    row['EXPOSURE'] = exposure
-                    row['OBSFREQ'] = obsfreqHz
-                    row['CRVAL1'] = obsfreqHz
+                output_data['DATA'][good] = calibrated
+                output_data['TSYS'][good] = tsys
+                output_data['TUNIT7'][good] = self.cl.units.title()  # .title() makes first letter upper
+                output_data['EXPOSURE'][good] = exposure
+                output_data['OBSFREQ'][good] = obsfreqHz
+                output_data['CRVAL1'][good] = obsfreqHz
 
-                    output_data[outputidx] = row.data
+            yield output_data
 
-                    outputidx = outputidx + 1
+            self.show_progress(stopint, nintegrations)
 
-                    self.show_progress(outputidx, rows2write)
+    def pair_cal_states(self, cal_states, cal_switching):
+        """Pair up the noise diode states of the integrations in a scan
 
-                    # done looping over rows in a chunk
+        Follows the same rules as reading the rows one at a time: the most
+        recent noise diode on and off integrations make a pair, and the row
+        that completes a pair provides the metadata for the calibrated row.
 
-                # done looping over chunks
-                self.outfile[-1].append(output_data)
-                self.outfile.update_hdu_list()
+        Keyword arguments:
+        cal_states -- the CAL column value of each row in the scan
+        cal_switching -- True if the noise diode is firing
 
-                # done looping over rows in a chunk
+        Returns:
+        arrays of indices, into cal_states, of the noise diode on rows (None
+        when not cal switching), the noise diode off rows and the output rows
 
-            # done looping over chunks
+        """
+        on_idx = []
+        off_idx = []
+        out_idx = []
 
-        self.outfile.close()
+        cal_on = None
+        cal_off = None
+        for idx, state in enumerate(cal_states):
+            if state.strip() == 'T':
+                cal_on = idx
+            else:
+                cal_off = idx
+
+            if cal_switching and cal_off is not None and cal_on is not None:
+                on_idx.append(cal_on)
+                off_idx.append(cal_off)
+                out_idx.append(idx)
+                # used these, so clear for the next pair
+                cal_on = None
+                cal_off = None
+            elif not cal_switching and cal_off is not None:
+                off_idx.append(cal_off)
+                out_idx.append(idx)
+
+        if cal_switching:
+            on_idx = np.array(on_idx, dtype=int)
+        else:
+            on_idx = None
+
+        return on_idx, np.array(off_idx, dtype=int), np.array(out_idx, dtype=int)
 
     def calibrate_ps_sdfits_integrations(self, feed, window, pol,
                                          avgCref1, avgTsys1, crefTime1, refTambient1,
@@ -576,273 +950,282 @@ class MappingPipeline:
         else:
             self.log.doMessage('DBG', 'calibrating feed', feed, 'window', window, 'polarization', pol)
 
+        if self.cl.units not in ('ta', 'tsrc', 'ta*', 'tmb', 'jy'):
+            self.log.doMessage('ERR', 'units not recognized.  Can not write data.')
+            sys.exit(9)
+
+        self.open_output()
+
+        tsky_refs = None
         if self.cl.units != 'ta' and self.cl.tsky:
             tsky1, tsky2 = self.getReferenceTsky(feed, window, pol, crefTime1, refTambient1, refElevation1,
                                                  crefTime2, refTambient2, refElevation2)
+            if not tsky1:
+                self.log.doMessage('ERR', 'no reference tsky value')
+                sys.exit()
+            tsky_refs = (tsky1, tsky2)
 
-        for scan in self.cl.mapscans:
-
-            try:
-                signalRows = self.row_list.get(scan, feed, window, pol)
-            except:
-                self.log.doMessage('WARN', '{t.bold}WARNING{t.normal}: '
-                                   'Scan {scan} not found.'.format(scan=scan, t=self.term))
-                continue
-
-            # get integration rows
-            rows = signalRows['ROW']
-            ext = signalRows['EXTENSION']
-
-            columns = tuple(self.infile[ext].get_colnames())
+        references = [(avgCref1, avgTsys1, crefTime1, refExposure1)]
+        if (avgCref2 is not None) and (crefTime2 is not None):
+            references.append((avgCref2, avgTsys2, crefTime2, refExposure2))
 
-            if CREATE_PLOTS:
-                tas = []
-                tsrcs = []
-                tastars = []
-                tmbs = []
-                jys = []
-                exposures = []
+        # smooth the references once for this feed, window and polarization
+        #   rather than for every integration
+        reference = self.reference_key(references, tsky_refs)
+        references = self.cal.prepare_references(references)
 
-            if CREATE_PLOTS:
-                ref_tsyss = []
+        # a resumed output is continued only with the same references
+        if self.committed_scans and reference != self.resumed_reference:
+            self.log.doMessage('WARN', 'References differ from those', self.outfilename,
+                               'was started with.\nCalibrating it from the start.')
+            self.restart_output()
 
-            cal_switching, sigref = self.determineSetup(rows, ext)
+        obsfreqHz = None
+        if self.cl.units != 'ta':
+            obsfreqHz = self.getObsFreq(feed, window, pol)
 
-            cal_on = None
-            cal_off = None
+        # with --scan-workers, the scans are calibrated in worker processes
+        scan_results = self.fan_out_scans(lambda scan: list(self.calibrate_ps_scan(scan, feed, window, pol,
+                                                                                   references, tsky_refs,
+                                                                                   obsfreqHz)),
+                                          feed, window, pol)
 
-            # break the input rows into chunks as buffers to write out
-            #   so that we don't write out rows one at a time
-            rowchunks = self.set_row_chunks(rows, self.BUFFER_SIZE)
+        for scan in self.cl.mapscans:
 
-            outputidx = 0
+            # let the caller step through the scans, e.g. to calibrate the
+            #  same scan for other feeds/windows/polarizations next
+            yield scan
 
-            for chunk in rowchunks:
+            # already in a resumed output
+            if scan in self.committed_scans:
+                continue
 
-                rows2write = self.nOutputRows(chunk, cal_switching, sigref)
+            if scan_results is None:
+                outputs = self.calibrate_ps_scan(scan, feed, window, pol, references, tsky_refs,
+                                                 obsfreqHz)
+            else:
+                outputs = scan_results.next()
 
-                output_data = np.zeros(rows2write, dtype=dtype)
+            # make some scan summary information for plotting
 
-                # now start at the beginning and calibrate all the integrations
-                for rowNum in chunk:
+            if CREATE_PLOTS:
+                outputs = list(outputs)
 
-                    row = Integration(self.infile[ext][columns][rowNum])
+            start = self.nrows_written
+            self.write_outputs(outputs)
+            self.commit_scan(scan, start, reference)
 
-                    if row['CAL'] == 'T':
-                        cal_on = row
-                    else:
-                        cal_off = row
+            if CREATE_PLOTS and outputs:
+                calibrated_integrations = np.concatenate([output['DATA'] for output in outputs])
+                ref_tsyss = np.ones(len(calibrated_integrations)) * avgTsys1
+                exposures = np.concatenate([output['EXPOSURE'] for output in outputs])
+                averaged_integrations = self.cal.average_spectra(calibrated_integrations, ref_tsyss, exposures)
+                pylab.plot(averaged_integrations, label=str(scan)+' tsys('+str(ref_tsyss.mean())[:5]+')')
 
-                    csig = None
+        if CREATE_PLOTS:
+            pylab.ylabel(self.cl.units)
+            pylab.xlabel('channel')
+            pylab.legend(title='scan', loc='upper right')
+            pylab.savefig('calibratedScans_f'+str(feed)+'_w'+str(window)+'_p'+str(pol)+'.png')
+            pylab.clf()
 
-                    if cal_switching and cal_off and cal_on:
-                        # noise diode is being fired during signal integrations
+        # done with scans
+        self.close_output(feed, window, pol)
 
-                        csig, sig_exposure = self.cal.total_power(cal_on['DATA'], cal_off['DATA'],
-                                                                  cal_on['EXPOSURE'], cal_off['EXPOSURE'])
+    def calibrate_ps_scan(self, scan, feed, window, pol, references, tsky_refs, obsfreqHz):
+        """Calibrate the integrations of one position-switched map scan.
 
-                        if CREATE_PLOTS:
-                            exposures.append(sig_exposure)
+        This is a generator of the calibrated output rows, a block at a
+        time, to be written in order.  Nothing is generated if the scan
+        is not found.
 
-                    # if there is more than one row, this isn't the last one, this and the next are CAL=='F',
-                    #    then the diode is not firing
-                    elif not cal_switching:
-                        csig, sig_exposure = cal_off['DATA'], cal_off['EXPOSURE']
+        Keyword arguments:
+        scan -- map scan number
+        feed, window, pol -- the feed, window and polarization
+        references -- references prepared by Calibration.prepare_references
+        tsky_refs -- sky temperatures of the references, or None
+        obsfreqHz -- observed frequency, or None for units of ta
 
-                    # we are cal switching but we only have one cal state,
-                    #   then read the next row
-                    else:
-                        continue
+        """
+        try:
+            signalRows = self.row_list.get(scan, feed, window, pol)
+        except:
+            self.log.doMessage('WARN', '{t.bold}WARNING{t.normal}: '
+                               'Scan {scan} not found.'.format(scan=scan, t=self.term))
+            return
 
-                    if csig is not None:
-
-                        intTime = self.pu.dateToMjd(cal_off['DATE-OBS'])  # integration timestamp
-                        elevation = cal_off['ELEVATIO']  # integration elevation
-                        receiver = cal_off['FRONTEND'].strip()
-
-                        if (avgCref2 is not None) and (crefTime2 is not None):
-                            crefInterp = \
-                                self.cal.interpolate_by_time(avgCref1, avgCref2,
-                                                             crefTime1, crefTime2, intTime)
-
-                            avgTsysInterp = \
-                                self.cal.interpolate_by_time(avgTsys1, avgTsys2,
-                                                             crefTime1, crefTime2, intTime)
-                            if refExposure2:
-                                refExposure = (refExposure1+refExposure2)/2.
-                            else:
-                                refExposure = refExposure1
-                            ta, exposure = self.cal.antenna_temp(avgTsysInterp, csig, crefInterp,
-                                                                 sig_exposure, refExposure)
-                            tsys = avgTsysInterp
-                        else:
-                            if refExposure2:
-                                refExposure = (refExposure1+refExposure2)/2.
-                            else:
-                                refExposure = refExposure1
-
-                            ta, exposure = self.cal.antenna_temp(avgTsys1, csig, avgCref1,
-                                                                 sig_exposure, refExposure)
-
-                            tsys = avgTsys1
-
-                        if CREATE_PLOTS:
-                            tas.append(ta)
-
-                        if CREATE_PLOTS:
-                            ref_tsyss.append(avgTsys1)
-
-                        if self.cl.units != 'ta':
-
-                            obsfreqHz = self.getObsFreq(feed, window, pol)
-
-                            if self.cl.tsky:
-                                if tsky1 and tsky2:
-                                    # get interpolated reference tsky value
-                                    tsky_ref = self.cal.interpolate_by_time(tsky1, tsky2,
-                                                                            crefTime1, crefTime2, intTime)
-                                elif tsky1 and not tsky2:
-                                    tsky_ref = tsky1
-                                else:
-                                    self.log.doMessage('ERR', 'no reference tsky value')
-                                    sys.exit()
-
-                            # ASSUMES a given opacity
-                            #   the opacity needs to come from the command line or Ron's
-                            #   model database.
-                            if not self.OPACITY:
-                                intOpacity = self.weather.retrieve_zenith_opacity(intTime, obsfreqHz, self.log)
-                                if not intOpacity:
-                                    self.log.doMessage('ERR', 'Not able to retrieve integration zenith opacity for calibration to:', self.cl.units, '\n  Please supply a zenith opacity or calibrate to Ta.')
-                                    sys.exit(9)
-                                else:
-                                    if 0 == outputidx:
-                                        self.log.doMessage('DBG', ('Zenith opacity, win {win} feed {feed} pol {pol} '
-                                                                   'scan {scan} freq {freq} time {time}:'.format(win=window, scan=scan, freq=obsfreqHz,
-                                                                                                                 feed=feed, pol=pol, time=intTime)), intOpacity)
-                            else:
-                                intOpacity = self.OPACITY
-
-                            opacity_el = self.cal.elevation_adjusted_opacity(intOpacity, elevation)
-
-                            tsrc = ta
-
-                            if self.cl.tsky:
-                                # get tsky for the current integration
-                                tambient_current = cal_off['TAMBIENT']
-                                tsky_current = self.cal.tsky(tambient_current, obsfreqHz, opacity_el)
-
-                                tsky_correction = self.cal.tsky_correction(tsky_current, tsky_ref, self.SPILLOVER)
-
-                                tsrc -= tsky_correction
-
-                            if CREATE_PLOTS:
-                                tsrcs.append(tsrc)
-
-                        if (self.cl.units == 'ta*') or (self.cl.units == 'tmb') or (self.cl.units == 'jy'):
-                            # ASSUMES GAIN COEFFICIENTS and a given opacity
-                            #   the opacity needs to come from the command line or Ron's
-                            #   model database.  Gain coefficients can optionally come
-                            #   from the command line.
-
-                            tastar = self.cal.ta_star(tsrc, opacity=opacity_el, spillover=self.SPILLOVER)
-
-                            if CREATE_PLOTS:
-                                tastars.append(tastar)
-
-                        if self.cl.units == 'tmb':
-                            # ASSUMES a reference value for etaB.  This should be made available
-                            #   at the command line.  The assumed value is for KFPA only.
-                            main_beam_efficiency = self.cal.main_beam_efficiency(self.ETAB_REF, obsfreqHz)
-                            tmb = tastar / main_beam_efficiency
-
-                            if CREATE_PLOTS:
-                                tmbs.append(tmb)
-
-                        if self.cl.units == 'jy':
-                            # ASSUMES a reference value for etaA.  This should be made available
-                            #   at the command line.  The assumed value is for KFPA only.
-                            aperture_efficiency = self.cal.aperture_efficiency(self.ETAA_REF, obsfreqHz)
-                            jy = tastar / (2.85 * aperture_efficiency)
-
-                            if CREATE_PLOTS:
-                                jys.append(jy)
-
-                        # used these, so clear for the next iteration
-                        cal_off = None
-                        cal_on = None
-
-                        # --------------------------------  write data out to FITS file
-
-                        if 'ta' == self.cl.units:
-                            row['DATA'] = ta
-                        elif 'tsrc' == self.cl.units:
-                            row['DATA'] = tsrc
-                        elif 'ta*' == self.cl.units:
-                            row['DATA'] = tastar
-                        elif 'tmb' == self.cl.units:
-                            row['DATA'] = tmb
-                        elif 'jy' == self.cl.units:
-                            row['DATA'] = jy
-                        else:
-                            self.log.doMessage('ERR', 'units not recognized.  Can not write data.')
-                            sys.exit(9)
+        # get integration rows
+        rows = signalRows['ROW']
+        ext = signalRows['EXTENSION']
 
-                        row['TSYS'] = tsys
-                        row['TUNIT7'] = self.cl.units.title()
-                        row['EXPOSURE'] = exposure
+        columns = tuple(self.infile[ext].get_colnames())
 
-                    output_data[outputidx] = row.data
+        cal_switching, sigref = self.determineSetup(rows, ext)
 
-                    outputidx = outputidx + 1
+        # pair the noise diode states for the whole scan, then
+        #   calibrate the pairs a block at a time
+        metadata = self.get_metadata(ext)
+        calstates = metadata[rows]
+        on_idx, off_idx, out_idx = self.pair_cal_states(calstates['CAL'], cal_switching)
 
-                    self.show_progress(outputidx, rows2write)
+        npairs = len(out_idx)
+        if cal_switching:
+            pairs_per_chunk = max(self.BUFFER_SIZE / 2, 1)
+        else:
+            pairs_per_chunk = self.BUFFER_SIZE
 
-                # done looping over a chunk
+        for startpair in range(0, npairs, pairs_per_chunk):
 
-                self.outfile[-1].append(output_data)
-                self.outfile.update_hdu_list()
+            stoppair = min(startpair + pairs_per_chunk, npairs)
 
-            # done looping over a scan
+            chunk_off = off_idx[startpair:stoppair]
+            chunk_out = out_idx[startpair:stoppair]
+            first = chunk_off.min()
+            if cal_switching:
+                chunk_on = on_idx[startpair:stoppair]
+                first = min(first, chunk_on.min())
+            last = chunk_out.max()
 
-            # make some scan summary information for plotting
+            block, data = self.read_scan_rows(scan, feed, window, pol, ext, rows,
+                                              first, last + 1, columns)
+            meta = metadata[rows[first:last + 1]]
 
-            if CREATE_PLOTS:
-                if self.cl.units == 'ta':
-                    tas = np.array(tas)
-                    calibrated_integrations = tas
+            cal_off = chunk_off - first
+            if cal_switching:
+                cal_on = chunk_on - first
+                on_data, on_exposure = data[cal_on], meta['EXPOSURE'][cal_on]
+            else:
+                on_data, on_exposure = None, None
+
+            # integration timestamps and elevations
+            intTimes = self.pu.dateToMjd_array(meta['DATE-OBS'][cal_off])
+            elevations = meta['ELEVATIO'][cal_off]
+
+            zenith_opacities = None
+            if self.cl.units != 'ta':
+                # ASSUMES a given opacity
+                #   the opacity needs to come from the command line or Ron's
+                #   model database.
+                if not self.OPACITY:
+                    zenith_opacities = []
+                    for intTime in intTimes:
+                        intOpacity = self.weather.retrieve_zenith_opacity(intTime, obsfreqHz, self.log)
+                        if not intOpacity:
+                            self.log.doMessage('ERR', 'Not able to retrieve integration zenith opacity for calibration to:', self.cl.units, '\n  Please supply a zenith opacity or calibrate to Ta.')
+                            sys.exit(9)
+                        zenith_opacities.append(intOpacity)
+                    if 0 == startpair:
+                        self.log.doMessage('DBG', ('Zenith opacity, win {win} feed {feed} pol {pol} '
+                                                   'scan {scan} freq {freq} time {time}:'.format(win=window, scan=scan, freq=obsfreqHz,
+                                                                                                 feed=feed, pol=pol, time=intTimes[0])), zenith_opacities[0])
+                else:
+                    zenith_opacities = np.ones(len(intTimes)) * self.OPACITY
+
+            # ASSUMES GAIN COEFFICIENTS and a given opacity
+            #   the opacity needs to come from the command line or Ron's
+            #   model database.  Gain coefficients can optionally come
+            #   from the command line.
+            calibrated, tsys, exposure = \
+                self.cal.calibrate_ps_block(on_data, data[cal_off],
+                                            on_exposure, meta['EXPOSURE'][cal_off],
+                                            intTimes, references, self.cl.units,
+                                            obsfreqHz, zenith_opacities, elevations,
+                                            meta['TAMBIENT'][cal_off], tsky_refs,
+                                            self.SPILLOVER, self.ETAB_REF, self.ETAA_REF,
+                                            smoothed=True)
+
+            # --------------------------------  write data out to FITS file
+
+            # the row that completes each pair provides the output metadata
+            output_data = block[chunk_out - first]
+
+            output_data['DATA'] = calibrated
+            output_data['TSYS'] = tsys
+            output_data['TUNIT7'] = self.cl.units.title()  # .title() makes first letter upper
+            output_data['EXPOSURE'] = exposure
+
+            yield output_data
+
+            self.show_progress(stoppair, npairs)
+
+    def fan_out_scans(self, calibrate_scan, feed, window, pol):
+        """Start calibrating the map scans in worker processes, with --scan-workers.
+
+        The scans are independent once the references are known, so
+        several can be calibrated at once.  Each worker opens its own
+        input file, and the calibrated rows of each scan are sent back
+        to this process, which writes them to the output file in scan
+        order.
+
+        Not used when the scans come from a demultiplexer (--single-pass)
+        or there is only one scan.
+
+        Keyword arguments:
+        calibrate_scan -- function of a scan number, returning a list of
+                          the scan's calibrated output rows
+        feed, window, pol -- the feed, window and polarization
+
+        Returns:
+        an iterator of calibrate_scan's result for each map scan not
+        already in a resumed output, in order, or None to calibrate the
+        scans in this process
+
+        """
+        scans = [scan for scan in self.cl.mapscans if scan not in self.committed_scans]
+        nworkers = self.cl.scan_workers
+        if not nworkers or nworkers < 2 or self.demux is not None or len(scans) < 2:
+            return None
 
-                elif self.cl.units == 'tsrc':
-                    tsrcs = np.array(tsrcs)
-                    calibrated_integrations = tsrcs
+        # read the scalar metadata before the workers start, so they share it
+        for scan in scans:
+            try:
+                self.get_metadata(self.row_list.get(scan, feed, window, pol)['EXTENSION'])
+            except KeyError:
+                continue
 
-                elif self.cl.units == 'ta*':
-                    tastars = np.array(tastars)
-                    calibrated_integrations = tastars
+        pool = OrderedPool(nworkers, initializer=self.reopen_input)
+        return pool.imap(calibrate_scan, scans)
 
-                elif self.cl.units == 'tmb':
-                    tmbs = np.array(tmbs)
-                    calibrated_integrations = tmbs
+    def reopen_input(self):
+        """Open the input file again, e.g. in a worker process, so its reads
+        do not share a file position with other processes."""
+        self.infile = fitsio.FITS(self.infilename)
 
-                elif self.cl.units == 'jy':
-                    jys = np.array(jys)
-                    calibrated_integrations = jys
+    def write_outputs(self, outputs):
+        """Append blocks of calibrated rows to the output file"""
+        for output_data in outputs:
+            self.outfile[-1].append(output_data)
+            self.outfile.update_hdu_list()
+            if self.first_output is None and len(output_data):
+                self.first_output = output_data[:1].copy()
+            self.nrows_written += len(output_data)
 
-            if CREATE_PLOTS:
-                ref_tsyss = np.array(ref_tsyss)
-                exposures = np.array(exposures)
-                averaged_integrations = self.cal.average_spectra(calibrated_integrations, ref_tsyss, exposures)
-                pylab.plot(averaged_integrations, label=str(scan)+' tsys('+str(ref_tsyss.mean())[:5]+')')
+    def close_output(self, feed, window, pol):
+        """Close the output file, and record it in the manifest, if any
 
-        if CREATE_PLOTS:
-            pylab.ylabel(self.cl.units)
-            pylab.xlabel('channel')
-            pylab.legend(title='scan', loc='upper right')
-            pylab.savefig('calibratedScans_f'+str(feed)+'_w'+str(window)+'_p'+str(pol)+'.png')
-            pylab.clf()
+        The output is marked complete with its build key, and its
+        checkpoint is no longer needed.
 
-        # done with scans
+        """
+        self.outfile[0].write_key('PIPEHASH', self.build_key,
+                                  comment='hash of the calibration inputs')
         self.outfile.close()
+        self.checkpoint.remove()
+        self.record_output(feed, window, pol)
+
+    def record_output(self, feed, window, pol):
+        """Record the output file in the manifest, if any"""
+        if MappingPipeline.MANIFEST is None:
+            return
+        source, restfreq = None, None
+        if self.first_output is not None:
+            source = self.first_output['OBJECT'][0].strip()
+            restfreq = float(self.first_output['RESTFREQ'][0])
+        MappingPipeline.MANIFEST.add(self.outfilename, feed=int(feed), window=int(window), pol=int(pol),
+                                     start=int(self.cl.mapscans[0]), end=int(self.cl.mapscans[-1]),
+                                     nchans=int(self.nchans), nrows=int(self.nrows_written),
+                                     object=source, restfreq=restfreq,
+                                     build_key=self.build_key)
 
     def show_progress(self, outputidx, rows2write):
         percent_done = int((outputidx/float(rows2write))*100)
@@ -857,14 +1240,36 @@ class MappingPipeline:
                                       avgCref2=None, avgTsys2=None, crefTime2=None, refTambient2=None,
                                       refElevation2=None, refExposure2=None, beam_scaling=None):
 
+        for scan in self.calibrate_sdfits_scans(feed, window, pol,
+                                                avgCref1, avgTsys1, crefTime1, refTambient1,
+                                                refElevation1, refExposure1,
+                                                avgCref2, avgTsys2, crefTime2, refTambient2,
+                                                refElevation2, refExposure2, beam_scaling):
+            pass
+
+    def calibrate_sdfits_scans(self, feed, window, pol,
+                               avgCref1=None, avgTsys1=None, crefTime1=None, refTambient1=None,
+                               refElevation1=None, refExposure1=None,
+                               avgCref2=None, avgTsys2=None, crefTime2=None, refTambient2=None,
+                               refElevation2=None, refExposure2=None, beam_scaling=None):
+        """Calibrate the map scans one at a time, as calibrate_sdfits_integrations.
+
+        This is a generator that yields each map scan number just before
+        the scan is calibrated, so the caller can interleave the scans of
+        several feeds/windows/polarizations.
+
+        """
         if avgCref1 is not None:
-            self.calibrate_ps_sdfits_integrations(feed, window, pol,
-                                                  avgCref1, avgTsys1, crefTime1, refTambient1,
-                                                  refElevation1, refExposure1,
-                                                  avgCref2, avgTsys2, crefTime2, refTambient2,
-                                                  refElevation2, refExposure2)
+            scans = self.calibrate_ps_sdfits_integrations(feed, window, pol,
+                                                          avgCref1, avgTsys1, crefTime1, refTambient1,
+                                                          refElevation1, refExposure1,
+                                                          avgCref2, avgTsys2, crefTime2, refTambient2,
+                                                          refElevation2, refExposure2)
         else:
-            self.calibrate_fs_sdfits_integrations(feed, window, pol, beam_scaling)
+            scans = self.calibrate_fs_sdfits_integrations(feed, window, pol, beam_scaling)
+
+        for scan in scans:
+            yield scan
 
     def __del__(self):
         pass
@@ -22,9 +22,10 @@
 
 # $Id$
 
-from ordereddict import OrderedDict
 from collections import namedtuple
 
+import numpy as np
+
 
 class ObservationRows:
     """Store index file information.
@@ -36,23 +37,52 @@ class ObservationRows:
        This is essientially a table of the raw SDFITS file rows, organized
        with a lookup key of scan/feed/window/polarization.
 
-       When rows are added to this object (addRow), the FITS extension,
-       row of the FITS table and scan type are stored.
+       When rows are added to this object (addRow or addRows), the FITS
+       extension, row of the FITS table and scan type are stored.
+
+       The table is kept in arrays: one entry per key, sorted by
+       scan/feed/window/polarization, with offsets into a single array
+       of row numbers that holds the rows of each key in file order.
+       Rows added with addRow are gathered and sorted into the table the
+       next time it is read.
 
        A list of rows for each scan/feed/window/polarization can be
        retrieved with the 'get' method.
 
     """
     def __init__(self):
-        self.rows = OrderedDict()
         self.Key = namedtuple('key', 'scan, feed, window, polarization')
 
+        # one entry per key, sorted by key
+        self.key_scans = np.zeros(0, dtype=np.int64)
+        self.key_feeds = np.zeros(0, dtype=np.int64)
+        self.key_windows = np.zeros(0, dtype=np.int64)
+        self.key_pols = np.zeros(0, dtype=np.int64)
+        self.extensions = np.zeros(0, dtype=np.int64)
+        self.obsids = np.zeros(0, dtype=str)
+        self.procnames = np.zeros(0, dtype=str)
+        self.procscans = np.zeros(0, dtype=str)
+        self.nchans = np.zeros(0, dtype=str)
+
+        # rows of key i are row_numbers[offsets[i]:offsets[i + 1]]
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.row_numbers = np.zeros(0, dtype=np.int64)
+
+        self._pending = []   # added rows not yet in the table, as column arrays
+        self._lookup = None  # key tuple -> key index
+        self._unique = {}    # cached scans(), feeds(), windows() and pols()
+
     def __repr__(self):
         return ('Scans: {0}\nFeeds: {1}\nWindows: {2}\nPols: {3}'.format(self.scans(),
                                                                          self.feeds(),
                                                                          self.windows(),
                                                                          self.pols()))
 
+    def __len__(self):
+        """Number of scan/feed/window/polarization keys."""
+        self._build()
+        return len(self.key_scans)
+
     def addRow(self, scan, feed, window, polarization,
                fitsExtension, rowOfFitsFile, obsid,
                procname, procscan, nchans):
@@ -62,49 +92,187 @@ class ObservationRows:
            row of the FITS table and scan type are stored.
 
         """
+        self._pending.append([np.asarray([value]) for value in
+                              (scan, feed, window, polarization, fitsExtension,
+                               rowOfFitsFile, obsid, procname, procscan, nchans)])
+        self._lookup = None
+        self._unique = {}
 
-        key = self.Key(scan, feed, window, polarization)
+    def addRows(self, scans, feeds, windows, polarizations,
+                fitsExtensions, rowsOfFitsFile, obsids,
+                procnames, procscans, nchans):
+        """Add many rows at once, given as equal length arrays.
 
-        if key in self.rows:
-            self.rows[key]['ROW'].append(rowOfFitsFile)
+           The result is the same as calling addRow for each row in
+           order: rows are kept in file order, and the extension and
+           scan type come from the first row of each key.
+
+        """
+        if 0 == len(scans):
+            return
+        self._pending.append([np.asarray(column) for column in
+                              (scans, feeds, windows, polarizations, fitsExtensions,
+                               rowsOfFitsFile, obsids, procnames, procscans, nchans)])
+        self._lookup = None
+        self._unique = {}
+
+        # sort them in now, rather than holding on to the per-row columns
+        self._build()
+
+    def _build(self):
+        """Sort any added rows into the table."""
+        if not self._pending:
+            return
+
+        # the rows already in the table come first, in key order, then the
+        #   added rows in the order they were added
+        counts = np.diff(self.offsets)
+        table = [np.repeat(column, counts) for column in
+                 (self.key_scans, self.key_feeds, self.key_windows, self.key_pols,
+                  self.extensions)]
+        table.append(self.row_numbers)
+        table += [np.repeat(column, counts) for column in
+                  (self.obsids, self.procnames, self.procscans, self.nchans)]
+        columns = [np.concatenate([table[idx]] + [chunk[idx] for chunk in self._pending])
+                   for idx in range(len(table))]
+        self._pending = []
+
+        scans, feeds, windows, pols, extensions, rows = [column.astype(np.int64)
+                                                         for column in columns[:6]]
+        obsids, procnames, procscans, nchans = [column.astype(str) for column in columns[6:]]
+
+        # sort by key, keeping rows of the same key in their original order.
+        #   The key columns are packed into a single integer when they fit.
+        combined = np.zeros(len(scans), dtype=np.int64)
+        size = 1
+        for column in (scans, feeds, windows, pols):
+            span = int(column.max()) - int(column.min()) + 1
+            size *= span
+            combined = combined * span + (column - column.min())
+        if size < 2**62:
+            order = np.argsort(combined, kind='mergesort')
+            keys = (combined[order],)
         else:
-            self.rows[key] = {'EXTENSION': fitsExtension,
-                              'ROW': [rowOfFitsFile],
-                              'OBSID': obsid,
-                              'PROCNAME': procname,
-                              'PROCSCAN': procscan,
-                              'NCHANS': nchans}
+            order = np.lexsort((np.arange(len(scans)), pols, windows, feeds, scans))
+            keys = (scans[order], feeds[order], windows[order], pols[order])
+        newkey = np.zeros(len(order), dtype=bool)
+        newkey[0] = True
+        for column in keys:
+            newkey[1:] |= column[1:] != column[:-1]
+        starts = np.flatnonzero(newkey)
+
+        # the first row of each key gives its extension and scan type
+        first = order[starts]
+        self.key_scans = scans[first]
+        self.key_feeds = feeds[first]
+        self.key_windows = windows[first]
+        self.key_pols = pols[first]
+        self.extensions = extensions[first]
+        self.obsids = obsids[first]
+        self.procnames = procnames[first]
+        self.procscans = procscans[first]
+        self.nchans = nchans[first]
+
+        self.offsets = np.append(starts, len(order)).astype(np.int64)
+        self.row_numbers = rows[order]
+
+    # arrays that hold the table, for as_arrays and load_arrays
+    ARRAYS = ('key_scans', 'key_feeds', 'key_windows', 'key_pols', 'extensions',
+              'obsids', 'procnames', 'procscans', 'nchans', 'offsets', 'row_numbers')
+
+    def as_arrays(self):
+        """Return the table as a dictionary of numpy arrays, e.g. for numpy.savez."""
+        self._build()
+        return dict((name, getattr(self, name)) for name in self.ARRAYS)
+
+    def load_arrays(self, arrays):
+        """Replace the table with arrays from as_arrays."""
+        for name in self.ARRAYS:
+            setattr(self, name, np.asarray(arrays[name]))
+        self._pending = []
+        self._lookup = None
+        self._unique = {}
+
+    def _key_index(self):
+        """Dictionary of key tuple to key index."""
+        self._build()
+        if self._lookup is None:
+            self._lookup = dict(zip(zip(self.key_scans.tolist(), self.key_feeds.tolist(),
+                                        self.key_windows.tolist(), self.key_pols.tolist()),
+                                    range(len(self.key_scans))))
+        return self._lookup
 
     def get(self, scan, feed, window, polarization):
         """Retreive a list of rows for scan/feed/win/pol.
 
+           Returns a dictionary with the FITS extension (EXTENSION), the
+           table rows (ROW, an int64 array) and the scan type (OBSID,
+           PROCNAME, PROCSCAN) and number of channels (NCHANS).  Raises
+           KeyError if there are no rows for the key.
+
         """
         try:
-            key = (scan, feed, window, polarization)
-            return self.rows[key]
+            idx = self._key_index()[(scan, feed, window, polarization)]
         except(KeyError):
-            raise
+            raise KeyError(self.Key(scan, feed, window, polarization))
+
+        return {'EXTENSION': int(self.extensions[idx]),
+                'ROW': self.row_numbers[self.offsets[idx]:self.offsets[idx + 1]],
+                'OBSID': str(self.obsids[idx]),
+                'PROCNAME': str(self.procnames[idx]),
+                'PROCSCAN': str(self.procscans[idx]),
+                'NCHANS': str(self.nchans[idx])}
+
+    def keys(self):
+        """Return a list of the (scan, feed, window, polarization) keys, in sorted order.
+
+        """
+        self._build()
+        return [self.Key(*key) for key in zip(self.key_scans.tolist(), self.key_feeds.tolist(),
+                                              self.key_windows.tolist(), self.key_pols.tolist())]
+
+    def scan_table(self):
+        """Return the scan type of every scan, in scan order.
+
+        The type comes from the first feed/window/polarization of the
+        scan, which is the lowest feed, window and polarization number.
+
+        Returns:
+        arrays of the scan numbers, OBSID, PROCNAME and PROCSCAN values
+
+        """
+        self._build()
+        first = np.ones(len(self.key_scans), dtype=bool)
+        first[1:] = self.key_scans[1:] != self.key_scans[:-1]
+        return (self.key_scans[first], self.obsids[first],
+                self.procnames[first], self.procscans[first])
+
+    def _unique_values(self, name):
+        self._build()
+        if name not in self._unique:
+            self._unique[name] = np.unique(getattr(self, name)).tolist()
+        return list(self._unique[name])
 
     def scans(self):
         """Return a list of scans in the observation.
 
         """
-        return sorted(list(set([xx.scan for xx in self.rows.keys()])))
+        return self._unique_values('key_scans')
 
     def feeds(self):
         """Return a list of feeds in the observation.
 
         """
-        return list(set([xx.feed for xx in self.rows.keys()]))
+        return self._unique_values('key_feeds')
 
     def windows(self):
         """Return a list of windows in the observation.
 
         """
-        return list(set([xx.window for xx in self.rows.keys()]))
+        return self._unique_values('key_windows')
 
     def pols(self):
         """Return a list of polarizations in the observation.
 
         """
-        return list(set([xx.polarization for xx in self.rows.keys()]))
+        return self._unique_values('key_pols')
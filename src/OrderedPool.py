@@ -0,0 +1,140 @@
+# Copyright (C) 2007 Associated Universities, Inc. Washington DC, USA.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+# Correspondence concerning GBT software should be addressed as follows:
+#       GBT Operations
+#       National Radio Astronomy Observatory
+#       P. O. Box 2
+#       Green Bank, WV 24944-0002 USA
+
+# $Id$
+
+import multiprocessing
+import sys
+import traceback
+from Queue import Empty
+
+
+class OrderedPool:
+    """Call a function on many items in worker processes, in order.
+
+       imap() forks the workers, which take the items one at a time and
+       send back what the function returns.  The results are handed back
+       in the order of the items, whatever order the workers finish
+       them in, so the caller can write them out as they come (e.g. the
+       calibrated scans of a map, in scan order).
+
+       The function and items are not pickled, since the workers are
+       forked, but the results are, to send them back.  Only a few items
+       more than the number of workers are handed out ahead of the next
+       result due, which bounds the results held waiting for a slow one.
+
+       If the function raises an exception or calls sys.exit() for an
+       item, the workers are stopped when that item's result is due, and
+       imap() raises RuntimeError or SystemExit.
+
+    """
+
+    def __init__(self, nworkers, initializer=None, lookahead=None):
+        """
+        Args:
+            nworkers: (int) number of worker processes
+            initializer: function called in each worker when it starts,
+                e.g. to open its own input file.  Default is none.
+            lookahead: (int) most items handed out beyond the next result
+                due.  Default is twice the number of workers.
+
+        """
+        self.nworkers = max(1, nworkers)
+        self.initializer = initializer
+        self.lookahead = lookahead or 2 * self.nworkers
+
+        self.tasks = None
+        self.results = None
+        self.workers = []
+
+    def imap(self, function, items):
+        """Return function(item) for each item, in order.
+
+        This is a generator; the workers are forked on the first next().
+
+        """
+        items = list(items)
+        self.tasks = multiprocessing.Queue()
+        self.results = multiprocessing.Queue()
+        self.workers = [multiprocessing.Process(target=self._work, args=(function, items))
+                        for _ in range(min(self.nworkers, len(items)))]
+        for worker in self.workers:
+            # so that a worker left waiting for items is not waited for at exit
+            worker.daemon = True
+            worker.start()
+
+        try:
+            done = {}  # item number -> (status, result), waiting to be handed back
+            nsent = 0
+            for idx in range(len(items)):
+                while nsent < min(idx + self.lookahead + 1, len(items)):
+                    self.tasks.put(nsent)
+                    nsent += 1
+                while idx not in done:
+                    self._wait(done)
+
+                status, result = done.pop(idx)
+                if status == 'exit':
+                    raise SystemExit(result)
+                elif status == 'error':
+                    raise RuntimeError('item {0} failed:\n{1}'.format(idx, result))
+                yield result
+
+            for worker in self.workers:
+                self.tasks.put(None)
+            for worker in self.workers:
+                worker.join()
+        finally:
+            # stop any workers still running, e.g. after a failure
+            for worker in self.workers:
+                if worker.is_alive():
+                    worker.terminate()
+                    worker.join()
+            self.workers = []
+            self.tasks = None
+            self.results = None
+
+    def _wait(self, done):
+        """Wait for the next result from the workers"""
+        try:
+            idx, status, result = self.results.get(timeout=1)
+            done[idx] = (status, result)
+        except Empty:
+            if not all(worker.is_alive() for worker in self.workers):
+                raise RuntimeError('a worker process exited unexpectedly')
+
+    def _work(self, function, items):
+        """Call the function for each item number from the task queue (in a worker)"""
+        if self.initializer is not None:
+            self.initializer()
+        while True:
+            idx = self.tasks.get()
+            if idx is None:
+                break
+            try:
+                result = ('ok', function(items[idx]))
+            except SystemExit as err:
+                result = ('exit', err.code)
+            except Exception:
+                result = ('error', traceback.format_exc())
+            sys.stdout.flush()
+            self.results.put((idx,) + result)
@@ -88,6 +88,61 @@ class Pipeutils:
         mjd = jd - 2400000.5
         return mjd
 
+    def dateToMjd_array(self, dateStrings):
+        """Convert a column of FITS DATE strings to Modified Julian Dates
+
+        Same arithmetic as dateToMjd, done on whole arrays, so the results
+        agree with dateToMjd bit for bit.  The seconds are parsed as an
+        integer number of their last decimal place, which converts to the
+        same (correctly rounded) value as float() of the string.
+
+        Keyword arguments:
+        dateStrings -- array or list of FITS format date strings,
+                       ie. '2009-02-10T21:09:00.08'
+
+        Returns:
+        numpy float64 array of Modified Julian Dates
+
+        """
+        dates = np.char.strip(np.atleast_1d(np.asarray(dateStrings, dtype=str)))
+        ndates = len(dates)
+        if 0 == ndates:
+            return np.zeros(0)
+
+        chars = dates.view('S1').reshape((ndates, dates.itemsize))
+        digits = chars.view(np.uint8).astype(np.int64) - ord('0')
+
+        def field(start, stop):
+            value = np.zeros(ndates, dtype=np.int64)
+            for col in range(start, stop):
+                value = value * 10 + digits[:, col]
+            return value
+
+        dd = field(8, 10)
+        mm = field(5, 7)
+        yyyy = field(0, 4)
+        hh = field(11, 13).astype(float)
+        minute = field(14, 16).astype(float)
+
+        # seconds: all the digits as one integer, scaled by the number of
+        #   digits after the decimal point
+        sec_digits = digits[:, 17:]
+        isdigit = (sec_digits >= 0) & (sec_digits <= 9)
+        fractional = isdigit & (np.cumsum(chars[:, 17:] == '.', axis=1) > 0)
+        value = np.zeros(ndates, dtype=np.int64)
+        for col in range(sec_digits.shape[1]):
+            value = np.where(isdigit[:, col], value * 10 + sec_digits[:, col], value)
+        sec = value / 10. ** fractional.sum(axis=1)
+
+        UT = hh+minute/60+sec/3600
+
+        sig = np.where((100 * yyyy + mm - 190002.5) > 0, 1, -1)
+
+        JD = (367 * yyyy - (7 * (yyyy + (mm + 9) // 12)) // 4 +
+              (275 * mm) // 9 + dd + 1721013.5 + UT / 24 - 0.5 * sig + 0.5)
+
+        return JD - 2400000.5
+
     def _hz2wavelength(self, f):
         """Simple frequency (Hz) to wavelength conversion
 
@@ -116,3 +171,71 @@ class Pipeutils:
 
         """
         return np.ma.masked_array(array, np.isnan(array))
+
+    def nan_array(self, array):
+        """Plain array with nans in place of any masked values
+
+        Keywords:
+        array -- (numpy nd array or masked array)
+
+        Returns:
+        numpy nd array, where masked values (if any) are nans
+
+        """
+        if isinstance(array, np.ma.MaskedArray):
+            if array.dtype.kind != 'f':
+                array = array.astype(float)
+            return array.filled(np.nan)
+        return np.asarray(array)
+
+    def nanmean(self, array, axis=None):
+        """Mean of the values that are not nans
+
+        Keywords:
+        array -- (numpy nd array)
+        axis -- axis to average over, default all values
+
+        Returns:
+        the mean, which is nan where every value is nan
+
+        """
+        array = np.asarray(array)
+        valid = ~np.isnan(array)
+        total = np.where(valid, array, 0).sum(axis=axis)
+        count = valid.sum(axis=axis)
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+    def nan_average(self, arrays, weights, axis=0):
+        """Weighted average of the values that are not nans
+
+        Keywords:
+        arrays -- (numpy nd array) values to average
+        weights -- (numpy nd array) weights that broadcast against arrays
+        axis -- axis to average over
+
+        Returns:
+        the weighted average, which is nan where every value is nan
+
+        """
+        arrays = np.asarray(arrays, dtype=float)
+        valid = ~np.isnan(arrays)
+        weights = np.where(valid, weights, 0)
+        total = (np.where(valid, arrays, 0) * weights).sum(axis=axis)
+        weight_sum = weights.sum(axis=axis)
+        return np.where(weight_sum > 0, total / np.where(weight_sum > 0, weight_sum, 1), np.nan)
+
+    def nanptp(self, array, axis=None):
+        """Range (maximum - minimum) of the values that are not nans
+
+        Keywords:
+        array -- (numpy nd array)
+        axis -- axis along which to find the range, default all values
+
+        Returns:
+        the range, which is -inf where every value is nan
+
+        """
+        array = np.asarray(array)
+        valid = ~np.isnan(array)
+        return (np.where(valid, array, -np.inf).max(axis=axis) -
+                np.where(valid, array, np.inf).min(axis=axis))
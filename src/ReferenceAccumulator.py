@@ -0,0 +1,131 @@
+# Copyright (C) 2007 Associated Universities, Inc. Washington DC, USA.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+# Correspondence concerning GBT software should be addressed as follows:
+#       GBT Operations
+#       National Radio Astronomy Observatory
+#       P. O. Box 2
+#       Green Bank, WV 24944-0002 USA
+
+# $Id$
+
+import numpy as np
+
+
+class ReferenceAccumulator:
+    """Average the total power integrations of a reference scan as they are read.
+
+       Rather than collecting every reference integration and averaging
+       them at the end, running sums are kept in float64 so that memory
+       use is one spectrum per feed/window/polarization, no matter how
+       long the reference scan is.
+
+       Integrations are weighted by exposure / tsys**2, as in
+       Calibration.make_weights, and the sums are accumulated in the
+       order the integrations are added.  The averages are the same as
+       those computed by Calibration.getReferenceAverage from the full
+       list of integrations.
+
+       With ignore_nan, NaN channels are left out of the average spectrum
+       (and the sum of weights is kept per channel), as the NaN-native
+       calibration path does.
+
+    """
+    def __init__(self, ignore_nan=False):
+        self.ignore_nan = ignore_nan
+        self.count = 0
+        self.spectrum_sum = None  # sum of weight * spectrum, per channel
+        self.spectrum_weight_sum = None  # sum of weights per channel, with ignore_nan
+        self.weight_sum = 0.       # sum of weights
+        self.tsys_sq_sum = 0.      # sum of weight * tsys**2
+        self.exposure_sum = 0.
+        self.timestamp_sum = 0.
+        self.tambient_sum = 0.
+        self.elevation_sum = 0.
+
+    def __len__(self):
+        return self.count
+
+    def add(self, crefs, tsyss, exposures, timestamps, tambients, elevations):
+        """Add one or more reference integrations to the running sums.
+
+        Keyword arguments:
+        crefs -- total power spectrum, or a 2d block with one spectrum per row
+        tsyss -- system temperature(s)
+        exposures -- exposure time(s)
+        timestamps -- MJD timestamp(s)
+        tambients -- ambient temperature(s) in Kelvin
+        elevations -- elevation(s) in degrees
+
+        """
+        crefs = np.atleast_2d(np.asarray(crefs, dtype=float))
+        tsyss = np.atleast_1d(np.asarray(tsyss, dtype=float))
+        exposures = np.atleast_1d(np.asarray(exposures, dtype=float))
+
+        weights = exposures / tsyss**2
+
+        # seed each sum with the running total so the additions happen in
+        #   the same order as averaging the full list of integrations
+        weighted = crefs * weights[:, np.newaxis]
+        if self.ignore_nan:
+            valid = ~np.isnan(crefs)
+            weighted[~valid] = 0
+            channel_weights = valid * weights[:, np.newaxis]
+            if self.spectrum_weight_sum is not None:
+                channel_weights = np.vstack(([self.spectrum_weight_sum], channel_weights))
+            self.spectrum_weight_sum = np.add.reduce(channel_weights, axis=0)
+        if self.spectrum_sum is not None:
+            weighted = np.vstack(([self.spectrum_sum], weighted))
+        self.spectrum_sum = np.add.reduce(weighted, axis=0)
+
+        self.weight_sum = self._running_sum(self.weight_sum, weights)
+        self.tsys_sq_sum = self._running_sum(self.tsys_sq_sum, tsyss**2 * weights)
+        self.exposure_sum = self._running_sum(self.exposure_sum, exposures)
+        self.timestamp_sum = self._running_sum(self.timestamp_sum, timestamps)
+        self.tambient_sum = self._running_sum(self.tambient_sum, tambients)
+        self.elevation_sum = self._running_sum(self.elevation_sum, elevations)
+
+        self.count += len(crefs)
+
+    def _running_sum(self, total, values):
+        values = np.atleast_1d(np.asarray(values, dtype=float))
+        if self.count == 0:
+            return np.add.reduce(values)
+        return np.add.reduce(np.concatenate(([total], values)))
+
+    def average(self):
+        """Return the averages of everything added so far.
+
+        Returns:
+        average spectrum, average system temperature, average timestamp,
+        average ambient temperature, average elevation and total exposure,
+        in the same form as Calibration.getReferenceAverage
+
+        """
+        if self.ignore_nan:
+            has_weight = self.spectrum_weight_sum > 0
+            avg_cref = np.where(has_weight,
+                                self.spectrum_sum / np.where(has_weight, self.spectrum_weight_sum, 1),
+                                np.nan)
+        else:
+            avg_cref = np.ma.masked_array(self.spectrum_sum / self.weight_sum)
+        avg_tsys = np.sqrt(self.tsys_sq_sum / self.weight_sum)
+
+        avg_timestamp = self.timestamp_sum / self.count
+        avg_tambient = self.tambient_sum / self.count
+        avg_elevation = self.elevation_sum / self.count
+
+        return avg_cref, avg_tsys, avg_timestamp, avg_tambient, avg_elevation, self.exposure_sum
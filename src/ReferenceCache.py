@@ -0,0 +1,140 @@
+# Copyright (C) 2007 Associated Universities, Inc. Washington DC, USA.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+# Correspondence concerning GBT software should be addressed as follows:
+#       GBT Operations
+#       National Radio Astronomy Observatory
+#       P. O. Box 2
+#       Green Bank, WV 24944-0002 USA
+
+# $Id$
+
+import hashlib
+import os
+import tempfile
+import zipfile
+
+import numpy as np
+
+
+class ReferenceCache:
+    """Averaged reference scans, kept to be reused by other maps.
+
+       Consecutive maps often share a reference scan: the trailing
+       reference of one map is the leading reference of the next (see
+       SdFits.find_maps).  Each map averages its references for every
+       feed, window and polarization, so the cache keeps the averages,
+       which are then used rather than reading and averaging the same
+       scan again.
+
+       A reference is kept with the averaged spectrum, system
+       temperature, timestamp, ambient temperature, elevation and
+       exposure, under a key made by key() from everything the average
+       depends on.  The averages are held in memory, and written to a
+       directory if one is given, so that maps calibrated in other
+       processes, or in later runs, can use them.  Each reference is
+       a .npz file there, written under a temporary name and renamed,
+       so a reader never sees one partly written.
+
+    """
+
+    def __init__(self, directory=None):
+        """
+        Args:
+            directory: (str) where the references are written and looked
+                for.  Default is none, to keep them only in memory.
+
+        """
+        self.directory = directory
+        self.references = {}
+
+    @staticmethod
+    def key(*parts):
+        """Key of a reference made from everything it depends on.
+
+        Args:
+            parts: e.g. the input file, scan, feed, window, polarization
+                and calibration options.  Their repr() must identify them.
+
+        Returns:
+        a (str) key
+
+        """
+        return hashlib.sha1(repr(parts)).hexdigest()
+
+    def filename(self, key):
+        """Name of the file a reference is kept in"""
+        return os.path.join(self.directory, key + '.npz')
+
+    def get(self, key):
+        """Look up a reference.
+
+        Args:
+            key: (str) reference key, from key()
+
+        Returns:
+        the reference (tuple) of average spectrum, tsys, timestamp,
+        ambient temperature, elevation and exposure, or None if it is
+        not in the cache
+
+        """
+        if key in self.references:
+            return self.references[key]
+        if self.directory is None or not os.path.exists(self.filename(key)):
+            return None
+
+        try:
+            stored = np.load(self.filename(key))
+            try:
+                spectrum = stored['spectrum']
+                if stored['masked']:
+                    spectrum = np.ma.masked_array(spectrum, mask=stored['mask'])
+                scalars = [float(value) for value in stored['scalars']]
+            finally:
+                stored.close()
+        except (IOError, ValueError, KeyError, zipfile.BadZipfile):
+            # e.g. left by an older version of the pipeline
+            return None
+
+        reference = tuple([spectrum] + scalars)
+        self.references[key] = reference
+        return reference
+
+    def put(self, key, reference):
+        """Keep a reference.
+
+        Args:
+            key: (str) reference key, from key()
+            reference: (tuple) average spectrum, tsys, timestamp, ambient
+                temperature, elevation and exposure
+
+        """
+        self.references[key] = reference
+        if self.directory is None:
+            return
+
+        spectrum = reference[0]
+        fd, tmpname = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as stored:
+                np.savez(stored, spectrum=np.ma.getdata(spectrum),
+                         mask=np.ma.getmaskarray(spectrum),
+                         masked=np.ma.isMaskedArray(spectrum),
+                         scalars=np.array(reference[1:], dtype=float))
+            os.rename(tmpname, self.filename(key))
+        except:
+            os.unlink(tmpname)
+            raise
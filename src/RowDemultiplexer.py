@@ -0,0 +1,148 @@
+# Copyright (C) 2007 Associated Universities, Inc. Washington DC, USA.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+# Correspondence concerning GBT software should be addressed as follows:
+#       GBT Operations
+#       National Radio Astronomy Observatory
+#       P. O. Box 2
+#       Green Bank, WV 24944-0002 USA
+
+# $Id$
+
+import fitsio
+import numpy as np
+
+from SdFitsIO import SdFits
+
+
+class RowDemultiplexer:
+    """Read each scan of an SDFITS file once for many feed/window/polarization streams.
+
+       The rows of a scan are interleaved by feed, window, polarization
+       and noise diode state.  Rather than each stream reading its own
+       rows out of the table, the rows of every stream are read together,
+       in file order, and each stream's rows are then picked out of the
+       scan in the order they appear in the index (file order), which is
+       the order the calibration expects.  Windows with different numbers
+       of channels are in different extensions, which are read separately.
+
+       One scan is held at a time, so the streams should be calibrated
+       scan by scan (see gbt_pipeline.calibrate_single_pass).  Asking for
+       a different scan replaces the one held.
+
+    """
+    def __init__(self, infilename, row_list, streams):
+        """
+        Args:
+            infilename: (str) SDFITS file name
+            row_list: ObservationRows of the file
+            streams: (list) of (feed, window, pol) tuples to read rows for
+
+        """
+        self.infilename = infilename
+        self.row_list = row_list
+        self.streams = list(streams)
+        self.sdf = SdFits()
+
+        self.infile = None
+        self.scan = None
+        self.blocks = {}    # ext -> every row read for the scan, in file order
+        self.index = {}     # stream -> (ext, positions in the block of the stream's rows)
+        self.nreads = 0     # number of scans read
+
+    def read(self, scan, feed, window, pol, start=None, stop=None):
+        """Return rows of a scan for one stream.
+
+        Args:
+            scan: (int) scan number
+            feed, window, pol: (int) the stream
+            start, stop: positions of the first and one past the last row
+                wanted, among the rows of this stream's scan (ObservationRows
+                get()['ROW'][start:stop]).  Default is all of them.
+
+        Returns:
+        a structured array of the rows, with all columns of the table, and
+        a 2-D (n_integrations, n_channels) view of its DATA column
+
+        """
+        if scan != self.scan:
+            self.read_scan(scan)
+
+        ext, positions = self.index[(feed, window, pol)]
+        block = self.blocks[ext][positions[start:stop]]
+        return block, block['DATA'].reshape((len(block), -1))
+
+    def scan_rows(self, scan):
+        """The rows of every stream for a scan.
+
+        Returns:
+        a (dict) of extension -> {stream: rows of the stream}
+
+        """
+        stream_rows = {}
+        for stream in self.streams:
+            try:
+                rows = self.row_list.get(scan, *stream)
+            except KeyError:
+                continue
+            stream_rows.setdefault(rows['EXTENSION'], {})[stream] = rows['ROW']
+        return stream_rows
+
+    def scan_nbytes(self, scan):
+        """Number of bytes of table rows read for a scan, by extension."""
+        if self.infile is None:
+            self.infile = fitsio.FITS(self.infilename)
+        return dict((ext, len(np.unique(np.concatenate(ext_rows.values()))) *
+                     self.infile[ext].get_rec_dtype()[0].itemsize)
+                    for ext, ext_rows in self.scan_rows(scan).items())
+
+    def read_scan(self, scan):
+        """Read the rows of every stream for a scan.
+
+        The rows are kept in blocks, by extension, with index giving the
+        extension and the positions in the block of each stream's rows.
+        Raises KeyError if none of the streams have rows in the scan.
+
+        """
+        self.scan = None
+        self.blocks = {}
+        self.index = {}
+
+        stream_rows = self.scan_rows(scan)
+        if not stream_rows:
+            raise KeyError(scan)
+
+        if self.infile is None:
+            self.infile = fitsio.FITS(self.infilename)
+
+        # read the rows of all the streams at once, in file order; most
+        #  of a scan is one run of consecutive rows
+        for ext, ext_rows in sorted(stream_rows.items()):
+            rows = np.unique(np.concatenate(ext_rows.values()))
+            self.blocks[ext], _ = self.sdf.read_scan_block(self.infile[ext], rows)
+            for stream, srows in ext_rows.items():
+                self.index[stream] = (ext, np.searchsorted(rows, srows))
+        self.scan = scan
+        self.nreads += 1
+
+    def close(self):
+        """Close the input file and drop the scan held."""
+        if self.infile is not None:
+            self.infile.close()
+            self.infile = None
+        self.scan = None
+        self.blocks = {}
+        self.index = {}
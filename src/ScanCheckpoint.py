@@ -0,0 +1,116 @@
+# Copyright (C) 2007 Associated Universities, Inc. Washington DC, USA.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+# Correspondence concerning GBT software should be addressed as follows:
+#       GBT Operations
+#       National Radio Astronomy Observatory
+#       P. O. Box 2
+#       Green Bank, WV 24944-0002 USA
+
+# $Id$
+
+import json
+import os
+
+
+class ScanCheckpoint:
+    """Checkpoint records of the scans written to a calibrated output file.
+
+       A record is added as each map scan is completed, after its rows
+       are flushed to the output file.  It has the scan number, the
+       range of output rows it wrote, the build key of the output and
+       the state of the references used to calibrate it.  Checkpoints
+       are only written with --resume.  A run that is stopped partway
+       through a map leaves the output file and its checkpoint, and
+       when the run is repeated the output is reopened, the last
+       committed scan is checked against the rows in the file, and
+       calibration continues with the next scan.
+
+       The checkpoint is a text file next to the output file, with one
+       JSON record per line.  It is removed when the output is complete.
+
+    """
+
+    # appended to the output file name
+    SUFFIX = '.checkpoint'
+
+    def __init__(self, outfilename):
+        """
+        Args:
+            outfilename: (str) calibrated output file name
+
+        """
+        self.filename = outfilename + self.SUFFIX
+
+    def exists(self):
+        """True if there is a checkpoint file"""
+        return os.path.exists(self.filename)
+
+    def add(self, scan, start, end, build_key, reference=None):
+        """Add the record of a completed scan.
+
+        The record is on disk when this returns.
+
+        Args:
+            scan: (int) map scan number
+            start: (int) first output row of the scan
+            end: (int) output row after the last one of the scan, i.e. the
+                number of rows in the output when the scan was committed
+            build_key: (str) build key of the output
+            reference: (str) key of the reference state used, if any
+
+        """
+        record = {'scan': int(scan), 'start': int(start), 'end': int(end),
+                  'build_key': build_key, 'reference': reference}
+        line = json.dumps(record, sort_keys=True) + '\n'
+
+        fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, line)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def last(self, build_key):
+        """The record of the last scan committed with a build key.
+
+        Args:
+            build_key: (str) build key of the output
+
+        Returns:
+        the last (dict) record, or None if no scan was committed with
+        this build key
+
+        """
+        if not self.exists():
+            return None
+
+        latest = None
+        with open(self.filename) as checkpoint:
+            for line in checkpoint:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # e.g. a partly written line from a run that was killed
+                    continue
+                if record.get('build_key') == build_key:
+                    latest = record
+        return latest
+
+    def remove(self):
+        """Remove the checkpoint file, if any"""
+        if self.exists():
+            os.unlink(self.filename)
@@ -25,8 +25,14 @@
 import os
 import sys
 import re
+import mmap
+import tempfile
+import time
 from collections import namedtuple
 
+import numpy as np
+import fitsio
+
 from Calibration import Calibration
 from Pipeutils import Pipeutils
 from ObservationRows import ObservationRows
@@ -60,10 +66,115 @@ class SdFits:
 
     """
 
+    # when a block of rows breaks up into more than this many runs of
+    #  consecutive rows, read it with one scattered-row read instead of
+    #  one range read per run
+    MAX_RANGE_READS = 16
+
+    # scalar columns used to set up and calibrate integrations
+    METADATA_COLUMNS = ('CAL', 'SIG', 'DATE-OBS', 'ELEVATIO', 'TAMBIENT', 'OBSFREQ',
+                        'CRVAL1', 'CDELT1', 'TCAL', 'EXPOSURE', 'FRONTEND', 'OBJECT')
+
+    # index file columns used to build the ObservationRows
+    INDEX_COLUMNS = ('SCAN', 'PROCEDURE', 'FDNUM', 'IFNUM', 'PLNUM', 'EXT', 'ROW',
+                     'OBSID', 'PROCSCAN', 'NUMCHN', 'RESTFREQ')
+
+    # scalar SDFITS columns read to index a file without an index file
+    FITS_INDEX_COLUMNS = ('SCAN', 'FDNUM', 'IFNUM', 'PLNUM', 'PROCNAME', 'OBSMODE',
+                          'PROCSCAN', 'OBSID', 'RESTFREQ')
+
+    # version of the parsed index cache file layout
+    INDEX_CACHE_VERSION = 1
+
     def __init__(self):
 
         self.pu = Pipeutils()
 
+    def row_runs(self, rows):
+        """Group row numbers into runs of consecutive rows.
+
+        Args:
+            rows: (list of ints) row numbers in the order they are wanted
+
+        Returns:
+        a (list) of (start, stop) tuples, one per run, where stop is
+        one past the last row of the run
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if 0 == len(rows):
+            return []
+
+        breaks = np.nonzero(np.diff(rows) != 1)[0] + 1
+        starts = np.concatenate(([0], breaks))
+        ends = np.concatenate((breaks, [len(rows)]))
+
+        return [(int(rows[start]), int(rows[end - 1]) + 1) for start, end in zip(starts, ends)]
+
+    def read_scan_block(self, hdu, rows, columns=None):
+        """Read a block of rows (e.g. a scan or a chunk of one) from a table.
+
+        Runs of consecutive row numbers are merged into a single range
+        read, so a contiguous scan costs one fitsio call instead of one
+        call per row.  Rows that are spread thinly through the table,
+        as they are for a single feed/window/polarization of a KFPA or
+        VEGAS scan, are read with a single scattered-row read.
+
+        Args:
+            hdu: fitsio table HDU, e.g. fitsio.FITS(filename)[ext]
+            rows: (list of ints) table row numbers, in the order wanted
+            columns: (tuple of str) columns to read.  Default is all columns.
+
+        Returns:
+        a structured array with one element per requested row, and a
+        2-D (n_integrations, n_channels) view of its DATA column
+        (or None if DATA was not read)
+
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        if columns is None:
+            columns = tuple(hdu.get_colnames())
+        columns = list(columns)
+
+        runs = self.row_runs(rows)
+
+        if len(runs) > self.MAX_RANGE_READS:
+            # fitsio returns scattered rows sorted and unique, so put them
+            #  back into the requested order
+            unique_rows = np.unique(rows)
+            block = hdu.read(columns=columns, rows=unique_rows)
+            block = block[np.searchsorted(unique_rows, rows)]
+        elif 1 == len(runs):
+            start, stop = runs[0]
+            block = hdu[columns][start:stop]
+        else:
+            block = np.concatenate([hdu[columns][start:stop] for start, stop in runs])
+
+        if 'DATA' in block.dtype.names:
+            data = block['DATA'].reshape((len(block), -1))
+        else:
+            data = None
+
+        return block, data
+
+    def read_metadata(self, hdu, columns=METADATA_COLUMNS):
+        """Read the scalar metadata columns of a whole table.
+
+        Only the listed columns are read, so the spectra are never
+        touched.  Columns that are not in the table are left out.
+
+        Args:
+            hdu: fitsio table HDU, e.g. fitsio.FITS(filename)[ext]
+            columns: (tuple of str) scalar columns to read
+
+        Returns:
+        a structured array with one element per table row, indexed by
+        table row number
+
+        """
+        colnames = hdu.get_colnames()
+        return hdu.read(columns=[col for col in columns if col in colnames])
+
     def find_maps(self, indexfile, debug=False):
         """Find mapping blocks. Also find samplers used in each map
 
@@ -71,6 +182,20 @@ class SdFits:
             indexfile: input required to search for maps and samplers
             debug: optional debug flag
 
+        Returns:
+        a (list) of map blocks, as find_maps_in_rows
+
+        """
+        observation, summary = self.parseSdfitsIndex(indexfile)
+        return self.find_maps_in_rows(observation, debug)
+
+    def find_maps_in_rows(self, observation, debug=False):
+        """Find mapping blocks in an already parsed index.
+
+        Args:
+            observation: ObservationRows from parseSdfitsIndex
+            debug: optional debug flag
+
         Returns:
         a (list) of map blocks, with each entry a (tuple) of the form:
         (int) reference 1,
@@ -78,41 +203,33 @@ class SdFits:
         (int) reference 2
 
         """
-
-        map_scans = {}
-        observation, summary = self.parseSdfitsIndex(indexfile)
-        feed = observation.feeds()[0]
-        window = observation.windows()[0]
-        pol = observation.pols()[0]
+        scans, obsids, procnames, procscans = observation.scan_table()
 
         # print results
         if debug:
             print '------------------------- All scans'
-            for scanid in sorted(observation.scans()):
-                scanstruct = observation.get(scanid, feed, window, pol)
+            for scanid, obsid, procname, procscan in zip(scans, obsids, procnames, procscans):
                 print('scan \'{0}\' obsid \'{1}\' procname \'{2}\' procscan \'{3}\''.format(scanid,
-                                                                                            scanstruct['OBSID'],
-                                                                                            scanstruct['PROCNAME'],
-                                                                                            scanstruct['PROCSCAN']))
-
-        for scanid in observation.scans():
-            scanstruct = observation.get(scanid, feed, window, pol)
-            obsid = scanstruct['OBSID'].upper()
-            procname = scanstruct['PROCNAME'].upper()
-            procscan = scanstruct['PROCSCAN'].upper()
-
-            # keyword check should depend on presence of PROCSCAN key, which is an
-            # alternative to checking SDFITVER.
-            # OBSID is the old way, PROCSCAN is the new way MR8Q312
-
-            # create a new list that only has 'MAP' and 'OFF' scans
-            if not procscan and (obsid == 'MAP' or obsid == 'OFF'):
-                map_scans[scanid] = obsid
-            elif (procscan == 'MAP' or
-                  procname == 'TRACK' or
-                  (procname == 'ONOFF' and procscan == 'OFF') or
-                  (procname == 'OFFON' and procscan == 'OFF')):
-                map_scans[scanid] = procscan
+                                                                                            obsid,
+                                                                                            procname,
+                                                                                            procscan))
+
+        obsids = np.char.upper(obsids)
+        procnames = np.char.upper(procnames)
+        procscans = np.char.upper(procscans)
+
+        # keyword check should depend on presence of PROCSCAN key, which is an
+        # alternative to checking SDFITVER.
+        # OBSID is the old way, PROCSCAN is the new way MR8Q312
+
+        # keep only 'MAP' and 'OFF' scans
+        old_style = (procscans == '') & ((obsids == 'MAP') | (obsids == 'OFF'))
+        new_style = ((procscans == 'MAP') |
+                     (procnames == 'TRACK') |
+                     (((procnames == 'ONOFF') | (procnames == 'OFFON')) & (procscans == 'OFF')))
+        relevant = old_style | new_style
+        map_scans = dict(zip(scans[relevant].tolist(),
+                             np.where(old_style, obsids, procscans)[relevant].tolist()))
 
         mapkeys = map_scans.keys()
         mapkeys.sort()
@@ -172,83 +289,549 @@ class SdFits:
 
         return maps
 
-    def parseSdfitsIndex(self, infile, mapscans=[]):
+    def read_index_columns(self, infile, names=None):
+        """Read the [rows] section of an index file into column arrays.
+
+        The rows of an index file are fixed width, with the columns
+        laid out by the header line that follows '[rows]'.  The file is
+        memory mapped and each column is cut out of the whole section
+        at once as a fixed width string array.  If the rows are not all
+        the same length, they are read one line at a time instead.
+
+        Args:
+            infile: (str) index file name
+            names: (list of str) columns to read.  Default is all columns.
+
+        Returns:
+        a (dict) of column name to a numpy string array with one value
+        per row, as in the file (padded, not stripped)
+
+        """
+        ifile = open(infile)
+        try:
+            if 0 == os.path.getsize(infile):
+                return {}
+            mm = mmap.mmap(ifile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            ifile.close()
+
+        try:
+            # look for start of row data
+            rowstart = mm.find('[rows]')
+            if rowstart < 0:
+                return {}
+            headerstart = mm.find('\n', rowstart) + 1
+            if 0 == headerstart:
+                return {}
+            datastart = mm.find('\n', headerstart) + 1
+            if 0 == datastart:
+                return {}
+            header = mm[headerstart:datastart]
+
+            columns = {}
+            for mm_field in re.finditer(r' *\S+', header):
+                if names is None or mm_field.group().lstrip() in names:
+                    columns[mm_field.group().lstrip()] = (mm_field.start(), mm_field.end())
+
+            nbytes = len(mm) - datastart
+            if 0 == nbytes:
+                return dict((name, np.zeros(0, dtype='S1')) for name in columns)
+
+            linewidth = mm.find('\n', datastart) + 1 - datastart
+            if linewidth <= 0:
+                # at most one row, without an end of line
+                linewidth = nbytes + 1
+
+            if nbytes % linewidth and nbytes % linewidth != linewidth - 1:
+                return self._read_index_lines(mm[datastart:], columns)
+
+            # one row of characters per line; add the last end of line if needed
+            nrows = (nbytes + 1) / linewidth
+            if nbytes % linewidth:
+                data = np.empty(nrows * linewidth, dtype=np.uint8)
+                data[:nbytes] = np.frombuffer(mm, dtype=np.uint8, offset=datastart)
+                data[-1] = ord('\n')
+            else:
+                data = np.frombuffer(mm, dtype=np.uint8, offset=datastart)
+            data = data.reshape((nrows, linewidth))
+
+            if nrows and (data[:, -1] != ord('\n')).any():
+                return self._read_index_lines(mm[datastart:], columns)
+
+            for name, (start, stop) in columns.items():
+                stop = min(stop, linewidth - 1)
+                field = np.ascontiguousarray(data[:, start:max(start, stop)])
+                if field.shape[1]:
+                    columns[name] = field.view('S{0}'.format(field.shape[1])).reshape(nrows)
+                else:
+                    columns[name] = np.zeros(nrows, dtype='S1')
+        finally:
+            mm.close()
+
+        return columns
+
+    def _read_index_lines(self, text, columns):
+        """Read index rows one line at a time, when they are not fixed width.
+
+        Args:
+            text: (str) the rows of the index file
+            columns: (dict) column name to (start, stop) character positions
+
+        Returns:
+        a (dict) of column name to a numpy string array, as read_index_columns
+
+        """
+        lines = text.splitlines()
+        return dict((name, np.array([line[start:stop] for line in lines], dtype=str))
+                    for name, (start, stop) in columns.items())
 
+    def parseSdfitsIndex(self, infile, mapscans=[], use_cache=True):
+        """Read an index file into an ObservationRows table.
+
+        The parsed index is saved in a cache file next to the index
+        (see index_cache_name), and later calls read the cache instead,
+        as long as the size and modification time of the index file
+        have not changed.
+
+        Args:
+            infile: (str) index file name
+            mapscans: (list of ints) map scans, to warn about if they are skipped
+            use_cache: (bool) read and write the index cache
+
+        Returns:
+        an ObservationRows table and a summary (dict) of the spectral
+        windows, as (window, rest frequency in GHz) tuples, and feeds
+
+        """
         try:
-            ifile = open(infile)
-        except IOError:
+            indexstat = os.stat(infile)
+        except OSError:
             print("ERROR: Could not open file: {0}\n"
                   "Please check and try again.".format(infile))
-            raise
+            raise IOError('Could not open file: {0}'.format(infile))
+
+        parsed = None
+        if use_cache:
+            parsed = self._load_index_cache(infile, indexstat)
+        if parsed is None:
+            parsed = self._parse_index(infile)
+            if use_cache:
+                self._save_index_cache(infile, indexstat, *parsed)
+        observation, summary, suspect_scans = parsed
+        self._warn_suspect_scans(suspect_scans, mapscans)
 
-        observation = ObservationRows()
+        return observation, summary
 
-        while True:
-            line = ifile.readline()
-            # look for start of row data or EOF (i.e. not line)
-            if '[rows]' in line or not line:
+    def _warn_suspect_scans(self, suspect_scans, mapscans):
+        """Warn about map scans skipped for an "Unknown" procedure"""
+        for scanid in suspect_scans:
+            if mapscans and scanid in mapscans:
+                print 'WARNING: scan', scanid, 'has "Unknown" procedure. Skipping.'
+
+    def buildSdfitsIndex(self, fitsnames, indexfile=None, mapscans=[], use_cache=True):
+        """Index SDFITS files directly, for when there is no index file.
+
+        Only the scalar columns needed to build the ObservationRows
+        (see read_fits_index_columns) are read, from every binary table
+        extension, so the spectra are never touched.  The result is the
+        same as parsing the index file written by the sdfits filler.
+
+        Args:
+            fitsnames: (str or list of str) SDFITS file name(s).  Rows
+                of several files are indexed one file after another.
+            indexfile: (str) optional index file to write, so that later
+                runs can parse it (and its cache) instead
+            mapscans: (list of ints) map scans, to warn about if they are skipped
+            use_cache: (bool) also write the index cache for indexfile
+
+        Returns:
+        an ObservationRows table and a summary, as parseSdfitsIndex
+
+        """
+        if isinstance(fitsnames, basestring):
+            fitsnames = [fitsnames]
+
+        columns = {}
+        for fitsname in fitsnames:
+            for name, values in self.read_fits_index_columns(fitsname).items():
+                columns.setdefault(name, []).append(values)
+        columns = dict((name, np.concatenate(values)) for name, values in columns.items())
+        if columns:
+            columns['INDEX'] = np.arange(len(columns['SCAN']))
+
+        observation, summary, suspect_scans = self._parse_columns(columns)
+
+        if indexfile:
+            if self.write_index_file(indexfile, columns) and use_cache:
+                self._save_index_cache(indexfile, os.stat(indexfile),
+                                       observation, summary, suspect_scans)
+
+        self._warn_suspect_scans(suspect_scans, mapscans)
+
+        return observation, summary
+
+    def read_fits_index_columns(self, fitsname):
+        """Read the index columns of an SDFITS file from its scalar columns.
+
+        Each binary table extension is read column by column, for only
+        the columns in FITS_INDEX_COLUMNS.  The procedure name is the
+        PROCNAME column, or else the first part of OBSMODE, as the sdfits
+        filler does.  OBSID and PROCSCAN are blank if they are missing.
+
+        Args:
+            fitsname: (str) SDFITS file name
+
+        Returns:
+        a (dict) of index column name (INDEX_COLUMNS, plus FILE) to a
+        numpy array with one value per table row, in file order.  Number
+        columns are integer or float arrays and text columns are
+        stripped string arrays.
+
+        """
+        columns = {}
+        fits = fitsio.FITS(fitsname)
+        try:
+            for ext in range(1, len(fits)):
+                hdu = fits[ext]
+                if hdu.get_exttype() != 'BINARY_TBL' or 0 == hdu.get_nrows():
+                    continue
+                colnames = hdu.get_colnames()
+                table = hdu.read(columns=[col for col in self.FITS_INDEX_COLUMNS
+                                          if col in colnames])
+                nrows = len(table)
+
+                def text(name):
+                    if name in table.dtype.names:
+                        return self._map_runs(table[name], str.strip)
+                    return np.zeros(nrows, dtype='S1')
+
+                if 'PROCNAME' in table.dtype.names:
+                    procnames = text('PROCNAME')
+                else:
+                    procnames = self._map_runs(text('OBSMODE'), lambda mode: mode.split(':')[0])
+
+                nchan = 0
+                if 'DATA' in colnames:
+                    nchan = int(np.prod(hdu.get_rec_dtype()[0]['DATA'].shape))
+
+                values = {'SCAN': table['SCAN'], 'FDNUM': table['FDNUM'],
+                          'IFNUM': table['IFNUM'], 'PLNUM': table['PLNUM'],
+                          'EXT': np.repeat(ext, nrows), 'ROW': np.arange(nrows),
+                          'PROCEDURE': procnames, 'OBSID': text('OBSID'),
+                          'PROCSCAN': text('PROCSCAN'),
+                          'NUMCHN': np.repeat(str(nchan), nrows),
+                          'RESTFREQ': table['RESTFREQ'].astype(float),
+                          'FILE': np.repeat(os.path.basename(fitsname), nrows)}
+                for name, value in values.items():
+                    columns.setdefault(name, []).append(value)
+        finally:
+            fits.close()
+
+        return dict((name, np.concatenate(value)) for name, value in columns.items())
+
+    # columns written to an index file by write_index_file, in order
+    INDEX_FILE_COLUMNS = ('INDEX', 'FILE', 'EXT', 'ROW', 'SCAN', 'PROCEDURE', 'OBSID',
+                          'PROCSCAN', 'PLNUM', 'IFNUM', 'FDNUM', 'RESTFREQ', 'NUMCHN')
+
+    def write_index_file(self, indexfile, columns):
+        """Write index columns out as an index file.
+
+        The file has the layout of an sdfits filler index file, with the
+        columns in INDEX_FILE_COLUMNS, each right justified in a fixed
+        width field.  It is written to a temporary file and renamed, and
+        is not written at all if the directory is not writable.
+
+        Args:
+            indexfile: (str) index file name
+            columns: (dict) column name to array, as read_fits_index_columns
+
+        Returns:
+        True if the file was written
+
+        """
+        names = [name for name in self.INDEX_FILE_COLUMNS if name in columns]
+        nrows = len(columns[names[0]]) if names else 0
+
+        fields = []
+        for name in names:
+            values = columns[name]
+            if values.dtype.kind in 'iu':
+                text = self._format_integers(values)
+            elif values.dtype.kind == 'f':
+                text = self._format_runs(values, lambda value: repr(float(value)))
+            else:
+                text = self._format_runs(values, str)
+            fields.append((name, max(len(name), text.itemsize) + 1, text))
+
+        # the values are already right justified, so each one fills the
+        #  end of its field
+        header = ''.join(name.rjust(width) for name, width, _ in fields)
+        chars = np.empty((nrows, len(header) + 1), dtype=np.uint8)
+        chars.fill(ord(' '))
+        stop = 0
+        for name, width, text in fields:
+            stop += width
+            chars[:, stop - text.itemsize:stop] = text.view(np.uint8).reshape((nrows, text.itemsize))
+        chars[:, -1] = ord('\n')
+
+        try:
+            fd, tmpname = tempfile.mkstemp(prefix=os.path.basename(indexfile) + '.',
+                                           dir=os.path.dirname(os.path.abspath(indexfile)))
+        except (IOError, OSError):
+            return False
+        try:
+            with os.fdopen(fd, 'wb') as ofile:
+                ofile.write('[header]\ncreated = {0}\nversion = 1.7\n'
+                            '[rows]\n{1}\n'.format(time.ctime(), header))
+                ofile.write(chars.tostring())
+            os.chmod(tmpname, 0666 & ~self._umask())
+            os.rename(tmpname, indexfile)
+        except (IOError, OSError):
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+            return False
+
+        return True
+
+    def index_cache_name(self, infile):
+        """Name of the cache file for a parsed index file"""
+        return infile + '.npz'
+
+    def _load_index_cache(self, infile, indexstat):
+        """Read a parsed index from its cache file.
+
+        Returns:
+        the ObservationRows, summary and suspect scans, or None if there
+        is no cache or it is not for this version of the index file
+
+        """
+        try:
+            cache = np.load(self.index_cache_name(infile))
+            try:
+                arrays = dict((name, cache[name]) for name in cache.files)
+            finally:
+                cache.close()
+        except (IOError, OSError, ValueError, KeyError, EOFError):
+            return None
+
+        try:
+            if (int(arrays['cache_version']) != self.INDEX_CACHE_VERSION or
+                    str(arrays['path']) != os.path.abspath(infile) or
+                    int(arrays['size']) != indexstat.st_size or
+                    float(arrays['mtime']) != indexstat.st_mtime):
+                return None
+
+            observation = ObservationRows()
+            observation.load_arrays(arrays)
+            summary = {'WINDOWS': set(zip(arrays['summary_windows'].tolist(),
+                                          arrays['summary_freqs'].tolist())),
+                       'FEEDS': set(arrays['summary_feeds'].tolist())}
+        except KeyError:
+            return None
+
+        return observation, summary, arrays['suspect_scans'].tolist()
+
+    def _save_index_cache(self, infile, indexstat, observation, summary, suspect_scans):
+        """Write a parsed index to its cache file, if the directory is writable.
+
+        The cache is written to a temporary file and renamed, so that
+        other processes never read a partly written cache.
+
+        """
+        cachename = self.index_cache_name(infile)
+        windows = sorted(summary['WINDOWS'])
+        arrays = observation.as_arrays()
+        arrays.update({'cache_version': self.INDEX_CACHE_VERSION,
+                       'path': os.path.abspath(infile),
+                       'size': indexstat.st_size,
+                       'mtime': indexstat.st_mtime,
+                       'summary_windows': np.array([window for window, _ in windows], dtype=np.int64),
+                       'summary_freqs': np.array([freq for _, freq in windows], dtype=float),
+                       'summary_feeds': np.array(sorted(summary['FEEDS']), dtype=str),
+                       'suspect_scans': np.array(suspect_scans, dtype=np.int64)})
+        try:
+            fd, tmpname = tempfile.mkstemp(prefix=os.path.basename(cachename) + '.',
+                                           dir=os.path.dirname(os.path.abspath(cachename)))
+        except (IOError, OSError):
+            return
+        try:
+            with os.fdopen(fd, 'wb') as cachefile:
+                np.savez(cachefile, **arrays)
+            os.chmod(tmpname, 0666 & ~self._umask())
+            os.rename(tmpname, cachename)
+        except (IOError, OSError):
+            if os.path.exists(tmpname):
+                os.unlink(tmpname)
+
+    def _format_integers(self, values):
+        """Format an integer array as a numpy string array, in decimal"""
+        values = np.asarray(values, dtype=np.int64)
+        remaining = np.abs(values)
+        ndigits = len(str(int(remaining.max()))) if len(values) else 1
+        width = ndigits + int((values < 0).any())
+        chars = np.empty((len(values), width), dtype=np.uint8)
+        chars.fill(ord(' '))
+
+        # digits from the last one back, for as long as any value has them
+        show = np.ones(len(values), dtype=bool)
+        for col in range(width - 1, -1, -1):
+            if not show.any():
                 break
+            chars[show, col] = ord('0') + remaining[show] % 10
+            remaining //= 10
+            done = show & (remaining == 0)
+            sign = done & (values < 0)
+            if col and sign.any():
+                chars[sign, col - 1] = ord('-')
+            show &= remaining > 0
+        return chars.view('S{0}'.format(width)).reshape(len(values))
+
+    def _format_runs(self, values, function):
+        """Format column values, once per run of repeated values
+
+        Returns:
+        a numpy string array of the formatted values, right justified to
+        the length of the longest one
+
+        """
+        if 0 == len(values):
+            return np.zeros(0, dtype='S1')
+        changed = np.ones(len(values), dtype=bool)
+        changed[1:] = values[1:] != values[:-1]
+        text = [function(value) for value in values[changed]]
+        width = max([1] + [len(value) for value in text])
+        text = np.array([value.rjust(width) for value in text], dtype='S{0}'.format(width))
+        return text[np.cumsum(changed) - 1]
+
+    def _umask(self):
+        umask = os.umask(0)
+        os.umask(umask)
+        return umask
+
+    def _parse_index(self, infile):
+        """Parse the rows of an index file.
 
-        lookup_table = {}
-        header = ifile.readline()
+        Returns:
+        the ObservationRows, the summary and a list of the scans that were
+        skipped for an "Unknown" procedure, in file order
 
-        fields = [xx.lstrip() for xx in re.findall(r' *\S+', header)]
+        """
+        return self._parse_columns(self.read_index_columns(infile, self.INDEX_COLUMNS))
 
-        iterator = re.finditer(r' *\S+', header)
-        for idx, mm in enumerate(iterator):
-            lookup_table[fields[idx]] = slice(mm.start(), mm.end())
+    def _parse_columns(self, columns):
+        """Build the ObservationRows from index columns.
 
-        rr = SdFitsIndexRowReader(lookup_table)
+        Args:
+            columns: (dict) column name to array, from read_index_columns
+                or read_fits_index_columns
+
+        Returns:
+        the ObservationRows, the summary and a list of the scans that were
+        skipped for an "Unknown" procedure, in file order
 
+        """
+        observation = ObservationRows()
         summary = {'WINDOWS': set([]), 'FEEDS': set([])}
 
-        # keep a list of suspect scans so we can know if the
-        # user has already been warned
-        suspectScans = set()
+        if not columns or 0 == len(columns.values()[0]):
+            # no rows, or none of the columns we need
+            return observation, summary, []
 
-        for row in ifile:
+        nrows = len(columns.values()[0])
+        missing = np.zeros(nrows, dtype='S1')
 
-            rr.setrow(row)
+        def column(name):
+            return self._index_strings(columns.get(name, missing))
 
-            scanid = int(rr['SCAN'])
+        def number(name):
+            return self._index_numbers(columns.get(name, missing))
 
-            # have a look at the procedure
-            #  if it is "Unknown", the data is suspect, so skip it
-            procname = rr['PROCEDURE']
-            if scanid in suspectScans:
-                continue
+        scans = number('SCAN')
 
-            if ((scanid not in suspectScans) and procname.lower() == 'unknown'):
+        # have a look at the procedure
+        #  if it is "Unknown", the data is suspect, so skip it along with
+        #  the rest of the scan
+        procnames = column('PROCEDURE')
+        unknown = np.char.lower(procnames) == 'unknown'
+        unknown_rows = np.flatnonzero(unknown)
+        suspect_scans, first = np.unique(scans[unknown_rows], return_index=True)
+        first_unknown = unknown_rows[first]
 
-                suspectScans.add(scanid)
-                if scanid in mapscans:
-                    print 'WARNING: scan', scanid, 'has "Unknown" procedure. Skipping.'
-                continue
 
-            feed = int(rr['FDNUM'])
-            windowNum = int(rr['IFNUM'])
-            pol = int(rr['PLNUM'])
-            fitsExtension = int(rr['EXT'])
-            rowOfFitsFile = int(rr['ROW'])
-            obsid = rr['OBSID']
-            procscan = rr['PROCSCAN']
-            nchans = rr['NUMCHN']
+        keep = np.ones(nrows, dtype=bool)
+        if len(suspect_scans):
+            pos = np.minimum(np.searchsorted(suspect_scans, scans), len(suspect_scans) - 1)
+            keep = ~((suspect_scans[pos] == scans) & (np.arange(nrows) >= first_unknown[pos]))
 
-            summary['WINDOWS'].add((windowNum, float(rr['RESTFREQ'])/1e9))
-            summary['FEEDS'].add(rr['FDNUM'])
+        windows = number('IFNUM')[keep]
+        restfreqs = column('RESTFREQ')[keep]
+        fdnums = column('FDNUM')[keep]
 
-            # we can assume all integrations of a single scan are within the same
-            #   FITS extension
-            observation.addRow(scanid, feed, windowNum, pol,
-                               fitsExtension, rowOfFitsFile, obsid,
-                               procname, procscan, nchans)
+        # only the first row of each run of repeated values is new
+        changed = np.ones(len(windows), dtype=bool)
+        changed[1:] = (windows[1:] != windows[:-1]) | (restfreqs[1:] != restfreqs[:-1])
+        for windowNum, restfreq in set(zip(windows[changed].tolist(), restfreqs[changed].tolist())):
+            summary['WINDOWS'].add((windowNum, float(restfreq)/1e9))
+        summary['FEEDS'].update(np.unique(fdnums.astype(str)).tolist())
 
-        try:
-            ifile.close()
-        except NameError:
-            raise
+        # we can assume all integrations of a single scan are within the same
+        #   FITS extension
+        observation.addRows(scans[keep], number('FDNUM')[keep], windows,
+                            number('PLNUM')[keep], number('EXT')[keep], number('ROW')[keep],
+                            column('OBSID')[keep], procnames[keep],
+                            column('PROCSCAN')[keep], column('NUMCHN')[keep])
 
-        return observation, summary
+        return observation, summary, suspect_scans[np.argsort(first_unknown)].tolist()
+
+    def _index_strings(self, values):
+        """Index column values with leading blanks removed, like SdFitsIndexRowReader
+
+        Values are stripped once per run of repeated values, which
+        is all of them for most index columns.
+
+        """
+        if values.dtype.kind != 'S':
+            return values
+        return self._map_runs(values, str.lstrip)
+
+    def _map_runs(self, values, function):
+        """Apply a function to column values, once per run of repeated values
+
+        Returns:
+        a numpy string array of the results, one per value
+
+        """
+        if 0 == len(values):
+            return np.zeros(0, dtype='S1')
+        changed = np.ones(len(values), dtype=bool)
+        changed[1:] = values[1:] != values[:-1]
+        results = np.array([function(value) for value in values[changed]], dtype=str)
+        return results[np.cumsum(changed) - 1]
+
+    def _index_numbers(self, values):
+        """Convert an index column of blank-padded integers to an int64 array"""
+        if values.dtype.kind in 'iu':
+            return values.astype(np.int64)
+
+        # parse the values as blank separated text, with a blank between
+        #  values so that full width values do not run together
+        chars = np.empty((len(values), values.itemsize + 1), dtype=np.uint8)
+        chars[:, :-1] = values.view(np.uint8).reshape((len(values), values.itemsize))
+        chars[:, -1] = ord(' ')
+        chars[chars == 0] = ord(' ')
+
+        # anything but digits, blanks and signs (or an empty value) is left
+        #  to int() to complain about
+        isdigit = (chars >= ord('0')) & (chars <= ord('9'))
+        other = ~isdigit & (chars != ord(' ')) & (chars != ord('-')) & (chars != ord('+'))
+        if other.any() or not isdigit.any(axis=1).all():
+            return values.astype(np.int64)
+
+        numbers = np.fromstring(chars.tostring(), dtype=np.int64, sep=' ')
+        if len(numbers) != len(values):
+            return values.astype(np.int64)
+
+        return numbers
 
     def getReferenceIntegration(self, cal_on, cal_off, scale):
 
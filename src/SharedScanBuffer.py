@@ -0,0 +1,209 @@
+# Copyright (C) 2007 Associated Universities, Inc. Washington DC, USA.
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+#
+# Correspondence concerning GBT software should be addressed as follows:
+#       GBT Operations
+#       National Radio Astronomy Observatory
+#       P. O. Box 2
+#       Green Bank, WV 24944-0002 USA
+
+# $Id$
+
+import mmap
+import multiprocessing
+import os
+import sys
+from Queue import Empty
+
+import numpy as np
+
+
+class SharedScanBuffer:
+    """Pass scans read by one process to worker processes through shared memory.
+
+       The buffer is a ring of slots in an anonymous shared memory map,
+       made before the workers are forked.  The reader puts each scan
+       (the table rows of every feed/window/polarization, as read by a
+       RowDemultiplexer) in the next slot, and sends each worker a short
+       message with the slot and where its own rows are.  The workers
+       look at the rows in place, without the spectra being pickled or
+       copied between processes.
+
+       Every worker is sent every scan, in the same order, and releases
+       a scan's slot when it moves on to the next scan.  A slot is only
+       reused once every worker still running has released it, so with
+       two or more slots the reader reads ahead while the workers
+       calibrate.
+
+       In a worker, after open_reader(), the buffer has the read()
+       method of a RowDemultiplexer, so it can be a MappingPipeline's
+       demux.
+
+    """
+
+    # slot contents start on this byte boundary
+    ALIGN = 64
+
+    def __init__(self, nworkers, slot_bytes, nslots=2):
+        """
+        Args:
+            nworkers: (int) number of worker processes
+            slot_bytes: (int) size of the largest scan, in bytes
+            nslots: (int) number of scans held at once
+
+        """
+        self.nworkers = nworkers
+        self.nslots = nslots
+        self.slot_bytes = self._aligned(max(slot_bytes, 1))
+        self.memory = mmap.mmap(-1, self.nslots * self.slot_bytes)
+
+        self.queues = [multiprocessing.Queue() for _ in range(nworkers)]
+        # number of scans each worker is done with
+        self.released = multiprocessing.Array('l', nworkers)
+        self.changed = multiprocessing.Condition()
+
+        self.processes = []  # worker processes, to skip any that have exited
+        self.nput = 0  # number of scans put in the buffer
+        self.reader_pid = os.getpid()
+
+        # worker side
+        self.worker = None
+        self.current = None  # message for the scan being read
+        self.nseen = 0  # number of scans received
+        self.closed = False  # True after the last message
+
+    def _aligned(self, nbytes):
+        return (nbytes + self.ALIGN - 1) // self.ALIGN * self.ALIGN
+
+    def put(self, scan, blocks, index):
+        """Put a scan in the buffer for the workers (reader side).
+
+        Waits for the workers to release the slot first.
+
+        Args:
+            scan: (int) scan number
+            blocks: (dict) extension -> structured array of the scan's rows
+            index: (dict) (feed, window, pol) -> (extension, positions of the
+                stream's rows in the block), as RowDemultiplexer.index
+
+        """
+        slot = self.nput % self.nslots
+        self._wait_for_slot(self.nput - self.nslots + 1)
+
+        layout = {}
+        offset = slot * self.slot_bytes
+        for ext, block in sorted(blocks.items()):
+            if offset + block.nbytes > (slot + 1) * self.slot_bytes:
+                raise ValueError('scan {0} does not fit in a buffer slot'.format(scan))
+            shared = np.frombuffer(self.memory, dtype=block.dtype, count=len(block), offset=offset)
+            shared[:] = block
+            layout[ext] = (offset, block.dtype, len(block))
+            offset += self._aligned(block.nbytes)
+
+        for queue in self.queues:
+            queue.put((scan, layout, index))
+        self.nput += 1
+
+    def _wait_for_slot(self, nreleased):
+        """Wait until every running worker has released nreleased scans"""
+        if nreleased <= 0:
+            return
+        with self.changed:
+            while True:
+                waiting = [worker for worker in range(self.nworkers)
+                           if self.released[worker] < nreleased and
+                           (worker >= len(self.processes) or self.processes[worker].is_alive())]
+                if not waiting:
+                    return
+                self.changed.wait(1)
+
+    def close(self):
+        """Tell the workers there are no more scans (reader side)."""
+        for queue in self.queues:
+            queue.put(None)
+
+    def open_reader(self, worker):
+        """Start reading scans as worker number `worker` (worker side)."""
+        self.worker = worker
+        self.current = None
+        self.nseen = 0
+        self.closed = False
+
+    def next_scan(self, scan):
+        """Release the scan being read and wait for the next one (worker side).
+
+        Args:
+            scan: (int) the scan expected next, which must be the next
+                scan put in the buffer
+
+        """
+        self._release()
+        message = self._get()
+        if message is None:
+            raise ValueError('no more scans in the buffer, expected scan {0}'.format(scan))
+        self.nseen += 1
+        if message[0] != scan:
+            raise ValueError('expected scan {0}, got scan {1}'.format(scan, message[0]))
+        self.current = message
+
+    def read(self, scan, feed, window, pol, start=None, stop=None):
+        """Return rows of the current scan for one stream (worker side).
+
+        Same as RowDemultiplexer.read.  The rows are copied out of the
+        shared memory, so they stay valid after the scan is released.
+
+        """
+        if self.current is None or self.current[0] != scan:
+            raise KeyError(scan)
+        _, layout, index = self.current
+        ext, positions = index[(feed, window, pol)]
+        offset, dtype, nrows = layout[ext]
+        shared = np.frombuffer(self.memory, dtype=dtype, count=nrows, offset=offset)
+        block = shared[positions[start:stop]]
+        return block, block['DATA'].reshape((len(block), -1))
+
+    def _release(self):
+        if self.current is not None:
+            self.current = None
+            with self.changed:
+                self.released[self.worker] = self.nseen
+                self.changed.notify_all()
+
+    def finish(self):
+        """Stop reading, releasing every scan still to come (worker side)."""
+        self.current = None
+        with self.changed:
+            self.released[self.worker] = sys.maxint
+            self.changed.notify_all()
+        # empty the queue, so the worker can exit
+        while self._get() is not None:
+            pass
+
+    def _get(self):
+        """Next message for this worker, or None at the end or if the reader has exited"""
+        if self.closed:
+            return None
+        while True:
+            try:
+                message = self.queues[self.worker].get(timeout=1)
+                break
+            except Empty:
+                if os.getppid() != self.reader_pid:
+                    message = None
+                    break
+        if message is None:
+            self.closed = True
+        return message
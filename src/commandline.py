@@ -32,6 +32,8 @@ from settings import *
 
 import argparse
 
+import smoothing
+
 
 class _MyParser(argparse.ArgumentParser):
     def convert_arg_line_to_args(self, arg_line):
@@ -74,6 +76,12 @@ class CommandLine:
                                  default='', required=True,
                                  help='SDFITS file name containing map scans',
                                  type=str)
+        input_group.add_argument("--write-index", dest="write_index",
+                                 action='store_true', default=False,
+                                 help='If there is no index file, the SDFITS '
+                                 'file is indexed directly from its scalar '
+                                 'columns.  If set, also write the index file '
+                                 '(and its cache) for later runs.')
         data_selection = self.parser.add_argument_group('Data Selection')
         data_selection.add_argument("-m", "--map-scans", dest="mapscans",
                                     default=None,
@@ -102,6 +110,39 @@ class CommandLine:
                              default=False, help="If set, will calibrate "
                              "data and write calibrated SDFITS files but "
                              "will not create image FITS files.")
+        control.add_argument("--single-pass", dest="single_pass",
+                             action='store_true', default=False,
+                             help="If set, read the input file once, a scan "
+                             "at a time, and calibrate every feed and "
+                             "polarization from each scan as it is read.  "
+                             "The feed/pol processes of each window share "
+                             "the scans through shared memory.  Memory use "
+                             "grows to a few scans of a window.")
+        control.add_argument("-j", "--jobs", dest="jobs", default=None,
+                             type=int,
+                             help="If set, calibrate every map, window, feed "
+                             "and polarization in a pool of N processes, "
+                             "largest first, rather than one process per "
+                             "feed and polarization of each window in turn.  "
+                             "When the input is a directory of bank files, "
+                             "the files share the pool, rather than being "
+                             "calibrated one after another.")
+        control.add_argument("--overlap-imaging", dest="overlap_imaging",
+                             action='store_true', default=False,
+                             help="If set, image each map window as soon as "
+                             "all its feeds and polarizations are "
+                             "calibrated, while other windows are still "
+                             "being calibrated.  Calibration and imaging "
+                             "share the pool of --jobs processes (default: "
+                             "one per CPU).")
+        control.add_argument("--scan-workers", dest="scan_workers", default=1,
+                             type=int,
+                             help="Calibrate the map scans of each feed, "
+                             "window and polarization in N processes.  The "
+                             "calibrated scans are written in scan order.  "
+                             "Useful for a map with few feeds and "
+                             "polarizations.  Not used with --single-pass.  "
+                             "Default: 1")
         control.add_argument("-a", "--average", dest="average", default=0,
                              type=int,
                              help='average the spectra over N channels '
@@ -148,6 +189,34 @@ class CommandLine:
                                  help='boxcar kernel size for '
                                  'reference spectrum smoothing. '
                                  'A value <= 1 means no smoothing.  Default: 3')
+        calibration.add_argument("--smoothing-kernel-type", dest="smoothing_kernel_type",
+                                 default='boxcar', choices=smoothing.KERNELS,
+                                 help='kernel for reference spectrum smoothing.  '
+                                 'The kernel size is the width in channels '
+                                 '(the FWHM for gaussian).  Default: boxcar')
+        calibration.add_argument("--nan-native", dest="nan_native",
+                                 action='store_true', default=False,
+                                 help='calibrate with plain arrays where blanked '
+                                 'channels are NaNs, instead of numpy masked '
+                                 'arrays.  Faster; blanked channels are written '
+                                 'out as NaN.')
+        calibration.add_argument("--precision", dest="precision",
+                                 default='float64', choices=('float64', 'float32'),
+                                 help='floating point type of the calibrated '
+                                 'spectra.  With float32, spectra are kept in '
+                                 'single precision and written out directly; '
+                                 'reference averages and weights are still '
+                                 'computed in float64.  Calibrated values differ '
+                                 'from float64 by at most about 1e-6 of the '
+                                 'peak of each spectrum.  '
+                                 'Default: float64')
+        calibration.add_argument("--reference-cache", dest="reference_cache",
+                                 default=None, metavar='DIR',
+                                 help='directory to keep the averaged reference '
+                                 'scans in, so that later runs on the same data '
+                                 'use them rather than averaging the scans '
+                                 'again.  Within a run, the maps always share '
+                                 'their reference scans.  Default: none')
 
         output = self.parser.add_argument_group('Output')
         output.add_argument("-v", "--verbose", dest="verbose", default=4,
@@ -157,6 +226,21 @@ class CommandLine:
         output.add_argument("--clobber", action='store_true',
                             dest="clobber", default=False,
                             help="Overwrites existing output files if set.")
+        output.add_argument("--incremental", action='store_true',
+                            dest="incremental", default=False,
+                            help="Only calibrate outputs whose input rows or "
+                            "calibration options have changed since they "
+                            "were written.  Up-to-date outputs are kept, and "
+                            "imaged, as they are; out-of-date outputs are "
+                            "overwritten.")
+        output.add_argument("--resume", action='store_true',
+                            dest="resume", default=False,
+                            help="Checkpoint each output after every map "
+                            "scan, and continue outputs left partly written by "
+                            "an interrupted --resume run, from the scan after "
+                            "the last one completed.  Up-to-date outputs are "
+                            "kept, as with --incremental, and any others are "
+                            "calibrated from the start.")
         output.add_argument("--keep-temporary-files", action='store_true',
                             dest='keeptempfiles', default=False,
                             help='If set, do not remove intermediate aips.fits '
@@ -293,6 +377,10 @@ class CommandLine:
             print '   please check your command line settings and try again.'
             sys.exit()
 
+        if opt.jobs is not None and opt.jobs < 1:
+            print 'ERROR: the number of jobs must be at least 1'
+            sys.exit()
+
         opt.units = opt.units.lower()
 
         return opt
@@ -24,6 +24,11 @@
 
 import commandline
 from MappingPipeline import MappingPipeline
+from RowDemultiplexer import RowDemultiplexer
+from SharedScanBuffer import SharedScanBuffer
+from JobScheduler import JobScheduler
+from CalibrationManifest import CalibrationManifest
+from ReferenceCache import ReferenceCache
 from SdFitsIO import SdFits
 import Imaging
 from PipeLogging import Logging
@@ -34,12 +39,15 @@ from settings import *
 import blessings
 import fitsio
 
+import atexit
 import os
 import errno
 import multiprocessing
 import sys
 import glob
 import copy
+import shutil
+import tempfile
 from collections import namedtuple
 
 
@@ -70,6 +78,21 @@ def calibrate_win_feed_pol(log, cl_params, window, feed, pol, pipe):
     pol        -- polarization number
     pipe       -- mapping pipeline instance from MappingPipeline class
 
+    """
+    for scan in calibrate_win_feed_pol_scans(log, cl_params, window, feed, pol, pipe):
+        pass
+
+
+def calibrate_win_feed_pol_scans(log, cl_params, window, feed, pol, pipe):
+    """Calibrate a single window, feed, polarization one scan at a time.
+
+    This is a generator that does the work of calibrate_win_feed_pol.
+    It yields each scan number (the reference scans, then the map
+    scans) just before the scan is read, so that calibrate_single_pass
+    can step many feeds/windows/polarizations through the same scan.
+
+    Keyword arguments are those of calibrate_win_feed_pol.
+
     """
 
     # initialize reference spectrum variables
@@ -89,6 +112,8 @@ def calibrate_win_feed_pol(log, cl_params, window, feed, pol, pipe):
     # if we are using reference spectra
     if cl_params.refscans:
 
+        yield cl_params.refscans[0]
+
         # check to see if there are any rows for the first reference scan
         #  note: the row_list.get() call below is normally used to return
         #  a list of rows, but here we are just checking to see if any rows
@@ -115,6 +140,9 @@ def calibrate_win_feed_pol(log, cl_params, window, feed, pol, pipe):
         #  a list of rows, but here we are just checking to see if any rows
         #  exist.  If not, row_list.get() will throw an exeption.
         if len(cl_params.refscans) > 1:
+
+            yield cl_params.refscans[1]
+
             try:
                 pipe.row_list.get(cl_params.refscans[1], feed, window, pol)
             except:
@@ -140,13 +168,227 @@ def calibrate_win_feed_pol(log, cl_params, window, feed, pol, pipe):
     #  The calibrate_sdfits_integrations() method does not return anything.
     #   It determines the correct calibration path and writes the calibrated
     #   SDFITS output file specific to this feed/window/polarization.
-    pipe.calibrate_sdfits_integrations(feed, window, pol,
-                                       refSpectrum1, refTsys1, refTimestamp1,
-                                       refTambient1, refElevation1,
-                                       refExposure1, refSpectrum2,
-                                       refTsys2, refTimestamp2, refTambient2,
-                                       refElevation2, refExposure2,
-                                       cl_params.beamscaling)
+    for scan in pipe.calibrate_sdfits_scans(feed, window, pol,
+                                            refSpectrum1, refTsys1, refTimestamp1,
+                                            refTambient1, refElevation1,
+                                            refExposure1, refSpectrum2,
+                                            refTsys2, refTimestamp2, refTambient2,
+                                            refElevation2, refExposure2,
+                                            cl_params.beamscaling):
+        yield scan
+
+
+def calibrate_single_pass(log, cl_params, row_list, maps):
+    """Calibrate many window/feed/pols together, reading each scan once.
+
+       Rather than each window/feed/pol reading its own rows of every
+       scan, a RowDemultiplexer reads all the rows of a scan in file
+       order and hands each window/feed/pol its own rows.  The
+       calibrations are stepped through the scans together, so the
+       input file is read once, front to back.
+
+    Keyword arguments:
+    log        -- logging object
+    cl_params  -- command line parameters
+    row_list   -- ObservationRows of the input file
+    maps       -- list of (MappingPipeline, window, feed, pol) tuples
+
+    """
+    demux = RowDemultiplexer(cl_params.infilename, row_list,
+                             [(feed, window, pol) for mp, window, feed, pol in maps])
+
+    steps = []
+    for mp, window, feed, pol in maps:
+        mp.demux = demux
+        steps.append(calibrate_win_feed_pol_scans(log, cl_params, window, feed, pol, mp))
+
+    # each step calibrates the scan yielded by the previous one, and every
+    #  window/feed/pol yields the same sequence of scans
+    while steps:
+        for step in list(steps):
+            try:
+                step.next()
+            except StopIteration:
+                steps.remove(step)
+
+    demux.close()
+
+
+def calibrate_shared(log, cl_params, row_list, maps):
+    """Calibrate window/feed/pols in parallel, reading each scan once.
+
+       This process reads each scan with a RowDemultiplexer and puts it
+       in a SharedScanBuffer.  One worker process per window/feed/pol
+       calibrates its own rows straight out of the shared memory, so the
+       input file is read once and the spectra are not copied to every
+       worker.
+
+    Keyword arguments:
+    log        -- logging object
+    cl_params  -- command line parameters
+    row_list   -- ObservationRows of the input file
+    maps       -- list of (MappingPipeline, window, feed, pol) tuples
+
+    """
+    demux = RowDemultiplexer(cl_params.infilename, row_list,
+                             [(feed, window, pol) for mp, window, feed, pol in maps])
+
+    # the workers step through the reference scans, then the map scans
+    scans = list(cl_params.refscans or [])[:2] + list(cl_params.mapscans)
+
+    # read the scalar metadata before the workers start, so they share it
+    slot_bytes = 0
+    for scan in scans:
+        nbytes = demux.scan_nbytes(scan)
+        slot_bytes = max(slot_bytes, sum(nbytes.values()) + len(nbytes) * SharedScanBuffer.ALIGN)
+        for ext in nbytes:
+            maps[0][0].get_metadata(ext)
+
+    buffer = SharedScanBuffer(len(maps), slot_bytes)
+
+    pids = []
+    for worker, (mp, window, feed, pol) in enumerate(maps):
+        pids.append(multiprocessing.Process(target=calibrate_win_feed_pol_shared,
+                                            args=(log, cl_params, window, feed, pol,
+                                                  mp, buffer, worker,)))
+    for pp in pids:
+        pp.start()
+    buffer.processes = pids
+    for mp, window, feed, pol in maps:
+        log.doMessage('DBG', 'Feed {feed} Pol {pol} '
+                      'started.'.format(feed=feed, pol=pol))
+
+    for scan in scans:
+        try:
+            demux.read_scan(scan)
+            blocks, index = demux.blocks, demux.index
+        except KeyError:
+            # still send it, so the workers stay in step
+            blocks, index = {}, {}
+        buffer.put(scan, blocks, index)
+    buffer.close()
+    demux.close()
+
+    for pp in pids:
+        pp.join()
+    for mp, window, feed, pol in maps:
+        log.doMessage('DBG', 'Feed {feed} Pol {pol} '
+                      'finished.'.format(feed=feed, pol=pol))
+
+
+def calibrate_win_feed_pol_shared(log, cl_params, window, feed, pol, pipe, buffer, worker):
+    """Calibrate a window/feed/pol from the scans in a SharedScanBuffer.
+
+    Keyword arguments are those of calibrate_win_feed_pol, and
+    buffer     -- SharedScanBuffer the scans are read from
+    worker     -- worker number in the buffer
+
+    """
+    buffer.open_reader(worker)
+    pipe.demux = buffer
+    try:
+        for scan in calibrate_win_feed_pol_scans(log, cl_params, window, feed, pol, pipe):
+            buffer.next_scan(scan)
+    finally:
+        buffer.finish()
+
+
+def estimate_cost(row_list, scans, streams):
+    """Estimate the cost of calibrating window/feed/pols
+
+       The cost is the number of spectrum values read, i.e. the number
+       of index rows of the scans times the number of channels.
+
+    Keyword arguments:
+    row_list   -- ObservationRows of the input file
+    scans      -- list of scans calibrated
+    streams    -- list of (feed, window, pol) tuples
+
+    """
+    cost = 0
+    for scan in scans:
+        for feed, window, pol in streams:
+            try:
+                rows = row_list.get(scan, feed, window, pol)
+            except KeyError:
+                continue
+            cost += len(rows['ROW']) * int(rows['NCHANS'] or 1)
+    return cost
+
+
+def schedule_window(scheduler, log, cl_params, row_list, window, maps,
+                    imag=None, calibrated_maps=None):
+    """Add the calibration of a window to a JobScheduler
+
+       Each feed/pol is a job, or with --single-pass, the whole window
+       is one job that reads each scan once.
+
+       With an Imaging object (--overlap-imaging), imaging the window
+       is another job, which starts as soon as the window's
+       calibration jobs have ended, while other windows are still
+       being calibrated.
+
+    Keyword arguments:
+    scheduler  -- JobScheduler the jobs are added to
+    log        -- logging object
+    cl_params  -- command line parameters, for this map only
+    row_list   -- ObservationRows of the input file
+    window     -- window number
+    maps       -- list of (MappingPipeline, window, feed, pol) tuples
+    imag       -- Imaging object, to image the window when calibrated
+    calibrated_maps -- the window's CalibratedMap tuples, for imaging
+
+    """
+    scans = list(cl_params.refscans or [])[:2] + list(cl_params.mapscans)
+    name = 'Map {first}-{last} window {ww}'.format(first=cl_params.mapscans[0],
+                                                   last=cl_params.mapscans[-1],
+                                                   ww=window)
+    streams = [(feed, window, pol) for mp, window, feed, pol in maps]
+
+    if cl_params.single_pass and maps:
+        jobs = [scheduler.add(name, estimate_cost(row_list, scans, streams),
+                              calibrate_single_pass, (log, cl_params, row_list, maps))]
+    else:
+        jobs = [scheduler.add('{name} feed {feed} pol {pol}'.format(name=name, feed=feed, pol=pol),
+                              estimate_cost(row_list, scans, [(feed, window, pol)]),
+                              calibrate_win_feed_pol, (log, cl_params, window, feed, pol, mp))
+                for mp, window, feed, pol in maps]
+
+    if imag is not None:
+        scheduler.add(name + ' imaging', estimate_cost(row_list, scans, streams),
+                      image_window, (log, cl_params, imag, calibrated_maps), after=jobs)
+
+
+def image_window(log, cl_params, imag, calibrated_maps):
+    """Image the calibrated maps of a window
+
+    Keyword arguments:
+    log        -- logging object
+    cl_params  -- command line parameters
+    imag       -- Imaging object
+    calibrated_maps -- list of CalibratedMap tuples of the window
+
+    """
+    records = MappingPipeline.MANIFEST.records([cm.mp_object.outfilename
+                                                for cm in calibrated_maps])
+    maps = imag.plan(log, records)
+    for thismap in sorted(maps):
+        imag.image_map(log, cl_params, thismap, maps[thismap])
+
+
+def run_scheduled(scheduler, log):
+    """Run the calibration jobs of a JobScheduler and report failures"""
+    if not len(scheduler):
+        return
+    log.doMessage('INFO', '\nCalibrating {nn} job(s), {jobs} at a '
+                  'time.'.format(nn=len(scheduler), jobs=scheduler.njobs))
+    sys.stdout.flush()
+    failed = [result.name for result in scheduler.run(log)
+              if result.status != JobScheduler.FINISHED]
+    if failed:
+        log.doMessage('ERR', '{nn} of {total} calibration job(s) failed: '
+                      '{names}'.format(nn=len(failed), total=len(scheduler),
+                                       names=', '.join(failed)))
 
 
 def preview_zenith_tau(log, row_list, cl_params, feeds, windows, pols):
@@ -197,11 +439,17 @@ def preview_zenith_tau(log, row_list, cl_params, feeds, windows, pols):
                       'map: {0:.3f}'.format(cl_params.zenithtau))
 
 
-def calibrate_maps(log, cl_params, row_list, term):
+def calibrate_maps(log, cl_params, row_list, term, scheduler=None, imag=None):
     """Calibrate maps for each window/feed/polarization
 
        Actual calibration is done in calibrate_win_feed_pol().
 
+       With a JobScheduler (--jobs), the calibration of each window is
+       only added to the scheduler, to be run later.  cl_params must
+       then not be changed until the jobs have run.  With an Imaging
+       object as well (--overlap-imaging), imaging each window is also
+       added to the scheduler.
+
        Returns a list of calibrated maps.  Each list item
        is a tuple of (MappingPipe instance, window, feed, pol)
 
@@ -258,9 +506,14 @@ def calibrate_maps(log, cl_params, row_list, term):
     #  ( MappingPipeline object, window, feed, polarization )
     calibrated_maps = []
 
+    # with --single-pass and without parallel processes, every
+    #  window/feed/pol is calibrated at the end, reading the input file once
+    single_pass_maps = []
+
     # calibrate one window/feed/pol at a time
     for window in windows:
         maps_for_this_window = []
+        calibrated_this_window = []
         for feed in feeds:
             for pol in pols:
                 # create MappingPipeline object for this window/feed/pol
@@ -270,6 +523,19 @@ def calibrate_maps(log, cl_params, row_list, term):
                 except KeyError:
                     continue
 
+                # add the MappingPipeline object to a list of all the
+                #  to be calibrated
+                CalibratedMap = namedtuple('CalibratedMap', 'mp_object, window, feed, pol, start, end')
+                calibrated_this_window.append(CalibratedMap(mp, window, feed, pol,
+                                                            cl_params.mapscans[0],
+                                                            cl_params.mapscans[-1]))
+
+                # with --incremental or --resume, an up-to-date output is kept as it is
+                #  and recorded for this run, so it is imaged
+                if mp.up_to_date:
+                    mp.record_output(feed, window, pol)
+                    continue
+
                 # add the MappingPipeline object to a list of feeds and pols
                 #  to be calibrated for this window.  That way, when running
                 #  parallel processes, only one window will be done at a time.
@@ -278,12 +544,17 @@ def calibrate_maps(log, cl_params, row_list, term):
                 #  for the next window, and so on.
                 maps_for_this_window.append((mp, window, feed, pol))
 
-                # add the MappingPipeline object to a list of all the
-                #  to be calibrated
-                CalibratedMap = namedtuple('CalibratedMap', 'mp_object, window, feed, pol, start, end')
-                calibrated_maps.append(CalibratedMap(mp, window, feed, pol,
-                                                     cl_params.mapscans[0],
-                                                     cl_params.mapscans[-1]))
+        calibrated_maps.extend(calibrated_this_window)
+
+        if scheduler is not None:
+            if calibrated_this_window:
+                schedule_window(scheduler, log, cl_params, row_list, window,
+                                maps_for_this_window, imag, calibrated_this_window)
+            continue
+
+        if cl_params.single_pass and not PARALLEL:
+            single_pass_maps.extend(maps_for_this_window)
+            continue
 
         pids = []
         if maps_for_this_window:
@@ -291,6 +562,12 @@ def calibrate_maps(log, cl_params, row_list, term):
                           '{ww}.'.format(ww=window))
             sys.stdout.flush()
 
+            # with --single-pass, this process reads the window once and
+            #  the feed/pol processes share what it reads
+            if cl_params.single_pass:
+                calibrate_shared(log, cl_params, row_list, maps_for_this_window)
+                continue
+
             # run the calibration for each feed/pol in this spectral window
             for mp, window, feed, pol in maps_for_this_window:
 
@@ -321,6 +598,13 @@ def calibrate_maps(log, cl_params, row_list, term):
                                   'finished.'.format(feed=feed, pol=pol))
 
     # iterate to the next window
+
+    if single_pass_maps:
+        log.doMessage('INFO', '\nCalibrating window(s) {ww} in a single '
+                      'pass.'.format(ww=','.join(sorted(set(str(window) for _, window, _, _ in single_pass_maps)))))
+        sys.stdout.flush()
+        calibrate_single_pass(log, cl_params, row_list, single_pass_maps)
+
     return calibrated_maps
 
 
@@ -375,12 +659,41 @@ def set_map_scans(cl_params, map_params):
     return cl_params
 
 
-def calibrate_file(term, log, command_options):
+def read_index(sdf, log, indexfile, fitsnames, command_options):
+    """Read the rows of the input data from the index file.
+
+       If there is no index file, the SDFITS file(s) are indexed
+       directly instead and, with --write-index, the index file is
+       written for later runs.
+
+    """
+    try:
+        # create a structure that lists the raw SDFITS rows for
+        #  each scan/window/feed/polarization
+        if os.path.exists(indexfile):
+            return sdf.parseSdfitsIndex(indexfile, command_options.mapscans)
+
+        log.doMessage('INFO', 'No index file', indexfile + ', indexing the SDFITS file(s)')
+        if command_options.write_index:
+            return sdf.buildSdfitsIndex(fitsnames, indexfile, command_options.mapscans)
+        return sdf.buildSdfitsIndex(fitsnames, mapscans=command_options.mapscans)
+    except IOError:
+        log.doMessage('ERR', 'Could not open index file', indexfile)
+        sys.exit()
+
+
+def calibrate_file(term, log, command_options, scheduler=None, imag=None):
     """Calibrate a single SDFITS file
 
        Actual calibration is done in calibrate_win_feed_pol(),
        which is called by calibrate_maps().
 
+       If a JobScheduler is given, the calibration jobs of the file are
+       only added to it, to be run along with those of other files.
+
+       If an Imaging object is given (--overlap-imaging), each window is
+       imaged as soon as it is calibrated, in the scheduler's pool.
+
     """
 
     # Instantiate a SdFits object for I/O and interpreting the
@@ -390,13 +703,7 @@ def calibrate_file(term, log, command_options):
     # generate a name for the index file based on the name of the
     #  raw SDFITS file.  The index file simply has a different extension
     indexfile = sdf.nameIndexFile(command_options.infilename)
-    try:
-        # create a structure that lists the raw SDFITS rows for
-        #  each scan/window/feed/polarization
-        row_list, summary = sdf.parseSdfitsIndex(indexfile, command_options.mapscans)
-    except IOError:
-        log.doMessage('ERR', 'Could not open index file', indexfile)
-        sys.exit()
+    row_list, summary = read_index(sdf, log, indexfile, command_options.infilename, command_options)
 
     log.doMessage('INFO', indexfile)
     log.doMessage('INFO', '    ', len(summary['WINDOWS']), 'spectral window(s)')
@@ -445,6 +752,13 @@ def calibrate_file(term, log, command_options):
     if proceed_with_calibration is False:
         return None
 
+    # with --jobs (or --overlap-imaging), every map, window, feed and pol
+    #  is calibrated at the end, in a pool of processes
+    run_jobs = False
+    if scheduler is None and (command_options.jobs or imag is not None):
+        scheduler = JobScheduler(command_options.jobs or multiprocessing.cpu_count())
+        run_jobs = True
+
     calibrated_maps = []
     # if there are no mapscans set at the command line, the user
     #  probably wants the pipeline to find maps in the input file
@@ -458,7 +772,7 @@ def calibrate_file(term, log, command_options):
         #  as a reference scan, followed by mapping scans, optionally
         #  followed by another reference scan.  The returned structure
         #  is a list of tuples of (reference1, mapscans, reference2)
-        maps = sdf.find_maps(indexfile)
+        maps = sdf.find_maps_in_rows(row_list)
 
         if maps:
             log.doMessage('INFO', 'Found', len(maps), 'map(s).')
@@ -469,13 +783,20 @@ def calibrate_file(term, log, command_options):
 
         # calibrate each map found in the input file
         for map_number, map_params in enumerate(maps):
-            cmd_options = set_map_scans(command_options, map_params)
+            # scheduled maps are calibrated later, so each needs its own scans
+            if scheduler is not None:
+                cmd_options = set_map_scans(copy.deepcopy(command_options), map_params)
+            else:
+                cmd_options = set_map_scans(command_options, map_params)
             log.doMessage('INFO', '\nProcessing map:', str(map_number+1), 'of',
                           len(maps))
-            calibrated_maps.append(calibrate_maps(log, cmd_options, row_list, term))
+            calibrated_maps.append(calibrate_maps(log, cmd_options, row_list, term, scheduler, imag))
     else:
         # calibrate the map defined by the user
-        calibrated_maps.append(calibrate_maps(log, command_options, row_list, term))
+        calibrated_maps.append(calibrate_maps(log, command_options, row_list, term, scheduler, imag))
+
+    if run_jobs:
+        run_scheduled(scheduler, log)
 
     return calibrated_maps
 
@@ -509,6 +830,28 @@ def runPipeline():
     else:
         imag = None
 
+    # with --overlap-imaging, each map window is imaged as soon as it is
+    #  calibrated, rather than all of them at the end
+    overlap_imag = None
+    if cl_params.overlap_imaging:
+        overlap_imag = imag
+
+    # every calibrated file is recorded in the manifest, which imaging
+    #  is planned from
+    MappingPipeline.MANIFEST = CalibrationManifest()
+    MappingPipeline.MANIFEST.start()
+
+    # the averaged reference scans are shared by the maps, which may be
+    #  calibrated in other processes, through files in a directory: the
+    #  --reference-cache one, kept for later runs, or one for this run only
+    if cl_params.reference_cache:
+        mkdir_p(cl_params.reference_cache)
+        MappingPipeline.REFERENCES = ReferenceCache(cl_params.reference_cache)
+    else:
+        reference_directory = tempfile.mkdtemp(prefix='references')
+        atexit.register(shutil.rmtree, reference_directory, True)
+        MappingPipeline.REFERENCES = ReferenceCache(reference_directory)
+
     log.doMessage('INFO', '{t.underline}Start '
                   'calibration.{t.normal}'.format(t=term))
 
@@ -532,13 +875,10 @@ def runPipeline():
         #  raw SDFITS file.  The index file simply has a different extension
         directory_name = os.path.basename(cl_params.infilename.rstrip('/'))
         indexfile = cl_params.infilename + '/' + directory_name + '.index'
-        try:
-            # create a structure that lists the raw SDFITS rows for
-            #  each scan/window/feed/polarization
-            row_list, summary = sdf.parseSdfitsIndex(indexfile, cl_params.mapscans)
-        except IOError:
-            log.doMessage('ERR', 'Could not open index file', indexfile)
-            sys.exit()
+        infilenames = glob.glob(input_directory + '/' +
+                                 os.path.basename(input_directory) +
+                                 '*.fits')
+        row_list, summary = read_index(sdf, log, indexfile, infilenames, cl_params)
 
         quitcal = False
         if cl_params.window and set(cl_params.window).isdisjoint(set(row_list.windows())):
@@ -560,10 +900,17 @@ def runPipeline():
         if quitcal:
             sys.exit(12)
 
-        # calibrate one raw SDFITS file at a time
-        for infilename in glob.glob(input_directory + '/' +
-                                    os.path.basename(input_directory) +
-                                    '*.fits'):
+        # the bank files are independent, so with --jobs (or
+        #  --overlap-imaging) the calibration jobs of every file are planned
+        #  first, then run together in one pool of --jobs (default: one per
+        #  CPU) processes, largest first.  Otherwise the files are
+        #  calibrated one after another.
+        scheduler = None
+        if cl_params.jobs or overlap_imag is not None:
+            scheduler = JobScheduler(cl_params.jobs or multiprocessing.cpu_count())
+
+        # plan or calibrate one raw SDFITS file at a time
+        for infilename in infilenames:
             log.doMessage('DBG', 'Attempting to calibrate', os.path.basename(infilename).rstrip('.fits'))
             # change the infilename in the params structure to the
             #  current infile in the directory for each iteration
@@ -572,12 +919,17 @@ def runPipeline():
             # copy the cl_params structure so we can modify it during calibration
             # for each seperate file.
             commandline_options = copy.deepcopy(cl_params)
-            calibrated_maps_this_file = calibrate_file(term, log, commandline_options)
+            calibrated_maps_this_file = calibrate_file(term, log, commandline_options, scheduler,
+                                                       overlap_imag)
             if calibrated_maps_this_file:
                 calibrated_maps.extend(calibrated_maps_this_file)
+
+        if scheduler is not None:
+            run_scheduled(scheduler, log)
     else:
         commandline_options = copy.deepcopy(cl_params)
-        calibrated_maps_this_file = calibrate_file(term, log, commandline_options)
+        calibrated_maps_this_file = calibrate_file(term, log, commandline_options,
+                                                   imag=overlap_imag)
         if calibrated_maps_this_file:
             calibrated_maps.extend(calibrated_maps_this_file)
 
@@ -585,14 +937,11 @@ def runPipeline():
         log.doMessage('ERR', 'No calibrated spectra.  Check inputs and try again')
         sys.exit(-1)
 
-    # if we are doing imaging
-    if not cl_params.imagingoff:
+    # if we are doing imaging, and have not already
+    if not cl_params.imagingoff and overlap_imag is None:
 
         # image all the calibrated maps
-        import itertools
-        calibrated_maps = list(itertools.chain(*calibrated_maps))
-
-        imag.run(log, term, cl_params, calibrated_maps)
+        imag.run(log, term, cl_params, MappingPipeline.MANIFEST.records())
 
     sys.stdout.write('\n')
 
@@ -24,10 +24,151 @@
 
 import numpy as np
 
+KERNELS = ('boxcar', 'hanning', 'gaussian')
 
-def boxcar(myarray, window):
-    outputarray = myarray.copy()
-    result = np.convolve(outputarray, np.ones(window), mode='same') / float(window)
-    result[0:window] = result[window]
-    result[-window:] = result[-window]
+# kernels at least this wide are convolved with FFTs instead of directly
+FFT_MIN_KERNEL = 64
+
+
+def _window_sums(data, start, stop):
+    """Sum data[..., start:stop] for each channel from cumulative sums.
+
+    The cost does not depend on the window size.  Non-finite values are
+    left out of the sums and counted instead, so the caller can blank
+    the windows that include them (as np.convolve would propagate them).
+
+    """
+    data = np.array(data, dtype=float)
+    bad = ~np.isfinite(data)
+    data[bad] = 0
+
+    zeros = np.zeros(data.shape[:-1] + (1,))
+    csum = np.concatenate((zeros, np.cumsum(data, axis=-1)), axis=-1)
+    cbad = np.concatenate((zeros, np.cumsum(bad, axis=-1)), axis=-1)
+
+    return csum[..., stop] - csum[..., start], cbad[..., stop] - cbad[..., start]
+
+
+def _channel_windows(nchan, before, after):
+    """Start and stop channels of the window [ii - before, ii + after] around each channel."""
+    channels = np.arange(nchan)
+    start = (channels - before).clip(0, nchan)
+    stop = (channels + after + 1).clip(0, nchan)
+    return start, stop
+
+
+def _fill_edges(result, edge):
+    """Replace the first and last edge channels, which the kernel does not fully cover."""
+    nchan = result.shape[-1]
+    result[..., :edge] = result[..., edge:edge + 1].copy()
+    result[..., -edge:] = result[..., nchan - edge:nchan - edge + 1].copy()
     return result
+
+
+def boxcar(myarray, window):
+    """Boxcar smooth a spectrum, or each row of a 2d block of spectra
+
+    The window sums come from cumulative sums along the channel axis, so
+    the cost does not depend on the window size.  The result matches
+    np.convolve(myarray, np.ones(window), mode='same') / window, with the
+    first and last window channels set to the nearest fully smoothed
+    value.
+
+    Keyword arguments:
+    myarray -- 1d spectrum or 2d array with one spectrum per row
+    window -- boxcar width in channels
+
+    Returns:
+    smoothed array, the same shape as myarray
+
+    """
+    nchan = np.shape(myarray)[-1]
+    start, stop = _channel_windows(nchan, window // 2, (window - 1) // 2)
+    sums, nbad = _window_sums(myarray, start, stop)
+
+    result = sums / float(window)
+    result[nbad > 0] = float('nan')
+
+    return _fill_edges(result, window)
+
+
+def hanning_kernel(width):
+    """Normalized Hanning kernel spanning width channels, e.g. [.25, .5, .25] for 3"""
+    kernel = np.hanning(width + 2)[1:-1]
+    return kernel / kernel.sum()
+
+
+def gaussian_kernel(width):
+    """Normalized Gaussian kernel with a FWHM of width channels, truncated at 3 sigma"""
+    sigma = width / (2 * np.sqrt(2 * np.log(2)))
+    half = max(int(np.ceil(3 * sigma)), 1)
+    xx = np.arange(-half, half + 1)
+    kernel = np.exp(-xx**2 / (2 * sigma**2))
+    return kernel / kernel.sum()
+
+
+def convolve(myarray, kernel):
+    """Convolve a spectrum, or each row of a 2d block of spectra, with a kernel
+
+    Narrow kernels are applied directly, one shifted copy of the block per
+    kernel channel; kernels of FFT_MIN_KERNEL channels or more are applied
+    with FFTs.  Channels are aligned as with np.convolve(mode='same'), any
+    channel whose window includes a NaN is NaN, and the first and last
+    len(kernel) channels are set to the nearest fully smoothed value.
+
+    Keyword arguments:
+    myarray -- 1d spectrum or 2d array with one spectrum per row
+    kernel -- 1d convolution kernel
+
+    Returns:
+    smoothed array, the same shape as myarray
+
+    """
+    data = np.array(myarray, dtype=float)
+    kernel = np.asarray(kernel, dtype=float)
+    nchan = data.shape[-1]
+    width = len(kernel)
+
+    bad = ~np.isfinite(data)
+    data[bad] = 0
+
+    nfull = nchan + width - 1
+    if width >= FFT_MIN_KERNEL:
+        nfft = 2**int(np.ceil(np.log2(nfull)))
+        full = np.fft.irfft(np.fft.rfft(data, nfft, axis=-1) * np.fft.rfft(kernel, nfft),
+                            nfft, axis=-1)[..., :nfull]
+    else:
+        full = np.zeros(data.shape[:-1] + (nfull,))
+        for idx, weight in enumerate(kernel):
+            full[..., idx:idx + nchan] += weight * data
+
+    offset = (width - 1) // 2
+    result = full[..., offset:offset + nchan]
+
+    start, stop = _channel_windows(nchan, width - 1 - offset, offset)
+    nbad, _ = _window_sums(bad, start, stop)
+    result[nbad > 0] = float('nan')
+
+    return _fill_edges(result, width)
+
+
+def smooth(myarray, window, kernel='boxcar'):
+    """Smooth a spectrum, or each row of a 2d block of spectra
+
+    Keyword arguments:
+    myarray -- 1d spectrum or 2d array with one spectrum per row
+    window -- kernel width in channels (FWHM for the gaussian kernel)
+    kernel -- one of KERNELS
+
+    Returns:
+    smoothed array, the same shape as myarray
+
+    """
+    if kernel == 'boxcar':
+        return boxcar(myarray, window)
+    elif kernel == 'hanning':
+        return convolve(myarray, hanning_kernel(window))
+    elif kernel == 'gaussian':
+        return convolve(myarray, gaussian_kernel(window))
+    else:
+        raise ValueError('Unknown smoothing kernel: {0}'.format(kernel))
@@ -92,26 +92,6 @@ class test_Calibration:
         expected_result = np.ones(128) * .5
         np.testing.assert_equal(antenna_temp, expected_result)
 
-    @unittest.skip("This is a stub test that we would like to expand in the future.")
-    def test__ta_fs_one_state(self):
-        sigref_state = [{'cal_on': None, 'cal_off': None, 'TP': None},
-                        {'cal_on': None, 'cal_off': None, 'TP': None}]
-
-        sigref_state[0]['cal_on'] = np.ones(128)
-        sigref_state[0]['cal_off'] = np.ones(128)
-
-        sigref_state[1]['cal_on'] = np.ones(128)
-        sigref_state[1]['cal_off'] = np.ones(128)
-
-        sigid = 0
-        refid = 1
-
-        assert False
-
-    @unittest.skip("This is a stub test that we would like to expand in the future.")
-    def test_ta_fs(self):
-        assert False
-
     @unittest.skip("Ignoring test per email from Joe Masters, 2017-10-26")
     def test_ta_star(self):
         antenna_temp = np.ones(128)
@@ -140,3 +120,198 @@ class test_Calibration:
                                                     result_time)
         expected = 50.
         ntest.assert_equal(result_value, expected)
+
+    def test_calibrate_ps_block(self):
+        nrows = 5
+        nchan = 32
+        rng = np.random.RandomState(7)
+        cal_on = (20 + rng.rand(nrows, nchan)).astype('f4')
+        cal_off = (18 + rng.rand(nrows, nchan)).astype('f4')
+        cal_off[2, 4] = np.nan
+        t_on = np.ones(nrows) * 1.1
+        t_off = np.ones(nrows) * .9
+        timestamps = 55000. + np.arange(nrows) / 1000.
+        ref1 = 19 + rng.rand(nchan)
+        ref2 = 19 + rng.rand(nchan)
+        references = [(ref1, 20., 54999.999, 30.), (ref2, 22., 55000.01, 40.)]
+        opacities = np.ones(nrows) * .08
+        elevations = 40 + np.arange(nrows) * .1
+        tambients = np.ones(nrows) * 290.
+        obsfreq = 23e9
+
+        block, tsys, exposure = self.cal.calibrate_ps_block(cal_on, cal_off, t_on, t_off,
+                                                            timestamps, references, 'tmb',
+                                                            obsfreq, opacities, elevations,
+                                                            tambients, (10., 11.), .99, .7, .71)
+
+        # compare with calibrating one integration at a time
+        for ii in range(nrows):
+            sig, sig_exposure = self.cal.total_power(cal_on[ii], np.ma.masked_invalid(cal_off[ii]),
+                                                     t_on[ii], t_off[ii])
+            ref = self.cal.interpolate_by_time(ref1, ref2, references[0][2], references[1][2],
+                                               timestamps[ii])
+            row_tsys = self.cal.interpolate_by_time(20., 22., references[0][2], references[1][2],
+                                                    timestamps[ii])
+            ta, row_exposure = self.cal.antenna_temp(row_tsys, sig, ref, sig_exposure, 35.)
+            opacity_el = self.cal.elevation_adjusted_opacity(opacities[ii], elevations[ii])
+            tsky_ref = self.cal.interpolate_by_time(10., 11., references[0][2], references[1][2],
+                                                    timestamps[ii])
+            tsky = self.cal.tsky(tambients[ii], obsfreq, opacity_el)
+            ta -= self.cal.tsky_correction(tsky, tsky_ref, .99)
+            tmb = self.cal.ta_star(ta, opacity_el, .99) / self.cal.main_beam_efficiency(.7, obsfreq)
+
+            np.testing.assert_equal(block[ii].filled(np.nan), tmb.filled(np.nan))
+            ntest.assert_equal(tsys[ii], row_tsys)
+            ntest.assert_equal(exposure[ii], row_exposure)
+
+        # float32 spectra stay within the documented tolerance of float64
+        single = Calibration(precision='float32')
+        references = single.prepare_references(references)
+        block32, tsys32, exposure32 = single.calibrate_ps_block(cal_on, cal_off, t_on, t_off,
+                                                                timestamps, references, 'tmb',
+                                                                obsfreq, opacities, elevations,
+                                                                tambients, (10., 11.), .99, .7, .71,
+                                                                smoothed=True)
+        ntest.assert_equal(block32.dtype, np.float32)
+        np.testing.assert_equal(block32.mask, block.mask)
+        tolerance = 1e-6 * np.abs(block).max()
+        assert np.abs(block32 - block).max() <= tolerance
+        np.testing.assert_equal(tsys32, tsys)
+        np.testing.assert_equal(exposure32, exposure)
+
+    def test_calibrate_ps_block_blanked(self):
+        nrows = 3
+        nchan = 16
+        rng = np.random.RandomState(11)
+        cal_on = (20 + rng.rand(nrows, nchan)).astype('f4')
+        cal_off = (18 + rng.rand(nrows, nchan)).astype('f4')
+        # a channel blanked in both noise diode states, one blanked in one
+        #  state only (averaged from the other), and one blanked in the reference
+        cal_on[:, 5] = np.nan
+        cal_off[:, 5] = np.nan
+        cal_on[:, 7] = np.nan
+        t_on = np.ones(nrows)
+        t_off = np.ones(nrows)
+        timestamps = 55000. + np.arange(nrows) / 1000.
+        ref = 19 + rng.rand(nchan)
+        ref[3] = np.nan
+        references = [(ref, 20.7, 55000., 30.)]
+
+        block, tsys, exposure = self.cal.calibrate_ps_block(cal_on, cal_off, t_on, t_off,
+                                                            timestamps, references)
+
+        # written to output rows the way MappingPipeline does
+        output = np.zeros(nrows, dtype=[('DATA', 'f4', nchan)])
+        output['DATA'] = block
+
+        # compare with calibrating and writing one integration at a time
+        expected = np.zeros(nrows, dtype=[('DATA', 'f4', nchan)])
+        for ii in range(nrows):
+            sig, sig_exposure = self.cal.total_power(self.cal.pu.masked_array(cal_on[ii]),
+                                                     self.cal.pu.masked_array(cal_off[ii]),
+                                                     t_on[ii], t_off[ii])
+            ta, row_exposure = self.cal.antenna_temp(20.7, sig, self.cal.pu.masked_array(ref),
+                                                     sig_exposure, 30.)
+            expected['DATA'][ii] = ta
+
+            ntest.assert_true(ta.mask[3] and ta.mask[5] and not ta.mask[7])
+            np.testing.assert_equal(block.mask[ii], ta.mask)
+
+        np.testing.assert_array_almost_equal(output['DATA'], expected['DATA'], 4)
+
+    def test_shift_spectra(self):
+        nchan = 64
+        rng = np.random.RandomState(3)
+        spectra = rng.rand(4, nchan)
+        spectra[1, 10] = np.nan
+
+        for channel_shift in (5.3, -5.3, 2., -.4, .7):
+            shifted = self.cal.shift_spectra(spectra, channel_shift)
+
+            # compare with shifting one integration at a time
+            for ii in range(len(spectra)):
+                ishifted = np.roll(spectra[ii], int(channel_shift))
+                if channel_shift > 0:
+                    ishifted[:int(channel_shift)] = float('nan')
+                elif channel_shift < 0:
+                    ishifted[int(channel_shift):] = float('nan')
+                xxp = range(nchan)
+                expected = np.interp(xxp - np.float64(channel_shift - int(channel_shift)), xxp, ishifted)
+                if channel_shift == int(channel_shift):
+                    # np.interp returns the samples themselves, though older
+                    #  numpy versions blank one next to a NaN
+                    expected = ishifted
+                np.testing.assert_equal(shifted[ii].filled(np.nan), expected)
+
+        # a whole-channel shift keeps the channel next to a NaN
+        shifted = self.cal.shift_spectra(spectra, 2.)
+        ntest.assert_equal(shifted[1, 11], spectra[1, 9])
+        ntest.assert_true(shifted.mask[1, 12])
+
+    def test_prepare_references(self):
+        cal = Calibration(3)
+        nrows = 4
+        nchan = 32
+        rng = np.random.RandomState(5)
+        cal_off = 18 + rng.rand(nrows, nchan)
+        timestamps = 55000. + np.arange(nrows) / 1000.
+        references = [(19 + rng.rand(nchan), 20., 54999.999, 30.),
+                      (19 + rng.rand(nchan), 22., 55000.01, 40.)]
+
+        expected = cal.calibrate_ps_block(None, cal_off, None, np.ones(nrows),
+                                          timestamps, references)
+        result = cal.calibrate_ps_block(None, cal_off, None, np.ones(nrows),
+                                        timestamps, cal.prepare_references(references),
+                                        smoothed=True)
+
+        np.testing.assert_almost_equal(result[0], expected[0], 10)
+        np.testing.assert_equal(result[1], expected[1])
+        np.testing.assert_equal(result[2], expected[2])
+
+    def test_nan_native(self):
+        nan_cal = Calibration(3, nan_native=True)
+        masked_cal = Calibration(3)
+        rng = np.random.RandomState(9)
+        nchan = 64
+        cal_on = (20 + rng.rand(6, nchan)).astype('f4')
+        cal_off = (18 + rng.rand(6, nchan)).astype('f4')
+        cal_on[1, 20] = np.nan
+        cal_off[2, 30:32] = np.nan
+        cal_on[2, 31] = np.nan
+
+        def check(nan_result, masked_result):
+            masked_result = np.ma.masked_invalid(masked_result)
+            np.testing.assert_equal(np.isnan(nan_result), np.ma.getmaskarray(masked_result))
+            valid = ~np.isnan(nan_result)
+            np.testing.assert_almost_equal(nan_result[valid], masked_result.data[valid], 5)
+
+        nan_tp, exposure = nan_cal.total_power(cal_on, cal_off, 1., 1.)
+        masked_tp, _ = masked_cal.total_power(np.ma.masked_invalid(cal_on), np.ma.masked_invalid(cal_off), 1., 1.)
+        assert not isinstance(nan_tp, np.ma.MaskedArray)
+        check(nan_tp, masked_tp)
+
+        for ii in range(len(cal_on)):
+            ntest.assert_almost_equal(nan_cal.tsys(1.5, cal_on[ii], cal_off[ii]),
+                                      masked_cal.tsys(1.5, np.ma.masked_invalid(cal_on[ii]),
+                                                      np.ma.masked_invalid(cal_off[ii])))
+
+        ref = nan_tp[0].astype(float)
+        for ii in range(1, len(nan_tp)):
+            nan_ta, _ = nan_cal.antenna_temp(20., nan_tp[ii], ref, 1., 1.)
+            masked_ta, _ = masked_cal.antenna_temp(20., masked_tp[ii], ref, 1., 1.)
+            check(nan_ta, masked_ta)
+
+        tsyss = np.array([20., 22.])
+        exposures = np.array([1., 2.])
+        check(nan_cal.average_spectra([nan_tp[1], nan_tp[3]], tsyss, exposures),
+              masked_cal.average_spectra([masked_tp[1], masked_tp[3]], tsyss, exposures))
+
+        # the reference average leaves out NaN channels rather than propagating them
+        nan_avg = nan_cal.getReferenceAverage(list(nan_tp), np.ones(6) * 20, np.ones(6),
+                                              np.arange(6.), np.ones(6), np.ones(6))
+        masked_avg = masked_cal.getReferenceAverage(list(masked_tp.filled(np.nan)), np.ones(6) * 20,
+                                                    np.ones(6), np.arange(6.), np.ones(6), np.ones(6))
+        valid = ~np.isnan(np.asarray(masked_avg[0]))
+        np.testing.assert_almost_equal(nan_avg[0][valid], np.asarray(masked_avg[0])[valid], 5)
+        assert not np.isnan(nan_avg[0][20])
+        ntest.assert_equal(nan_avg[1:], masked_avg[1:])
@@ -0,0 +1,54 @@
+from nose.tools import *
+
+import os
+import shutil
+import tempfile
+
+from CalibrationManifest import CalibrationManifest
+
+
+class test_CalibrationManifest:
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, CalibrationManifest.FILENAME)
+        self.manifest = CalibrationManifest(self.filename, run='this run')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_records(self):
+        eq_(self.manifest.records(), [])
+
+        self.manifest.add('b.fits', feed=1, window=0, pol=0, nchans=64, nrows=0)
+        self.manifest.add('a.fits', feed=0, window=0, pol=0, nchans=64, nrows=12,
+                          object='W51', restfreq=23.0e9)
+        # recalibrated, so the last record counts
+        self.manifest.add('b.fits', feed=1, window=0, pol=0, nchans=64, nrows=12)
+
+        records = self.manifest.records()
+        eq_([record['file'] for record in records], ['a.fits', 'b.fits'])
+        eq_(records[0]['object'], 'W51')
+        eq_(records[0]['restfreq'], 23.0e9)
+        eq_(records[1]['nrows'], 12)
+
+        eq_([record['file'] for record in self.manifest.records(['b.fits', 'c.fits'])],
+            ['b.fits'])
+
+    def test_other_runs(self):
+        CalibrationManifest(self.filename, run='earlier run').add('old.fits', nrows=5)
+        self.manifest.add('new.fits', nrows=5)
+        # a line cut short by a killed run
+        with open(self.filename, 'a') as manifest:
+            manifest.write('{"file": "cut.fits", "ru\n')
+
+        eq_([record['file'] for record in self.manifest.records()], ['new.fits'])
+
+    def test_start(self):
+        CalibrationManifest(self.filename, run='earlier run').add('old.fits', nrows=5)
+        self.manifest.start()
+        eq_(os.path.getsize(self.filename), 0)
+
+        self.manifest.add('new.fits', nrows=5)
+        eq_([record['file'] for record in self.manifest.records()], ['new.fits'])
+        eq_(len(open(self.filename).readlines()), 1)
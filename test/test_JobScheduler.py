@@ -0,0 +1,85 @@
+from nose.tools import *
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from JobScheduler import JobScheduler
+
+
+def record(filename, name):
+    with open(filename, 'a') as ff:
+        ff.write(name + '\n')
+
+
+def record_slowly(filename, name):
+    record(filename, name + '-start')
+    time.sleep(0.2)
+    record(filename, name + '-end')
+
+
+def fail():
+    raise ValueError('bad data')
+
+
+def stop():
+    sys.exit(3)
+
+
+def die():
+    os._exit(5)
+
+
+class test_JobScheduler:
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'jobs.txt')
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_order(self):
+        scheduler = JobScheduler(1)
+        for name, cost in (('small', 1), ('large', 10), ('medium', 5), ('medium2', 5)):
+            scheduler.add(name, cost, record, (self.filename, name))
+        eq_(scheduler.order(), [1, 2, 3, 0])
+
+        results = scheduler.run()
+
+        # one at a time, so they ran in order of cost
+        eq_(open(self.filename).read().split(), ['large', 'medium', 'medium2', 'small'])
+        # results are in the order the jobs were added
+        eq_([result.name for result in results], ['small', 'large', 'medium', 'medium2'])
+        eq_(set(result.status for result in results), set([JobScheduler.FINISHED]))
+
+    def test_failures(self):
+        scheduler = JobScheduler(2)
+        scheduler.add('ok', 1, record, (self.filename, 'ok'))
+        scheduler.add('exception', 1, fail)
+        scheduler.add('exit', 1, stop)
+        scheduler.add('died', 1, die)
+
+        results = scheduler.run()
+
+        eq_([result.status for result in results],
+            [JobScheduler.FINISHED, JobScheduler.FAILED, JobScheduler.FAILED, JobScheduler.FAILED])
+        eq_(results[1].message, 'ValueError: bad data')
+        eq_(results[2].message, 'exited with code 3')
+        eq_(results[3].message, 'process exited with code 5')
+        eq_(open(self.filename).read().split(), ['ok'])
+
+    def test_after(self):
+        scheduler = JobScheduler(2)
+        first = scheduler.add('first', 1, record_slowly, (self.filename, 'first'))
+        failed = scheduler.add('failed', 1, fail)
+        scheduler.add('last', 10, record, (self.filename, 'last'), after=[first, failed])
+
+        results = scheduler.run()
+
+        # the most costly job waited for the others to end, even one that failed
+        eq_(open(self.filename).read().split(), ['first-start', 'first-end', 'last'])
+        eq_([result.status for result in results],
+            [JobScheduler.FINISHED, JobScheduler.FAILED, JobScheduler.FINISHED])
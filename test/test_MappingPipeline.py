@@ -0,0 +1,91 @@
+from nose.tools import *
+import numpy as np
+import fitsio
+
+import os
+import shutil
+import tempfile
+
+from commandline import CommandLine
+from MappingPipeline import MappingPipeline
+from ObservationRows import ObservationRows
+
+
+class test_MappingPipeline:
+
+    def setup(self):
+        self.cwd = os.getcwd()
+        self.tmpdir = tempfile.mkdtemp()
+        os.chdir(self.tmpdir)
+        os.mkdir('log')
+        self.infilename = os.path.join(self.tmpdir, 'input.fits')
+
+        # one map scan of 2 integrations for a single feed, window and pol
+        nrows = 4
+        table = np.zeros(nrows, dtype=[('OBJECT', 'S8'), ('SCAN', 'i4'), ('CAL', 'S1'),
+                                       ('SIG', 'S1'), ('RESTFREQ', 'f8'), ('DATA', 'f4', 8)])
+        table['OBJECT'] = 'W51'
+        table['SCAN'] = 11
+        table['CAL'] = ['T', 'F', 'T', 'F']
+        table['SIG'] = 'T'
+
+        ff = fitsio.FITS(self.infilename, 'rw', clobber=True)
+        ff.write(table, extname='SINGLE DISH')
+        ff.close()
+
+        self.row_list = ObservationRows()
+        self.row_list.addRows(table['SCAN'], np.zeros(nrows), np.zeros(nrows), np.zeros(nrows),
+                              np.ones(nrows), np.arange(nrows), ['MAP'] * nrows,
+                              ['RALongMap'] * nrows, ['MAP'] * nrows, ['4'] * nrows)
+
+    def teardown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.tmpdir)
+        MappingPipeline.METADATA.clear()
+
+    def pipeline(self, *args):
+        cl_params = CommandLine().parser.parse_args(['-i', self.infilename, '-v', '0'] + list(args))
+        cl_params.mapscans = [11]
+        return MappingPipeline(cl_params, self.row_list, 0, 0, 0, None)
+
+    def test_incremental(self):
+        mp = self.pipeline()
+        mp.close_output(0, 0, 0)
+        outfilename = mp.outfilename
+
+        # same inputs: kept
+        mp = self.pipeline('--incremental')
+        ok_(mp.up_to_date)
+
+        # without --incremental or --clobber, an existing output stops the run
+        assert_raises(SystemExit, self.pipeline, '-u', 'ta')
+
+        # stale output, no --clobber: calibrated again
+        mp = self.pipeline('--incremental', '-u', 'ta')
+        ok_(not mp.up_to_date)
+        mp.close_output(0, 0, 0)
+        ok_(self.pipeline('--incremental', '-u', 'ta').up_to_date)
+        eq_(fitsio.read_header(outfilename, 0)['PIPEHASH'], mp.build_key)
+
+    def test_checkpoint(self):
+        rows = fitsio.read(self.infilename, ext=1)
+
+        # no checkpoint, or sync, without --resume
+        mp = self.pipeline('--clobber')
+        mp.write_outputs([rows])
+        mp.commit_scan(11, 0)
+        ok_(not mp.checkpoint.exists())
+        mp.outfile.close()
+
+        mp = self.pipeline('--clobber', '--resume')
+        mp.write_outputs([rows])
+        mp.commit_scan(11, 0)
+        ok_(mp.checkpoint.exists())
+        # stopped partway through: some rows of a scan that did not finish
+        mp.write_outputs([rows[:2]])
+        mp.outfile.close()
+
+        mp = self.pipeline('--resume')
+        eq_(mp.committed_scans, set([11]))
+        eq_(mp.nrows_written, len(rows))
+        eq_(fitsio.FITS(mp.outfilename)[1].get_nrows(), len(rows))
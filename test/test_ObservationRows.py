@@ -0,0 +1,43 @@
+from nose.tools import *
+import numpy as np
+
+from ObservationRows import ObservationRows
+
+
+class test_ObservationRows:
+
+    def setup(self):
+        self.observation = ObservationRows()
+        for row, (scan, feed) in enumerate([(12, 1), (11, 0), (12, 0), (11, 0), (12, 1)]):
+            self.observation.addRow(scan, feed, 0, 0, 1, row, 'MAP', 'RALongMap', 'MAP', '1024')
+
+    def test_get(self):
+        rows = self.observation.get(12, 1, 0, 0)
+        eq_(rows['ROW'].dtype, np.int64)
+        eq_(rows['ROW'].tolist(), [0, 4])
+        eq_(rows['EXTENSION'], 1)
+        eq_(rows['PROCNAME'], 'RALongMap')
+        eq_(rows['NCHANS'], '1024')
+        eq_(self.observation.get(11, 0, 0, 0)['ROW'].tolist(), [1, 3])
+        assert_raises(KeyError, self.observation.get, 13, 0, 0, 0)
+
+    def test_keys(self):
+        eq_(len(self.observation), 3)
+        eq_(self.observation.keys(), [(11, 0, 0, 0), (12, 0, 0, 0), (12, 1, 0, 0)])
+        eq_(self.observation.scans(), [11, 12])
+        eq_(self.observation.feeds(), [0, 1])
+        eq_(self.observation.windows(), [0])
+        eq_(self.observation.pols(), [0])
+
+    def test_addRows(self):
+        # rows added later go after the rows already there; the first row
+        #   of a key gives its extension and scan type
+        self.observation.addRows(np.array([12, 13]), [1, 0], [0, 2], [0, 1], [2, 2],
+                                 [7, 8], ['OFF', 'OFF'], ['Track', 'Track'],
+                                 ['OFF', 'OFF'], ['1024', '1024'])
+        rows = self.observation.get(12, 1, 0, 0)
+        eq_(rows['ROW'].tolist(), [0, 4, 7])
+        eq_(rows['EXTENSION'], 1)
+        eq_(self.observation.get(13, 0, 2, 1)['OBSID'], 'OFF')
+        eq_(self.observation.scans(), [11, 12, 13])
+        eq_(self.observation.windows(), [0, 2])
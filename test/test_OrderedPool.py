@@ -0,0 +1,67 @@
+from nose.tools import *
+
+import os
+import time
+
+from OrderedPool import OrderedPool
+
+# set by the initializer, in the workers only
+WORKER_PID = None
+
+
+def initialize():
+    global WORKER_PID
+    WORKER_PID = os.getpid()
+
+
+def square_slowly(item):
+    # the early items finish last
+    time.sleep(0.02 * (5 - item))
+    return item * item, WORKER_PID
+
+
+def fail_on_three(item):
+    if item == 3:
+        raise ValueError('bad item')
+    return item
+
+
+def exit_on_two(item):
+    if item == 2:
+        raise SystemExit(9)
+    return item
+
+
+class test_OrderedPool:
+
+    def test_order(self):
+        pool = OrderedPool(3, initializer=initialize)
+        results = list(pool.imap(square_slowly, range(6)))
+
+        eq_([square for square, pid in results], [0, 1, 4, 9, 16, 25])
+        pids = set(pid for square, pid in results)
+        ok_(os.getpid() not in pids)
+        ok_(None not in pids)
+        eq_(pool.workers, [])
+
+    def test_lookahead(self):
+        pool = OrderedPool(2, lookahead=1)
+        eq_(list(pool.imap(abs, [-3, 2, -1, 0])), [3, 2, 1, 0])
+
+    def test_exception(self):
+        pool = OrderedPool(2)
+        results = pool.imap(fail_on_three, range(6))
+        eq_([results.next() for _ in range(3)], [0, 1, 2])
+        assert_raises(RuntimeError, results.next)
+        eq_(pool.workers, [])
+
+    def test_exit(self):
+        pool = OrderedPool(2)
+        results = pool.imap(exit_on_two, range(6))
+        eq_([results.next() for _ in range(2)], [0, 1])
+        try:
+            results.next()
+        except SystemExit as err:
+            eq_(err.code, 9)
+        else:
+            raise AssertionError('SystemExit not raised')
@@ -26,3 +26,18 @@ def test_masked_array():
     eq_(np.isnan(masked).tolist().count(True), 0)
     np.testing.assert_equal(masked.data, unmasked)
     eq_(masked.sum(), 37.7)
+
+
+def test_dateToMjd_array():
+
+    putils = Pipeutils()
+
+    date_strings = np.array(['2009-02-10T21:09:00.10', '2009-02-10T21:09:02.1',
+                             '1899-12-31T23:59:59.999', '2014-06-18T00:00:00',
+                             '2009-02-10T21:09:00.08  '])
+    result = putils.dateToMjd_array(date_strings)
+    eq_(result.dtype, np.float64)
+    expected_result = [putils.dateToMjd(date.strip()) for date in date_strings]
+    # same values, bit for bit, as the scalar conversion
+    eq_(result.tolist(), expected_result)
+    eq_(len(putils.dateToMjd_array([])), 0)
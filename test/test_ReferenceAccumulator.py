@@ -0,0 +1,51 @@
+from nose.tools import *
+import numpy as np
+
+from Calibration import Calibration
+from ReferenceAccumulator import ReferenceAccumulator
+
+
+class test_ReferenceAccumulator:
+
+    def setup(self):
+        self.cal = Calibration()
+        rng = np.random.RandomState(11)
+        self.nint = 9
+        self.crefs = 10 + rng.rand(self.nint, 32)
+        self.crefs[4, 7] = np.nan
+        self.tsyss = 20 + rng.rand(self.nint)
+        self.exposures = 1.5 + rng.rand(self.nint)
+        self.timestamps = 55000. + np.arange(self.nint) / 1000.
+        self.tambients = 290 + rng.rand(self.nint)
+        self.elevations = 40 + rng.rand(self.nint)
+
+    def expected(self):
+        avg_tsys = self.cal.average_tsys(self.tsyss, self.exposures)
+        avg_cref = self.cal.average_spectra(self.crefs, self.tsyss, self.exposures)
+        return (avg_cref, avg_tsys, self.timestamps.mean(), self.tambients.mean(),
+                self.elevations.mean(), np.sum(self.exposures))
+
+    def check(self, result):
+        expected = self.expected()
+        np.testing.assert_equal(np.asarray(result[0]), np.asarray(expected[0]))
+        for value, expected_value in zip(result[1:], expected[1:]):
+            eq_(value, expected_value)
+
+    def test_one_at_a_time(self):
+        accumulator = ReferenceAccumulator()
+        for ii in range(self.nint):
+            accumulator.add(self.crefs[ii], self.tsyss[ii], self.exposures[ii],
+                            self.timestamps[ii], self.tambients[ii], self.elevations[ii])
+        eq_(len(accumulator), self.nint)
+        self.check(accumulator.average())
+
+    def test_blocks(self):
+        accumulator = ReferenceAccumulator()
+        for block in (slice(0, 4), slice(4, 5), slice(5, None)):
+            accumulator.add(self.crefs[block], self.tsyss[block], self.exposures[block],
+                            self.timestamps[block], self.tambients[block], self.elevations[block])
+        self.check(accumulator.average())
+
+    def test_getReferenceAverage(self):
+        self.check(self.cal.getReferenceAverage(list(self.crefs), self.tsyss, self.exposures,
+                                                self.timestamps, self.tambients, self.elevations))
@@ -0,0 +1,51 @@
+from nose.tools import *
+
+import shutil
+import tempfile
+
+import numpy as np
+
+from ReferenceCache import ReferenceCache
+
+
+class test_ReferenceCache:
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.reference = (np.ma.masked_array([1., 2., 3.], mask=[False, True, False]),
+                          20.5, 55000.25, 280.0, 45.0, 12.0)
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        eq_(ReferenceCache.key('a.fits', 14, 0, 1, 0), ReferenceCache.key('a.fits', 14, 0, 1, 0))
+        assert_not_equal(ReferenceCache.key('a.fits', 14, 0, 1, 0),
+                         ReferenceCache.key('a.fits', 14, 0, 1, 1))
+
+    def test_memory(self):
+        cache = ReferenceCache()
+        eq_(cache.get('key'), None)
+        cache.put('key', self.reference)
+        ok_(cache.get('key') is self.reference)
+
+    def test_directory(self):
+        ReferenceCache(self.tmpdir).put('key', self.reference)
+
+        # e.g. in another process, or a later run
+        reference = ReferenceCache(self.tmpdir).get('key')
+        ok_(np.ma.isMaskedArray(reference[0]))
+        eq_(list(reference[0].mask), [False, True, False])
+        eq_(list(reference[0].data), [1., 2., 3.])
+        eq_(reference[1:], self.reference[1:])
+
+        eq_(ReferenceCache(self.tmpdir).get('other key'), None)
+
+    def test_plain_array(self):
+        reference = (np.array([1., np.nan]),) + self.reference[1:]
+        ReferenceCache(self.tmpdir).put('key', reference)
+
+        spectrum = ReferenceCache(self.tmpdir).get('key')[0]
+        ok_(not np.ma.isMaskedArray(spectrum))
+        eq_(spectrum[0], 1.)
+        ok_(np.isnan(spectrum[1]))
@@ -0,0 +1,74 @@
+from nose.tools import *
+import numpy as np
+import fitsio
+
+import os
+import shutil
+import tempfile
+
+from ObservationRows import ObservationRows
+from RowDemultiplexer import RowDemultiplexer
+from SdFitsIO import SdFits
+
+
+class test_RowDemultiplexer:
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.fits')
+
+        # two scans of 3 integrations, with the feeds, pols and noise
+        #  diode states interleaved as in a GBT SDFITS file
+        rows = []
+        for scan in (11, 12):
+            for integration in range(3):
+                for feed in (0, 1):
+                    for pol in (0, 1):
+                        for cal in ('T', 'F'):
+                            rows.append((scan, feed, pol, cal))
+        self.nrows = len(rows)
+        table = np.zeros(self.nrows, dtype=[('SCAN', 'i4'), ('FDNUM', 'i2'), ('PLNUM', 'i2'),
+                                            ('CAL', 'S1'), ('DATA', 'f4', 4)])
+        for idx, row in enumerate(rows):
+            table['SCAN'][idx], table['FDNUM'][idx], table['PLNUM'][idx], table['CAL'][idx] = row
+        table['DATA'] = np.arange(self.nrows * 4).reshape((self.nrows, 4))
+
+        ff = fitsio.FITS(self.filename, 'rw', clobber=True)
+        ff.write(table)
+        ff.close()
+
+        self.row_list = ObservationRows()
+        self.row_list.addRows(table['SCAN'], table['FDNUM'], np.zeros(self.nrows), table['PLNUM'],
+                              np.ones(self.nrows), np.arange(self.nrows), ['MAP'] * self.nrows,
+                              ['RALongMap'] * self.nrows, ['MAP'] * self.nrows, ['4'] * self.nrows)
+
+        self.streams = [(feed, 0, pol) for feed in (0, 1) for pol in (0, 1)]
+        self.demux = RowDemultiplexer(self.filename, self.row_list, self.streams)
+        self.fits = fitsio.FITS(self.filename)
+
+    def teardown(self):
+        self.demux.close()
+        self.fits.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_read(self):
+        sdf = SdFits()
+        for scan in (11, 12):
+            for feed, window, pol in self.streams:
+                rows = self.row_list.get(scan, feed, window, pol)['ROW']
+                block, data = self.demux.read(scan, feed, window, pol)
+                expected, expected_data = sdf.read_scan_block(self.fits[1], rows)
+                for name in ('SCAN', 'FDNUM', 'PLNUM', 'CAL'):
+                    eq_(block[name].tolist(), expected[name].tolist())
+                np.testing.assert_equal(data, expected_data)
+
+                # part of the stream's rows
+                block, data = self.demux.read(scan, feed, window, pol, 1, 4)
+                eq_(block['CAL'].tolist(), expected['CAL'][1:4].tolist())
+                np.testing.assert_equal(data, expected_data[1:4])
+
+        # each scan was read once for all the streams
+        eq_(self.demux.nreads, 2)
+
+    def test_missing_scan(self):
+        assert_raises(KeyError, self.demux.read, 13, 0, 0, 0)
@@ -0,0 +1,45 @@
+from nose.tools import *
+
+import os
+import shutil
+import tempfile
+
+from ScanCheckpoint import ScanCheckpoint
+
+
+class test_ScanCheckpoint:
+
+    def setup(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.outfilename = os.path.join(self.tmpdir, 'map.fits')
+        self.checkpoint = ScanCheckpoint(self.outfilename)
+
+    def teardown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_last(self):
+        eq_(self.checkpoint.exists(), False)
+        eq_(self.checkpoint.last('key'), None)
+
+        self.checkpoint.add(11, 0, 12, 'key', 'ref')
+        self.checkpoint.add(12, 12, 24, 'key', 'ref')
+        eq_(self.checkpoint.filename, self.outfilename + ScanCheckpoint.SUFFIX)
+
+        record = self.checkpoint.last('key')
+        eq_((record['scan'], record['start'], record['end']), (12, 12, 24))
+        eq_(record['reference'], 'ref')
+
+        # from other inputs
+        eq_(self.checkpoint.last('other key'), None)
+
+        self.checkpoint.remove()
+        eq_(self.checkpoint.exists(), False)
+        self.checkpoint.remove()
+
+    def test_cut_record(self):
+        self.checkpoint.add(11, 0, 12, 'key')
+        # a line cut short by a killed run
+        with open(self.checkpoint.filename, 'a') as checkpoint:
+            checkpoint.write('{"build_key": "key", "end": 2')
+
+        eq_(self.checkpoint.last('key')['scan'], 11)
@@ -0,0 +1,221 @@
+from nose.tools import *
+import numpy as np
+import fitsio
+
+import os
+import shutil
+import tempfile
+
+from SdFitsIO import SdFits
+from ObservationRows import ObservationRows
+
+
+class test_SdFits:
+
+    def setup(self):
+        self.sdf = SdFits()
+        self.tmpdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tmpdir, 'test.fits')
+
+        self.nrows = 40
+        self.nchan = 8
+        table = np.zeros(self.nrows, dtype=[('SCAN', 'i4'), ('CAL', 'S1'),
+                                            ('DATA', 'f4', self.nchan)])
+        table['SCAN'] = np.arange(self.nrows)
+        table['CAL'] = ['T', 'F'] * (self.nrows / 2)
+        table['DATA'] = np.arange(self.nrows * self.nchan).reshape((self.nrows, self.nchan))
+
+        ff = fitsio.FITS(self.filename, 'rw', clobber=True)
+        ff.write(table)
+        ff.close()
+
+        self.fits = fitsio.FITS(self.filename)
+
+    def teardown(self):
+        self.fits.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_row_runs(self):
+        eq_(self.sdf.row_runs([]), [])
+        eq_(self.sdf.row_runs([3, 4, 5]), [(3, 6)])
+        eq_(self.sdf.row_runs([3, 4, 8, 9, 1]), [(3, 5), (8, 10), (1, 2)])
+
+    def test_read_scan_block_contiguous(self):
+        block, data = self.sdf.read_scan_block(self.fits[1], range(5, 15))
+        np.testing.assert_equal(block['SCAN'], np.arange(5, 15))
+        eq_(data.shape, (10, self.nchan))
+        np.testing.assert_equal(data[0], np.arange(5 * self.nchan, 6 * self.nchan))
+
+    def test_read_scan_block_runs(self):
+        rows = [7, 8, 2, 3, 30]
+        block, data = self.sdf.read_scan_block(self.fits[1], rows, ('SCAN', 'DATA'))
+        np.testing.assert_equal(block['SCAN'], rows)
+        eq_(block.dtype.names, ('SCAN', 'DATA'))
+        np.testing.assert_equal(data[:, 0], np.array(rows) * self.nchan)
+
+    def test_read_scan_block_scattered(self):
+        rows = range(0, self.nrows, 2)
+        block, data = self.sdf.read_scan_block(self.fits[1], rows)
+        np.testing.assert_equal(block['SCAN'], rows)
+        np.testing.assert_equal(block['CAL'], ['T'] * len(rows))
+        eq_(data.shape, (len(rows), self.nchan))
+
+    def test_read_scan_block_no_data(self):
+        block, data = self.sdf.read_scan_block(self.fits[1], [1, 2], ('CAL',))
+        eq_(data, None)
+        np.testing.assert_equal(block['CAL'], ['F', 'T'])
+
+    def test_read_metadata(self):
+        metadata = self.sdf.read_metadata(self.fits[1])
+        # only the scalar columns present in the table are read
+        eq_(metadata.dtype.names, ('CAL',))
+        eq_(len(metadata), self.nrows)
+        np.testing.assert_equal(metadata['CAL'][[1, 2]], ['F', 'T'])
+
+    def write_index(self, rows, newline='\n', last_newline=True):
+        header = '%6s%4s%6s%12s%8s%9s%6s%6s%6s%8s%14s' % ('SCAN', 'EXT', 'ROW', 'PROCEDURE',
+                                                          'OBSID', 'PROCSCAN', 'FDNUM', 'IFNUM',
+                                                          'PLNUM', 'NUMCHN', 'RESTFREQ')
+        lines = ['[header]', 'version = 1.7', '[rows]', header]
+        lines += ['%6d%4d%6d%12s%8s%9s%6d%6d%6d%8d%14s' % row for row in rows]
+        indexname = os.path.join(self.tmpdir, 'test.index')
+        with open(indexname, 'w') as indexfile:
+            indexfile.write(newline.join(lines) + (newline if last_newline else ''))
+        return indexname
+
+    def index_rows(self):
+        rows = []
+        for scan, procname in ((1, 'Track'), (2, 'RALongMap'), (3, 'Unknown'), (4, 'RALongMap')):
+            for integration in range(3):
+                for feed in range(2):
+                    rows.append((scan, 1, len(rows), procname, 'MAP', 'MAP', feed,
+                                 0, 0, 1024, '2.3e+10'))
+        # the rest of scan 4 is suspect
+        rows[-1] = rows[-1][:3] + ('unknown',) + rows[-1][4:]
+        rows.append((4, 1, len(rows), 'RALongMap', 'MAP', 'MAP', 0, 0, 0, 1024, '2.3e+10'))
+        return rows
+
+    def check_same_rows(self, observation, expected):
+        eq_(observation.keys(), expected.keys())
+        for key in expected.keys():
+            rows, expected_rows = observation.get(*key), expected.get(*key)
+            eq_(rows['ROW'].tolist(), expected_rows['ROW'].tolist())
+            del rows['ROW'], expected_rows['ROW']
+            eq_(rows, expected_rows)
+
+    def test_parseSdfitsIndex(self):
+        rows = self.index_rows()
+        indexname = self.write_index(rows)
+
+        observation, summary = self.sdf.parseSdfitsIndex(indexname, mapscans=None)
+        eq_(observation.scans(), [1, 2, 4])
+        eq_(observation.keys()[:2], [(1, 0, 0, 0), (1, 1, 0, 0)])
+        eq_(observation.get(2, 1, 0, 0)['ROW'].tolist(), [7, 9, 11])
+        # rows of scan 4 from the first "Unknown" procedure on are skipped
+        eq_(observation.get(4, 0, 0, 0)['ROW'].tolist(), [18, 20, 22])
+        eq_(observation.get(4, 1, 0, 0)['ROW'].tolist(), [19, 21])
+        eq_(observation.get(1, 0, 0, 0)['PROCNAME'], 'Track')
+        eq_(observation.get(1, 0, 0, 0)['NCHANS'], '1024')
+        eq_(summary, {'WINDOWS': set([(0, 23.0)]), 'FEEDS': set(['0', '1'])})
+
+        # the same result for rows that are not all the same length
+        for newline, last_newline in (('\r\n', True), ('\n', False)):
+            other, other_summary = self.sdf.parseSdfitsIndex(self.write_index(rows, newline, last_newline))
+            self.check_same_rows(other, observation)
+            eq_(other_summary, summary)
+        lines = open(indexname).read().split('\n')
+        lines[6] += '  '
+        with open(indexname, 'w') as indexfile:
+            indexfile.write('\n'.join(lines))
+        ragged, ragged_summary = self.sdf.parseSdfitsIndex(indexname)
+        self.check_same_rows(ragged, observation)
+        eq_(ragged_summary, summary)
+
+    def test_index_cache(self):
+        rows = self.index_rows()
+        indexname = self.write_index(rows)
+        cachename = self.sdf.index_cache_name(indexname)
+
+        observation, summary = self.sdf.parseSdfitsIndex(indexname)
+        assert os.path.exists(cachename)
+
+        # the second read comes from the cache
+        cached, cached_summary = self.sdf.parseSdfitsIndex(indexname)
+        self.check_same_rows(cached, observation)
+        eq_(cached_summary, summary)
+
+        # a changed index file is parsed again
+        rows = rows[:12]
+        indexname = self.write_index(rows)
+        os.utime(indexname, (0, 0))
+        changed, _ = self.sdf.parseSdfitsIndex(indexname)
+        eq_(changed.scans(), [1, 2])
+
+        # so is one with a damaged cache
+        with open(cachename, 'w') as cachefile:
+            cachefile.write('not a cache')
+        damaged, _ = self.sdf.parseSdfitsIndex(indexname)
+        self.check_same_rows(damaged, changed)
+
+        uncached, _ = self.sdf.parseSdfitsIndex(indexname, use_cache=False)
+        self.check_same_rows(uncached, changed)
+
+    def test_buildSdfitsIndex(self):
+        # the index rows, split over two FITS extensions
+        rows = self.index_rows()
+        split = 9
+        rows = rows[:split] + [row[:1] + (2, row[2] - split) + row[3:] for row in rows[split:]]
+        observation, summary = self.sdf.parseSdfitsIndex(self.write_index(rows), use_cache=False)
+
+        fitsname = os.path.join(self.tmpdir, 'index.fits')
+        table = np.zeros(len(rows), dtype=[('SCAN', 'i4'), ('OBSMODE', 'S32'), ('OBSID', 'S32'),
+                                           ('PROCSCAN', 'S16'), ('FDNUM', 'i2'), ('IFNUM', 'i2'),
+                                           ('PLNUM', 'i2'), ('RESTFREQ', 'f8'), ('DATA', 'f4', 1024)])
+        for idx, row in enumerate(rows):
+            table['SCAN'][idx] = row[0]
+            table['OBSMODE'][idx] = row[3] + ':PSWITCHON:TPWCAL'
+            table['OBSID'][idx], table['PROCSCAN'][idx] = row[4], row[5]
+            table['FDNUM'][idx], table['IFNUM'][idx], table['PLNUM'][idx] = row[6:9]
+            table['RESTFREQ'][idx] = float(row[10])
+        ff = fitsio.FITS(fitsname, 'rw', clobber=True)
+        ff.write(table[:split])
+        ff.write(table[split:])
+        ff.close()
+
+        built, built_summary = self.sdf.buildSdfitsIndex(fitsname)
+        self.check_same_rows(built, observation)
+        eq_(built_summary, summary)
+
+        # a written index file parses to the same rows
+        indexname = os.path.join(self.tmpdir, 'index.index')
+        written, _ = self.sdf.buildSdfitsIndex(fitsname, indexname)
+        assert os.path.exists(self.sdf.index_cache_name(indexname))
+        parsed, parsed_summary = self.sdf.parseSdfitsIndex(indexname, use_cache=False)
+        self.check_same_rows(parsed, observation)
+        eq_(parsed_summary, summary)
+
+    def test_find_maps_in_rows(self):
+        # scan: (OBSID, PROCNAME, PROCSCAN)
+        scantypes = {1: ('', 'OnOff', 'OFF'),
+                     2: ('', 'RALongMap', 'MAP'),
+                     3: ('', 'RALongMap', 'MAP'),
+                     4: ('', 'OnOff', 'OFF'),
+                     5: ('Unknown', 'Nod', ''),
+                     6: ('', 'DecLatMap', 'MAP'),
+                     7: ('', 'DecLatMap', 'MAP'),
+                     9: ('off', '', ''),
+                     10: ('map', '', '')}
+        observation = ObservationRows()
+        scans = sorted(scantypes) * 2
+        feeds = [1] * len(scantypes) + [0] * len(scantypes)
+        observation.addRows(scans, feeds, [0] * len(scans), [0] * len(scans),
+                            [1] * len(scans), range(len(scans)),
+                            [scantypes[scan][0] for scan in scans],
+                            [scantypes[scan][1] for scan in scans],
+                            [scantypes[scan][2] for scan in scans],
+                            ['1024'] * len(scans))
+
+        maps = self.sdf.find_maps_in_rows(observation)
+        eq_([tuple(mm) for mm in maps], [(1, [2, 3], 4), (4, [6, 7], 9), (9, [10], False)])
+        eq_(maps[0].refscan1, 1)
+        eq_(self.sdf.find_maps_in_rows(ObservationRows()), [])
@@ -0,0 +1,66 @@
+from nose.tools import *
+import numpy as np
+
+import multiprocessing
+
+from SharedScanBuffer import SharedScanBuffer
+
+
+def read_scans(buffer, worker, stream, scans, results):
+    buffer.open_reader(worker)
+    try:
+        for scan in scans:
+            buffer.next_scan(scan)
+            block, data = buffer.read(scan, *stream)
+            results.put((worker, scan, block['SCAN'].tolist(), data.tolist()))
+    finally:
+        buffer.finish()
+
+
+class test_SharedScanBuffer:
+
+    def setup(self):
+        self.dtype = [('SCAN', 'i4'), ('DATA', 'f4', 2)]
+        self.streams = [(0, 0, 0), (0, 0, 1)]
+
+    def scan_block(self, scan):
+        block = np.zeros(4, dtype=self.dtype)
+        block['SCAN'] = scan
+        block['DATA'] = np.arange(8).reshape((4, 2)) + 10 * scan
+        # the streams' rows alternate
+        index = {self.streams[0]: (1, np.array([0, 2])),
+                 self.streams[1]: (1, np.array([1, 3]))}
+        return {1: block}, index
+
+    def test_workers(self):
+        scans = [11, 12, 13]
+        buffer = SharedScanBuffer(len(self.streams), self.scan_block(11)[0][1].nbytes)
+        results = multiprocessing.Queue()
+
+        # the second worker stops after the first scan
+        workers = [multiprocessing.Process(target=read_scans,
+                                           args=(buffer, 0, self.streams[0], scans, results)),
+                   multiprocessing.Process(target=read_scans,
+                                           args=(buffer, 1, self.streams[1], scans[:1], results))]
+        for worker in workers:
+            worker.start()
+        buffer.processes = workers
+
+        # more scans than slots, so the buffer is reused
+        for scan in scans:
+            blocks, index = self.scan_block(scan)
+            buffer.put(scan, blocks, index)
+        buffer.close()
+        for worker in workers:
+            worker.join()
+
+        got = sorted(results.get(timeout=10) for _ in range(4))
+        eq_(got, [(0, 11, [11, 11], [[110., 111.], [114., 115.]]),
+                  (0, 12, [12, 12], [[120., 121.], [124., 125.]]),
+                  (0, 13, [13, 13], [[130., 131.], [134., 135.]]),
+                  (1, 11, [11, 11], [[112., 113.], [116., 117.]])])
+
+    def test_scan_too_big(self):
+        buffer = SharedScanBuffer(1, 8)
+        blocks = {1: np.zeros(100, dtype=self.dtype)}
+        assert_raises(ValueError, buffer.put, 11, blocks, {})
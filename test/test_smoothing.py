@@ -142,3 +142,43 @@ class test_smoothing:
                                             0.59842368,  0.60177253,  0.62984484,  0.67057223,  0.67057223,
                                             0.67057223,  0.67057223,  0.67057223,  0.67057223,  0.67057223])
         np.testing.assert_almost_equal(boxcar(self.unsmoothed, 7), expected_result_kernel7)
+
+    def convolve_reference(self, spectrum, kernel):
+        result = np.convolve(spectrum, kernel, mode='same')
+        width = len(kernel)
+        result[0:width] = result[width]
+        result[-width:] = result[-width]
+        return result
+
+    def test_boxcar_block(self):
+        block = np.array([self.unsmoothed, self.unsmoothed[::-1], self.unsmoothed * 2])
+        block[1, 50] = np.nan
+        for window in (3, 4, 25):
+            smoothed = boxcar(block, window)
+            for row, spectrum in zip(smoothed, block):
+                expected = self.convolve_reference(spectrum, np.ones(window) / float(window))
+                np.testing.assert_equal(np.isnan(row), np.isnan(expected))
+                np.testing.assert_almost_equal(row[~np.isnan(row)], expected[~np.isnan(expected)])
+
+    def test_kernels(self):
+        np.testing.assert_almost_equal(hanning_kernel(3), [.25, .5, .25])
+        kernel = gaussian_kernel(4)
+        assert_almost_equal(kernel.sum(), 1)
+        assert_almost_equal(kernel[len(kernel) // 2 + 2] / kernel.max(), .5)
+
+    def test_convolve(self):
+        block = np.array([self.unsmoothed, self.unsmoothed[::-1]])
+        block[0, 40] = np.nan
+        # a narrow kernel is applied directly, a wide one with FFTs
+        for kernel in (hanning_kernel(5), hanning_kernel(FFT_MIN_KERNEL)):
+            smoothed = convolve(block, kernel)
+            for row, spectrum in zip(smoothed, block):
+                expected = self.convolve_reference(spectrum, kernel)
+                np.testing.assert_equal(np.isnan(row), np.isnan(expected))
+                np.testing.assert_almost_equal(row[~np.isnan(row)], expected[~np.isnan(expected)])
+
+    def test_smooth(self):
+        np.testing.assert_equal(smooth(self.unsmoothed, 5), boxcar(self.unsmoothed, 5))
+        np.testing.assert_equal(smooth(self.unsmoothed, 5, 'gaussian'),
+                                convolve(self.unsmoothed, gaussian_kernel(5)))
+        assert_raises(ValueError, smooth, self.unsmoothed, 5, 'tophat')